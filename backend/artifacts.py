@@ -0,0 +1,154 @@
+"""Short-lived download artifacts (XLSX/CSV/JSON) rendered lazily on first fetch"""
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_TTL_SECONDS = float(os.getenv("ARTIFACT_TTL_SECONDS", "900"))
+ARTIFACT_MAX_ENTRIES = int(os.getenv("ARTIFACT_MAX_ENTRIES", "500"))
+# Directory shared by all worker processes (multi-worker deployments); empty keeps artifacts in this process
+ARTIFACT_STORE_PATH = os.getenv("ARTIFACT_STORE_PATH", "")
+
+MEDIA_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "json": "application/json"
+}
+
+
+class ArtifactStore:
+    """Keeps the calculated data of recent requests; renders each format once, on demand"""
+
+    def __init__(self, renderers: dict, ttl_seconds: float = ARTIFACT_TTL_SECONDS, max_entries: int = ARTIFACT_MAX_ENTRIES):
+        self.renderers = renderers
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def put(self, data, company_name: str) -> str:
+        artifact_id = uuid.uuid4().hex
+        with self._lock:
+            self._evict()
+            self._entries[artifact_id] = {
+                "data": data,
+                "company_name": company_name,
+                "created_at": time.time(),
+                "rendered": {}
+            }
+        return artifact_id
+
+    def render(self, artifact_id: str, fmt: str):
+        """Bytes for one format of an artifact, or None when unknown/expired"""
+        if fmt not in self.renderers:
+            raise ValueError(f"Unsupported artifact format: {fmt}")
+        with self._lock:
+            self._evict()
+            entry = self._entries.get(artifact_id)
+        if entry is None:
+            return None
+        rendered = entry["rendered"].get(fmt)
+        if rendered is None:
+            rendered = self.renderers[fmt](entry["data"], entry["company_name"])
+            entry["rendered"][fmt] = rendered
+        return rendered
+
+    def links(self, artifact_id: str) -> dict:
+        return {fmt: f"/artifacts/{artifact_id}.{fmt}" for fmt in self.renderers}
+
+    def _evict(self):
+        now = time.time()
+        expired = [key for key, entry in self._entries.items() if now - entry["created_at"] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+        while len(self._entries) >= self.max_entries:
+            oldest = min(self._entries, key=lambda key: self._entries[key]["created_at"])
+            del self._entries[oldest]
+
+
+class DiskArtifactStore(ArtifactStore):
+    """ArtifactStore in a directory, so any worker process can serve an artifact another one created.
+
+    Each artifact is <id>.pkl (its data and company name) plus one file per
+    rendered format. Files are written under a temporary name and renamed
+    into place, so a concurrent reader never sees half a file; two workers
+    rendering the same format at once both write the same bytes.
+    """
+
+    def __init__(self, renderers: dict, path: str, ttl_seconds: float = ARTIFACT_TTL_SECONDS,
+                 max_entries: int = ARTIFACT_MAX_ENTRIES):
+        super().__init__(renderers, ttl_seconds, max_entries)
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def put(self, data, company_name: str) -> str:
+        artifact_id = uuid.uuid4().hex
+        with self._lock:
+            self._evict()
+        self._write(f"{artifact_id}.pkl", pickle.dumps((data, company_name), protocol=pickle.HIGHEST_PROTOCOL))
+        return artifact_id
+
+    def render(self, artifact_id: str, fmt: str):
+        if fmt not in self.renderers:
+            raise ValueError(f"Unsupported artifact format: {fmt}")
+        # The id names files, so only ever accept what put() generates
+        if not re.fullmatch(r"[0-9a-f]{32}", artifact_id):
+            return None
+        source = os.path.join(self.path, f"{artifact_id}.pkl")
+        try:
+            if time.time() - os.path.getmtime(source) > self.ttl_seconds:
+                return None
+            try:
+                with open(os.path.join(self.path, f"{artifact_id}.{fmt}"), "rb") as rendered:
+                    return rendered.read()
+            except FileNotFoundError:
+                pass
+            with open(source, "rb") as stored:
+                data, company_name = pickle.load(stored)
+        except FileNotFoundError:
+            return None
+        rendered = self.renderers[fmt](data, company_name)
+        self._write(f"{artifact_id}.{fmt}", rendered)
+        return rendered
+
+    def _write(self, name: str, content: bytes):
+        temporary = os.path.join(self.path, f".{name}.{uuid.uuid4().hex}.tmp")
+        with open(temporary, "wb") as output:
+            output.write(content)
+        os.replace(temporary, os.path.join(self.path, name))
+
+    def _evict(self):
+        now = time.time()
+        artifacts = []
+        for entry in os.scandir(self.path):
+            try:
+                if entry.name.endswith(".pkl"):
+                    artifacts.append((entry.stat().st_mtime, entry.name[:-4]))
+                elif entry.name.endswith(".tmp") and now - entry.stat().st_mtime > self.ttl_seconds:
+                    # Left behind by a worker that died mid-write
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+        artifacts.sort()
+        expired = [artifact_id for mtime, artifact_id in artifacts if now - mtime > self.ttl_seconds]
+        oldest = [artifact_id for _, artifact_id in artifacts[len(expired):]]
+        expired += oldest[:max(0, len(oldest) - self.max_entries + 1)]
+        for artifact_id in expired:
+            for suffix in ["pkl"] + list(self.renderers):
+                try:
+                    os.remove(os.path.join(self.path, f"{artifact_id}.{suffix}"))
+                except FileNotFoundError:
+                    pass
+
+
+def create_artifact_store(renderers: dict) -> ArtifactStore:
+    """In-process store, or the shared directory at ARTIFACT_STORE_PATH"""
+    if ARTIFACT_STORE_PATH:
+        logger.info(f"✅ Using shared artifact directory {ARTIFACT_STORE_PATH}")
+        return DiskArtifactStore(renderers, ARTIFACT_STORE_PATH)
+    return ArtifactStore(renderers)
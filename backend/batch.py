@@ -0,0 +1,62 @@
+"""Helpers for the multi-file /process/batch endpoint"""
+import logging
+import os
+import re
+import zipfile
+from io import BytesIO
+
+from uploads import MAX_BATCH_UPLOAD_BYTES, MAX_UPLOAD_BYTES, UploadTooLarge
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "100"))
+
+IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'pdf')
+CONTENT_TYPES = {
+    'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg',
+    'gif': 'image/gif', 'bmp': 'image/bmp', 'tiff': 'image/tiff', 'pdf': 'application/pdf'
+}
+
+
+def is_zip_upload(filename: str, content_type: str) -> bool:
+    return filename.lower().endswith('.zip') or content_type in ('application/zip', 'application/x-zip-compressed')
+
+
+def expand_zip(zip_bytes: bytes, zip_name: str) -> list:
+    """(filename, bytes, content_type) for every image inside a ZIP archive"""
+    files = []
+    with zipfile.ZipFile(BytesIO(zip_bytes)) as archive:
+        # Checked against the declared sizes before anything is inflated
+        images = [info for info in archive.infolist() if not info.is_dir()]
+        oversized = next((info for info in images if info.file_size > MAX_UPLOAD_BYTES), None)
+        if oversized is not None:
+            raise UploadTooLarge(f"{oversized.filename} in {zip_name} is {oversized.file_size / 2 ** 20:.1f} MB, "
+                                 f"the limit is {MAX_UPLOAD_BYTES / 2 ** 20:.0f} MB")
+        if sum(info.file_size for info in images) > MAX_BATCH_UPLOAD_BYTES:
+            raise UploadTooLarge(f"{zip_name} expands past {MAX_BATCH_UPLOAD_BYTES / 2 ** 20:.0f} MB")
+        for info in archive.infolist():
+            name = info.filename
+            base = os.path.basename(name)
+            if info.is_dir() or name.startswith('__MACOSX/') or base.startswith('.'):
+                continue
+            extension = base.rsplit('.', 1)[-1].lower() if '.' in base else ''
+            if extension not in IMAGE_EXTENSIONS:
+                logger.warning(f"⚠️ Skipping non-image {name} in {zip_name}")
+                continue
+            files.append((base, archive.read(info), CONTENT_TYPES[extension]))
+    return files
+
+
+def unique_sheet_name(filename: str, used: set) -> str:
+    """Excel-safe sheet name (<= 31 chars, no []:*?/\\) that is not already in used"""
+    base = re.sub(r'[\[\]:*?/\\]', '_', os.path.splitext(filename)[0]).strip("' ") or "Sheet"
+    base = base[:31]
+    name = base
+    counter = 2
+    while name.lower() in used or name.lower() == 'consolidated':
+        suffix = f" ({counter})"
+        name = base[:31 - len(suffix)] + suffix
+        counter += 1
+    used.add(name.lower())
+    return name
@@ -0,0 +1,112 @@
+"""Benchmark the CPU pool: result-building throughput by pool size, and event-loop stalls while it runs.
+
+Usage (from backend/):
+    python bench/bench_cpu_pool.py
+    python bench/bench_cpu_pool.py --records 5000 --cards 32 --pools 0,1,2,4,8
+
+Builds the full response outputs (formulas, DataFrame, workbook, base64,
+CSV, indented JSON) for --cards synthetic cards of --records rows at once:
+inline on the event loop (how process_files used to run them), on a thread
+(CPU_POOL_WORKERS=0) and in process pools of each --pools size. A 10 ms
+ticker runs on the loop meanwhile; its worst overshoot is how long any other
+request would have waited. Throughput only scales while pool processes have
+cores of their own: on a machine with N cores expect roughly min(N, pool)x
+the single-process rate.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cpu_pool import CPUPool, build_outputs
+
+SEGMENTS = ["TW TP", "TW SAOD + COMP", "PVT CAR TP", "PVT CAR COMP + SAOD", "TAXI", "SCHOOL BUS", "STAFF BUS"]
+OUTPUTS = ("excel", "csv", "json")
+TICK_SECONDS = 0.01
+
+
+def make_card(records: int, seed: int) -> list:
+    rng = random.Random(seed)
+    return [
+        {"segment": rng.choice(SEGMENTS), "policy_type": rng.choice(("Comp", "TP")), "location": f"CLUSTER {row}",
+         "payin": f"{rng.randint(5, 95)}.{rng.choice((0, 5))}%", "remark": rng.choice(("", "Other make", "Upto 2 years"))}
+        for row in range(records)
+    ]
+
+
+async def ticker(stop: asyncio.Event) -> float:
+    """Largest delay past its 10 ms sleep the event loop made a waiting task suffer"""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        worst = max(worst, time.perf_counter() - started - TICK_SECONDS)
+    return worst
+
+
+async def run_mode(cards: list, formula_data: list, rules_version: str, pool) -> tuple:
+    stop = asyncio.Event()
+    lag = asyncio.create_task(ticker(stop))
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    if pool is None:
+        # The old path: everything on the event loop
+        for card in cards:
+            build_outputs(card, formula_data, rules_version, "Bench", OUTPUTS)
+            await asyncio.sleep(0)
+    else:
+        await asyncio.gather(*(pool.run(build_outputs, card, formula_data, rules_version, "Bench", OUTPUTS) for card in cards))
+    seconds = time.perf_counter() - started
+    stop.set()
+    return seconds, await lag
+
+
+async def run(args):
+    import main as backend
+
+    cards = [make_card(args.records, seed) for seed in range(args.cards)]
+    formula_data, rules_version = backend.FORMULA_DATA, backend.RULES_VERSION
+    print(f"{args.cards} cards x {args.records} records, {os.cpu_count()} CPU(s)")
+
+    modes = [("inline (event loop)", None), ("thread", CPUPool(0))]
+    modes += [(f"{size} process{'es' if size > 1 else ''}", CPUPool(size)) for size in args.pools]
+    baseline = None
+    for name, pool in modes:
+        # One untimed round so imports, the compiled rules and openpyxl's styles are loaded in every process
+        if pool is None:
+            build_outputs(cards[0], formula_data, rules_version, "Bench", OUTPUTS)
+        else:
+            await pool.warm()
+            await asyncio.gather(*(pool.run(build_outputs, cards[0], formula_data, rules_version, "Bench", OUTPUTS)
+                                   for _ in range(max(1, pool.workers))))
+        seconds, worst_lag = await run_mode(cards, formula_data, rules_version, pool)
+        rate = args.cards / seconds
+        baseline = baseline or rate
+        print(f"{name:22s} {seconds:6.2f}s  {rate:6.2f} cards/s ({rate / baseline:4.2f}x)  "
+              f"worst loop stall {worst_lag * 1000:7.1f} ms")
+        if pool is not None:
+            pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--cards", type=int, default=16)
+    parser.add_argument("--pools", default=None, help="comma-separated pool sizes (default: 1, 2, 4 up to the CPU count)")
+    args = parser.parse_args()
+    cores = os.cpu_count() or 1
+    args.pools = [int(size) for size in args.pools.split(",")] if args.pools else \
+        sorted({1, 2, cores} | {size for size in (4, 8) if size <= cores})
+
+    import logging
+    logging.disable(logging.WARNING)
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
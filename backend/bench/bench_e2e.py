@@ -0,0 +1,236 @@
+"""End-to-end benchmark of /process and process_files at varied concurrency and record counts.
+
+Usage (from backend/):
+    python bench/bench_e2e.py                                   # synthetic replies, 10/100/1000 records
+    python bench/bench_e2e.py --records 100 --concurrency 1 8 32 --latency 1.0
+    python bench/bench_e2e.py --fixtures bench/fixtures/corpus --images samples/*.png
+    python bench/bench_e2e.py --output bench/results/$(git rev-parse --short HEAD).json
+    python bench/bench_e2e.py --compare bench/results/abc1234.json
+
+No key or network is needed: model calls are answered in-process, either
+with synthetic replies of N records or from a corpus recorded with
+bench/replay.py, after --latency seconds. "http" cases drive /process on a
+local uvicorn server; "direct" cases call process_files. Every case reports
+throughput, p50/p95/p99 latency and response bytes. Direct cases also report
+peak traced allocations for one request. Results are written as JSON, so
+runs on different commits can be compared with --compare.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Measure the pipeline, not the cache or the local OCR engine
+os.environ.setdefault("RESULT_CACHE_BACKEND", "none")
+os.environ.setdefault("LOCAL_OCR", "off")
+
+from fakes import SAMPLE_RECORDS, chat_completion, chat_completion_chunk, make_png, prompt_text
+from replay import FixtureStore, ReplayClient
+
+
+class SyntheticStore:
+    """Fixture source that answers every extraction with the same N records"""
+
+    def __init__(self, record_count: int):
+        records = [dict(SAMPLE_RECORDS[i % len(SAMPLE_RECORDS)], location=f"LOCATION {i}") for i in range(record_count)]
+        payload = json.dumps(records)
+        pieces = ["["] + [json.dumps(r) + ("," if i < len(records) - 1 else "") for i, r in enumerate(records)] + ["]"]
+        self.extraction = {
+            "response": chat_completion(payload, prompt_tokens=2000, completion_tokens=len(payload) // 4),
+            "chunks": [chat_completion_chunk(piece) for piece in pieces] + [chat_completion_chunk("", finish_reason="stop")]
+        }
+        self.layout = {"response": chat_completion("other", prompt_tokens=170, completion_tokens=1), "chunks": []}
+
+    def load(self, request: dict) -> dict:
+        return self.layout if prompt_text(request).startswith("Which layout") else self.extraction
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(case: dict, latencies: list, wall: float, response_bytes: list) -> dict:
+    return {
+        **case,
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / wall, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1),
+        "response_bytes": round(statistics.mean(response_bytes))
+    }
+
+
+async def run_http(url: str, uploads: list, concurrency: int, requests: int) -> tuple:
+    import httpx
+
+    latencies, sizes = [], []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(http, index):
+        name, image = uploads[index % len(uploads)]
+        async with gate:
+            started = time.perf_counter()
+            response = await http.post(f"{url}/process", data={"company_name": "Liberty"},
+                                       files={"policy_file": (name, image, "image/png")})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+            sizes.append(len(response.content))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=None, limits=limits) as http:
+        # Warm-up: lazy imports and the first connection stay out of the numbers
+        await one(http, 0)
+        latencies.clear()
+        sizes.clear()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(http, i) for i in range(requests)))
+        wall = time.perf_counter() - started
+    return latencies, wall, sizes
+
+
+async def run_direct(backend, uploads: list, concurrency: int, requests: int) -> tuple:
+    latencies, sizes = [], []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(index):
+        name, image = uploads[index % len(uploads)]
+        async with gate:
+            started = time.perf_counter()
+            result = await backend.process_files(image, name, "image/png", "Liberty", response_format="slim")
+            latencies.append(time.perf_counter() - started)
+            sizes.append(len(json.dumps(result)))
+
+    await one(0)
+    latencies.clear()
+    sizes.clear()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies, time.perf_counter() - started, sizes
+
+
+async def run_direct_cases(backend, uploads: list, concurrencies: list, requests: int) -> list:
+    """(concurrency, latencies, wall, sizes, alloc peak) per level, all on one event loop"""
+    runs = []
+    for concurrency in concurrencies:
+        count = requests or max(8, 4 * concurrency)
+        latencies, wall, sizes = await run_direct(backend, uploads, concurrency, count)
+        runs.append((concurrency, latencies, wall, sizes, await traced_peak_mb(backend, uploads[0])))
+    return runs
+
+
+async def traced_peak_mb(backend, upload: tuple) -> float:
+    """Peak Python allocations while one request runs through process_files"""
+    name, image = upload
+    tracemalloc.start()
+    try:
+        await backend.process_files(image, name, "image/png", "Liberty", response_format="slim")
+        return round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+    finally:
+        tracemalloc.stop()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(results: dict, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as handle:
+        baseline = json.load(handle)
+    key = lambda case: (case["mode"], case["corpus"], case["records"], case["concurrency"])
+    previous = {key(case): case for case in baseline["cases"]}
+    print(f"\nvs {baseline['commit']} ({os.path.basename(baseline_path)})")
+    for case in results["cases"]:
+        old = previous.get(key(case))
+        if old is None:
+            continue
+        deltas = "  ".join(
+            f"{metric} {100 * (case[metric] - old[metric]) / old[metric]:+6.1f}%"
+            for metric in ("throughput_rps", "p50_ms", "p95_ms", "response_bytes") if old.get(metric)
+        )
+        print(f"{case['mode']:6s} {case['corpus']:10s} {case['records']!s:6} x{case['concurrency']:<4} {deltas}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=0, help="requests per case (default 4 x concurrency, at least 8)")
+    parser.add_argument("--latency", type=float, default=0.5, help="simulated model latency per call, seconds")
+    parser.add_argument("--modes", nargs="+", default=["http", "direct"], choices=["http", "direct"])
+    parser.add_argument("--fixtures", help="replay a corpus recorded with bench/replay.py instead of synthetic replies")
+    parser.add_argument("--images", nargs="*", default=[], help="the corpus images (with --fixtures)")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--compare", help="baseline results JSON to diff against")
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.WARNING)
+    import main as backend
+    from fakes import BackgroundServer
+
+    if args.fixtures:
+        corpora = [("recorded", None, FixtureStore(args.fixtures),
+                    [(os.path.basename(path), open(path, "rb").read()) for path in args.images])]
+    else:
+        # Distinct images per request, so nothing downstream can dedupe them
+        images = [(f"card_{i}.png", make_png(64, 64, shade=i % 256)) for i in range(64)]
+        corpora = [("synthetic", count, SyntheticStore(count), images) for count in args.records]
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "latency": args.latency,
+        "cases": []
+    }
+    with BackgroundServer(backend.app) as api:
+        for corpus, record_count, store, uploads in corpora:
+            backend.set_openai_client(ReplayClient(store, latency=args.latency))
+            runs = []
+            if "http" in args.modes:
+                for concurrency in args.concurrency:
+                    count = args.requests or max(8, 4 * concurrency)
+                    runs.append(("http", concurrency, *asyncio.run(run_http(api.url, uploads, concurrency, count)), None))
+            if "direct" in args.modes:
+                runs.extend(("direct", *run) for run in asyncio.run(
+                    run_direct_cases(backend, uploads, args.concurrency, args.requests)
+                ))
+
+            for mode, concurrency, latencies, wall, sizes, alloc_peak in runs:
+                case = summarize({"mode": mode, "corpus": corpus, "records": record_count, "concurrency": concurrency},
+                                 latencies, wall, sizes)
+                if alloc_peak is not None:
+                    case["alloc_peak_mb"] = alloc_peak
+                results["cases"].append(case)
+                print(f"{mode:6s} {corpus:10s} records={record_count or '-'!s:6s} x{concurrency:<4} "
+                      f"{case['throughput_rps']:8.2f} req/s  p50 {case['p50_ms']:8.1f}ms  p95 {case['p95_ms']:8.1f}ms  "
+                      f"p99 {case['p99_ms']:8.1f}ms  {case['response_bytes']:9d} B"
+                      + (f"  alloc peak {alloc_peak:.1f} MB" if alloc_peak is not None else ""))
+    backend.set_openai_client(None)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=1)
+        print(f"\nWrote {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark Excel export: pandas ExcelWriter + per-cell styling (old) vs write-only streaming export.
+
+Usage (from backend/):
+    python bench/bench_excel.py --rows 1000 10000 100000
+
+Every (builder, rows) case runs in a fresh subprocess so peak RSS is not
+polluted by the previous case.
+"""
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+COLUMNS = ['segment', 'policy type', 'location', 'payin', 'remark', 'Calculated Payout', 'Formula Used', 'Rule Explanation']
+
+
+def make_rows(count: int) -> list:
+    return [{
+        'segment': 'TW TP', 'policy type': 'TP', 'location': f'RTO LOCATION {i}',
+        'payin': f"{20 + i % 50:.2f}%", 'remark': 'Ex. Nagpur' if i % 7 == 0 else '',
+        'Calculated Payout': f"{17 + i % 50:.2f}%", 'Formula Used': '-3%',
+        'Rule Explanation': 'Match: LOB=TW, Segment=TW TP, Payin 21% to 30%'
+    } for i in range(count)]
+
+
+def legacy_build(rows: list) -> str:
+    """The pre-streaming path: DataFrame -> ExcelWriter -> restyle every header -> read back -> base64"""
+    import pandas as pd
+    df = pd.DataFrame(rows)
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, sheet_name='Policy Data', startrow=2, index=False)
+        worksheet = writer.sheets['Policy Data']
+        for col_num, value in enumerate(df.columns, 1):
+            cell = worksheet.cell(row=3, column=col_num, value=value)
+            cell.font = cell.font.copy(bold=True)
+        title_cell = worksheet.cell(row=1, column=1, value="Liberty - Policy Data")
+        worksheet.merge_cells(start_row=1, start_column=1, end_row=1, end_column=len(df.columns))
+        title_cell.font = title_cell.font.copy(bold=True, size=14)
+        title_cell.alignment = title_cell.alignment.copy(horizontal='center')
+    output.seek(0)
+    return base64.b64encode(output.read()).decode('utf-8')
+
+
+def streaming_build(rows: list) -> int:
+    """Write-only export to a temporary file, as /process?response_format=xlsx does (then streamed from disk)"""
+    from excel_export import write_workbook
+    with tempfile.TemporaryFile() as workbook:
+        write_workbook(workbook, [('Policy Data', 'Liberty - Policy Data', COLUMNS, iter(rows))])
+        return workbook.tell()
+
+
+def run_case(builder: str, rows: int) -> dict:
+    data = make_rows(rows)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    if builder == "legacy":
+        legacy_build(data)
+    else:
+        streaming_build(data)
+    seconds = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux
+    return {"builder": builder, "rows": rows, "seconds": seconds, "peak_rss_mb": peak / 1024, "delta_rss_mb": (peak - baseline) / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--case", nargs=2, metavar=("BUILDER", "ROWS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        import pandas, openpyxl  # noqa: F401 - imported before the baseline so only the build is measured
+        print(json.dumps(run_case(args.case[0], int(args.case[1]))))
+        return
+
+    print(f"{'builder':10s} {'rows':>8s} {'wall':>9s} {'peak RSS':>10s} {'build RSS':>10s}")
+    for rows in args.rows:
+        for builder in ("legacy", "streaming"):
+            output = subprocess.run(
+                [sys.executable, __file__, "--case", builder, str(rows)],
+                capture_output=True, text=True, check=True, cwd=BACKEND_DIR
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{builder:10s} {rows:8d} {result['seconds']:8.2f}s {result['peak_rss_mb']:8.1f}MB {result['delta_rss_mb']:8.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Benchmark history lookups and aggregations, indexed vs a full scan.
+
+Usage (from backend/):
+    python bench/bench_history_query.py                  # 50000 cards x 20 records = 1M rows
+    python bench/bench_history_query.py --cards 5000
+
+Fills a temporary history store with synthetic cards spread over two years,
+then times typical ops questions through HistoryStore.query and the same SQL
+with every filter term made unindexable, and prints SQLite's query plan.
+"""
+import argparse
+import hashlib
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import HistoryStore
+
+SEGMENTS = ["TW TP", "TW SAOD + COMP", "PVT CAR TP", "PVT CAR COMP + SAOD", "TAXI", "SCHOOL BUS", "Misd, Tractor", "1+5"]
+LOCATIONS = ["PUNE", "Mumbai", "NAGPUR ", "Delhi", "JAIPUR", "Chennai", "KOLKATA", "INDORE", "Surat", "LUCKNOW"]
+LOCATIONS += [f"RTO {index}" for index in range(190)]
+
+QUERIES = [
+    ("TW TP in Pune, one quarter", {"location": "pune", "segment": "TW TP"}, "2025-04-01", "2025-06-30", []),
+    ("TW TP in Pune per month", {"location": "Pune", "segment": "tw-tp"}, None, None, ["month"]),
+    ("TW payout per location, one quarter", {"lob": "TW"}, "2025-04-01", "2025-06-30", ["location"]),
+    ("Liberty TP per segment, one month", {"company_name": "Liberty", "policy_type": "TP"}, "2025-05-01", "2025-05-31", ["segment"]),
+]
+
+
+def fill(store: HistoryStore, cards: int, records: int):
+    start = time.mktime((2024, 7, 1, 0, 0, 0, 0, 0, 0))
+    for index in range(cards):
+        rng = random.Random(index)
+        rows, payins = [], []
+        for _ in range(records):
+            payin = round(rng.uniform(5, 80), 1)
+            payins.append(payin)
+            rows.append({
+                "segment": rng.choice(SEGMENTS), "policy type": rng.choice(["TP", "Comp", "SAOD"]),
+                "location": rng.choice(LOCATIONS), "remark": "",
+                "Calculated Payout": f"{payin * 0.9:.2f}%", "Formula Used": "90% of Payin"
+            })
+        store.save(hashlib.sha256(str(index).encode()).hexdigest(), rng.choice(["Liberty", "Digit", "ICICI"]),
+                   f"card_{index}.png", rows, payins, "bench", created_at=start + rng.uniform(0, 730 * 86400))
+
+
+def timed(store: HistoryStore, sql: str, params: list, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        store._conn.execute(sql, params).fetchall()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, default=50000)
+    parser.add_argument("--records", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = HistoryStore(os.path.join(directory, "history.sqlite3"))
+        started = time.perf_counter()
+        fill(store, args.cards, args.records)
+        print(f"stored {args.cards * args.records} records in {time.perf_counter() - started:.1f}s\n")
+
+        for label, filters, date_from, date_to, group_by in QUERIES:
+            result = store.query(filters, date_from, date_to, group_by, limit=10000)
+            sql, params = store._query_sql(filters, date_from, date_to, group_by, 10000)
+            indexed = timed(store, sql, params)
+            # A unary + makes a term unusable for index lookups, forcing a scan with the same result
+            scan = timed(store, re.sub(r"(\w+) (=|>=|<=) \?", r"+\1 \2 ?", sql), params, repeat=2)
+            print(f"{label:40s} {result['count']:5d} rows  indexed {indexed * 1000:7.1f}ms  "
+                  f"full scan {scan * 1000:7.1f}ms  ({scan / indexed:5.1f}x)")
+            print(f"    {' | '.join(store.explain(filters, date_from, date_to, group_by))}")
+
+
+if __name__ == "__main__":
+    main()
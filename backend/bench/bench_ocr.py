@@ -0,0 +1,106 @@
+"""Benchmark the local OCR fast path: how many uploads it handles and how fast.
+
+Usage (from backend/):
+    python bench/bench_ocr.py                       # synthetic tables
+    python bench/bench_ocr.py --samples samples/    # labelled sample set
+
+--samples uses the same directory layout as bench_templates.py (images plus
+labels.json mapping file name to layout). A sample counts as handled when
+the local parser accepts it; it is correct when the parsed layout matches
+the label. Compare the records against the vision model with
+bench_templates.py on the same set.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ocr import extract_local, ocr_engine
+
+logging.disable(logging.INFO)
+
+
+def make_table(header: list, rows: list, col_width: int = 220, row_height: int = 44) -> bytes:
+    """Machine-generated looking ruled table"""
+    from PIL import Image, ImageDraw, ImageFont
+
+    font = ImageFont.load_default(size=18)
+    width = col_width * len(header) + 40
+    height = row_height * (len(rows) + 1) + 40
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for r, row in enumerate([header] + rows + [[]]):
+        y = 20 + r * row_height
+        draw.line([(20, y), (width - 20, y)], fill="black")
+        for c, text in enumerate(row):
+            draw.text((30 + c * col_width, y + 12), text, fill="black", font=font)
+    for c in range(len(header) + 1):
+        draw.line([(20 + c * col_width, 20), (20 + c * col_width, height - 20)], fill="black")
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def synthetic_samples() -> list:
+    states = ["MUMBAI", "PUNE", "NAGPUR", "DELHI", "JAIPUR", "CHENNAI", "KOLKATA", "INDORE"]
+    return [
+        ("revised_po.png", "revised_po", make_table(
+            ["RTO-Statename", "Revised PO", "From April'25", "Remarks"],
+            [[state, f"{50 + i}.5%", f"{55 + i}%" if i % 2 else "", "Ex. Nagpur" if i == 1 else ""] for i, state in enumerate(states)]
+        )),
+        ("required_existing.png", "required_existing", make_table(
+            ["RTO-Statename", "Required", "Existing"],
+            [[state, "-" if i % 3 == 0 else f"{60 + i}%", f"{52 + i}.5%"] for i, state in enumerate(states)]
+        )),
+        ("geo_cc_grid.png", "geo_cc_grid", make_table(
+            ["Geo segment New", "Geo segment Old", "Bikes <75 CC", "Bikes >75-150 CC", "Bikes >150-350 CC",
+             "Bikes >350 CC", "Scooter <75 CC", "Scooter >75-150 CC"],
+            [[f"Zone {i}", state] + [f"{30 + i + c}%" for c in range(6)] for i, state in enumerate(states)],
+            col_width=200
+        )),
+        ("cd2_table.png", "other", make_table(
+            ["Segment", "Cluster", "CD1", "CD2"],
+            [["2W SATP", state, "10%", f"{60 + i}%"] for i, state in enumerate(states)]
+        ))
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", help="directory with images and labels.json")
+    args = parser.parse_args()
+
+    if args.samples:
+        labels = json.load(open(os.path.join(args.samples, "labels.json")))
+        samples = [(name, label, open(os.path.join(args.samples, name), "rb").read()) for name, label in labels.items()]
+    else:
+        samples = synthetic_samples()
+
+    print(f"engine: {ocr_engine()}")
+    if ocr_engine() is None:
+        return
+
+    # Load the OCR models outside the timings
+    extract_local(samples[0][2])
+
+    handled = correct = 0
+    for name, label, image_bytes in samples:
+        started = time.perf_counter()
+        result = extract_local(image_bytes)
+        seconds = time.perf_counter() - started
+        layout = result.layout if result else "other"
+        handled += result is not None
+        correct += layout == label
+        detail = f"{len(result.records):4d} records  confidence {result.confidence:.3f}" if result else "→ vision model"
+        print(f"{name:32s} {label:18s} → {layout:18s} {seconds * 1000:7.0f}ms  {detail}")
+
+    print(f"\nhandled locally {handled}/{len(samples)}, layout correct {correct}/{len(samples)}")
+
+
+if __name__ == "__main__":
+    main()
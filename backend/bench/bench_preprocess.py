@@ -0,0 +1,94 @@
+"""Benchmark image pre-processing: bytes sent, wall time and output equality.
+
+Usage (from backend/):
+    python bench/bench_preprocess.py samples/*.jpg            # payload sizes only
+    python bench/bench_preprocess.py samples/*.jpg --extract  # also call the model
+
+Without image arguments a few synthetic rate-card photos are generated.
+--extract calls the configured OpenAI endpoint (OPENAI_BASE_URL/OPENAI_API_KEY)
+once with the raw upload and once with the pre-processed image and reports
+whether the extracted JSON is identical.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocess import preprocess_image
+
+
+def synthetic_samples():
+    """Phone-photo-sized table images with a wide margin and some noise"""
+    from PIL import Image, ImageDraw
+
+    samples = []
+    for width, height, fmt in [(4000, 3000, "JPEG"), (3024, 4032, "JPEG"), (2480, 3508, "BMP")]:
+        image = Image.new("RGB", (width, height), (250, 250, 245))
+        draw = ImageDraw.Draw(image)
+        left, top = width // 8, height // 6
+        for row in range(40):
+            y = top + row * 50
+            draw.line([(left, y), (width - left, y)], fill=(20, 20, 20), width=3)
+            for col in range(6):
+                draw.text((left + 20 + col * (width - 2 * left) // 6, y + 15), f"{30 + row % 7}.{col}%", fill=(0, 0, 0))
+        noise = Image.effect_noise((width, height), 12).convert("RGB")
+        image = Image.blend(image, noise, 0.08)
+        buffer = BytesIO()
+        image.save(buffer, format=fmt, quality=92) if fmt == "JPEG" else image.save(buffer, format=fmt)
+        samples.append((f"synthetic_{width}x{height}.{fmt.lower()}", buffer.getvalue()))
+    return samples
+
+
+async def extract(image_bytes: bytes, mime_type: str):
+    import main as backend
+    started = time.perf_counter()
+    text = await backend.request_extraction(image_bytes, mime_type)
+    return json.loads(text), time.perf_counter() - started
+
+
+async def run(samples, call_model: bool):
+    totals = {"raw": 0, "sent": 0}
+    for name, raw in samples:
+        started = time.perf_counter()
+        processed, mime_type = preprocess_image(raw)
+        prep_seconds = time.perf_counter() - started
+
+        raw_b64 = len(base64.b64encode(raw))
+        sent_b64 = len(base64.b64encode(processed))
+        totals["raw"] += raw_b64
+        totals["sent"] += sent_b64
+        line = f"{name:40s} {raw_b64 / 1e6:8.2f} MB → {sent_b64 / 1e6:8.2f} MB base64  prep {prep_seconds * 1000:7.1f}ms"
+
+        if call_model:
+            extension = name.rsplit(".", 1)[-1].lower()
+            before, before_seconds = await extract(raw, f"image/{extension}")
+            after, after_seconds = await extract(processed, mime_type or f"image/{extension}")
+            line += f"  model {before_seconds:5.1f}s → {after_seconds:5.1f}s  equal={before == after}"
+        print(line)
+
+    if totals["raw"]:
+        print(f"{'TOTAL':40s} {totals['raw'] / 1e6:8.2f} MB → {totals['sent'] / 1e6:8.2f} MB base64 "
+              f"({100 * (1 - totals['sent'] / totals['raw']):.0f}% smaller)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("images", nargs="*")
+    parser.add_argument("--extract", action="store_true", help="call the model and compare outputs")
+    args = parser.parse_args()
+
+    if args.images:
+        samples = [(os.path.basename(path), open(path, "rb").read()) for path in args.images]
+    else:
+        samples = synthetic_samples()
+    asyncio.run(run(samples, args.extract))
+
+
+if __name__ == "__main__":
+    main()
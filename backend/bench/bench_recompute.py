@@ -0,0 +1,86 @@
+"""Benchmark payout recomputation over a large extraction history.
+
+Usage (from backend/):
+    python bench/bench_recompute.py                     # 5000 cards x 20 records
+    python bench/bench_recompute.py --cards 20000 --records 30
+
+Fills a temporary history store with synthetic cards, then recomputes every
+payout under a corrected rule set (TW TP above 50% changed from -3% to -4%)
+and reports the load + recompute time, the number of changed rows and the
+store size on disk. The result is checked against the row-by-row
+RuleIndex.evaluate path.
+"""
+import argparse
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import HistoryStore
+from rules import compile_formula_data, payin_band
+
+SEGMENTS = ["TW TP", "TW SAOD + COMP", "PVT CAR TP", "PVT CAR COMP + SAOD", "TAXI", "SCHOOL BUS", "Misd, Tractor", "1+5"]
+
+
+def synthetic_card(index: int, records: int, rule_index) -> tuple:
+    rng = random.Random(index)
+    payins = [round(rng.uniform(5, 80), 1) for _ in range(records)]
+    rows = []
+    for payin in payins:
+        segment = rng.choice(SEGMENTS)
+        payout, formula, explanation = rule_index.evaluate(segment, payin, payin_band(payin))
+        rows.append({
+            "segment": segment, "policy type": "TP", "location": f"RTO {rng.randint(1, 500)}", "remark": "",
+            "Calculated Payout": f"{payout:.2f}%", "Formula Used": formula, "Rule Explanation": explanation
+        })
+    return hashlib.sha256(str(index).encode()).hexdigest(), rows, payins
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, default=5000)
+    parser.add_argument("--records", type=int, default=20)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)
+    from main import FORMULA_DATA
+
+    old_rules = compile_formula_data(FORMULA_DATA)
+    corrected = [dict(rule, PO="-4%") if rule["SEGMENT"] == "TW TP" and rule["REMARKS"] == "Payin Above 50%" else rule
+                 for rule in FORMULA_DATA]
+    new_rules = compile_formula_data(corrected)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = HistoryStore(os.path.join(directory, "history.sqlite3"))
+        started = time.perf_counter()
+        expected_changes = 0
+        for index in range(args.cards):
+            image_hash, rows, payins = synthetic_card(index, args.records, old_rules)
+            store.save(image_hash, "Liberty", f"card_{index}.png", rows, payins, "old")
+            for row, payin in zip(rows, payins):
+                payout, formula, _ = new_rules.evaluate(row["segment"], payin, payin_band(payin))
+                expected_changes += f"{payout:.2f}%" != row["Calculated Payout"] or formula != row["Formula Used"]
+        fill = time.perf_counter() - started
+        size = os.path.getsize(store.path) + sum(
+            os.path.getsize(store.path + suffix) for suffix in ("-wal",) if os.path.exists(store.path + suffix)
+        )
+
+        result = store.recompute(new_rules, "new")
+        summary = result["summary"]
+        print(f"stored {args.cards} cards x {args.records} records in {fill:.1f}s ({size / 2 ** 20:.1f} MB)")
+        print(f"recompute: {summary['records']} records from {summary['runs']} runs in {summary['seconds']:.2f}s, "
+              f"{summary['changed_records']} changed in {summary['changed_runs']} runs")
+        print(f"row-by-row reference: {expected_changes} changed -> {'match' if expected_changes == summary['changed_records'] else 'MISMATCH'}")
+
+        applied = store.recompute(new_rules, "new", apply=True)["summary"]
+        again = store.recompute(new_rules, "new")["summary"]
+        print(f"apply: {applied['seconds']:.2f}s, then {again['changed_records']} changed on a second recompute")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Measure /process response size and serialization time: full payload vs slim + artifact links.
+
+Usage (from backend/):
+    python bench/bench_response.py --rows 500
+
+The extraction result is seeded into the result cache, so no model call is
+made; the numbers cover formula application, artifact building and JSON
+rendering of the response.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse
+
+import main as backend
+from cache import make_cache_key
+from fakes import make_png
+
+logging.disable(logging.INFO)
+
+
+def card_records(rows: int) -> list:
+    segments = ["TW TP", "TW SAOD + COMP", "PVT CAR TP", "All GVW & PCV 3W, GCV 3W", "SCHOOL BUS"]
+    return [{
+        "segment": segments[i % len(segments)],
+        "policy_type": "TP" if i % 2 else "Comp",
+        "location": f"RTO LOCATION {i}",
+        "payin": 15 + (i * 7) % 60,
+        "remark": "Ex. Nagpur" if i % 5 == 0 else ""
+    } for i in range(rows)]
+
+
+async def measure(image: bytes, response_format: str, repeat: int) -> tuple:
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = await backend.process_files(image, "card.png", "image/png", "Liberty", response_format=response_format)
+        body = JSONResponse(content=result).body
+        durations.append(time.perf_counter() - started)
+    return len(body), min(durations)
+
+
+async def run(rows: int, repeat: int):
+    image = make_png(300, 300)
+    backend.result_cache.set(make_cache_key(image, backend.EXTRACTION_VERSION), json.dumps(card_records(rows)))
+
+    full_bytes, full_seconds = await measure(image, "full", repeat)
+    slim_bytes, slim_seconds = await measure(image, "slim", repeat)
+
+    print(f"rows: {rows}")
+    print(f"full response:  {full_bytes / 1024:9.1f} KiB  {full_seconds * 1000:7.1f}ms process + serialize")
+    print(f"slim response:  {slim_bytes / 1024:9.1f} KiB  {slim_seconds * 1000:7.1f}ms process + serialize")
+    print(f"reduction:      {full_bytes / slim_bytes:9.1f}x bytes  {full_seconds / slim_seconds:7.1f}x time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
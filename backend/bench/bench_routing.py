@@ -0,0 +1,184 @@
+"""Benchmark model routing: full model only against fast-first with validated escalation.
+
+Usage (from backend/):
+    python bench/bench_routing.py
+    python bench/bench_routing.py --cards 60 --hard 0.4
+
+Extracts a synthetic workload of rate cards against a fake OpenAI server:
+most are short tables, some run past ROUTE_MAX_ROWS. The fake full model is
+always right and takes 0.4s + 15ms per record; the fake fast model takes a
+third of that but gets --hard of the short cards wrong, cycling through
+dropped rows, a payin off by 10x, an unknown segment, and a swapped digit
+that validation cannot catch. Prompt tokens follow each model's image
+billing, so the cost column uses OPENAI_PRICES. Reports latency, estimated
+cost, escalation rate (by reason) and exact-match accuracy for both modes.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("LOCAL_OCR", "off")
+os.environ.setdefault("RESULT_CACHE_BACKEND", "none")
+os.environ.setdefault("EXTRACTION_HISTORY", "off")
+# The fake tells cards apart by their PNG dimensions, so they must reach it unchanged
+os.environ.setdefault("IMAGE_PREPROCESS", "0")
+os.environ.setdefault("TILED_EXTRACTION", "off")
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from fakes import BackgroundServer, chat_completion, make_png, prompt_text
+
+SEGMENTS = ["TW TP", "TW SAOD + COMP", "PVT CAR TP", "PVT CAR COMP + SAOD", "TAXI", "SCHOOL BUS"]
+MISTAKES = ["dropped_rows", "payin_10x", "unknown_segment", "swapped_digits"]
+# Card i is a PNG CARD_BASE_WIDTH + i pixels wide
+CARD_BASE_WIDTH = 800
+
+
+def make_cards(count: int, hard: float, seed: int = 7) -> list:
+    """[(png bytes, true records, fast-model mistake or None)]"""
+    rng = random.Random(seed)
+    cards, mistakes = [], 0
+    for index in range(count):
+        large = rng.random() < 0.25
+        rows = rng.randint(30, 60) if large else rng.randint(2, 12)
+        records = [
+            {"segment": rng.choice(SEGMENTS), "policy_type": "Comp", "location": f"CLUSTER {row}",
+             "payin": rng.randint(10, 90) + rng.choice((0.0, 0.5)), "remark": ""}
+            for row in range(rows)
+        ]
+        mistake = None
+        # Large cards go to the full model anyway; spread the mistakes over the ones the fast model sees
+        if not large and rng.random() < hard:
+            mistake, mistakes = MISTAKES[mistakes % len(MISTAKES)], mistakes + 1
+        cards.append((make_png(CARD_BASE_WIDTH + index, 300 + 16 * rows), records, mistake))
+    return cards
+
+
+def fast_reply(records: list, mistake: str) -> list:
+    records = [dict(record) for record in records]
+    if mistake == "dropped_rows":
+        return records[:max(1, len(records) // 2)]
+    if mistake == "payin_10x":
+        records[0]["payin"] *= 10
+    elif mistake == "unknown_segment":
+        records[-1]["segment"] = "Two Wheeler"
+    elif mistake == "swapped_digits":
+        payin = records[0]["payin"]
+        records[0]["payin"] = float(str(int(payin))[::-1]) + payin % 1
+    return records
+
+
+def image_size(body: dict) -> tuple:
+    """(width, height) of the PNG in a chat request's image part"""
+    for message in body["messages"]:
+        for part in message["content"]:
+            if part.get("type") == "image_url":
+                png = base64.b64decode(part["image_url"]["url"].split(",", 1)[1][:64])
+                return struct.unpack(">II", png[16:24])
+    raise ValueError("no image")
+
+
+def create_routing_fake(cards: list, full_model: str) -> FastAPI:
+    from scheduler import estimate_image_tokens
+
+    fake = FastAPI()
+
+    @fake.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        model = body["model"]
+        prompt = prompt_text(body)
+        width, height = image_size(body)
+        _, records, mistake = cards[width - CARD_BASE_WIDTH]
+        detail = body["messages"][0]["content"][1]["image_url"].get("detail")
+        prompt_tokens = len(prompt) // 4 + estimate_image_tokens(model, width, height, detail)
+
+        if prompt.startswith("Which layout"):
+            return JSONResponse(content=chat_completion(f"other {len(records)}", model, prompt_tokens, 3))
+
+        full = model == full_model
+        await asyncio.sleep((0.4 + 0.015 * len(records)) / (1 if full else 3))
+        payload = json.dumps(records if full else fast_reply(records, mistake))
+        return JSONResponse(content=chat_completion(payload, model, prompt_tokens, len(payload) // 4))
+
+    return fake
+
+
+async def run_mode(backend, cards: list, routing: str, concurrency: int) -> dict:
+    import routing as routing_module
+
+    routing_module.MODEL_ROUTING = routing
+    backend.route_stats = routing_module.RouteStats()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, correct = [], 0
+
+    async def one(index: int):
+        nonlocal correct
+        png, records, _ = cards[index]
+        async with semaphore:
+            started = time.perf_counter()
+            text = await backend.extract_text_from_file(png, f"card_{index}.png", "image/png")
+            latencies.append(time.perf_counter() - started)
+        correct += json.loads(text) == records
+
+    from telemetry import track_usage
+    started = time.perf_counter()
+    with track_usage() as usage:
+        await asyncio.gather(*(one(index) for index in range(len(cards))))
+    latencies.sort()
+    return {
+        "wall": time.perf_counter() - started,
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[int(len(latencies) * 0.95)],
+        "cost": usage["cost_usd"],
+        "correct": correct,
+        "stats": backend.route_stats.stats()
+    }
+
+
+async def run(backend, cards: list, concurrency: int):
+    results = {}
+    for name, routing in (("full only", "off"), ("routed", "auto")):
+        result = results[name] = await run_mode(backend, cards, routing, concurrency)
+        print(f"{name:10s} wall {result['wall']:6.2f}s  p50 {result['p50']:5.2f}s  p95 {result['p95']:5.2f}s  "
+              f"cost ${result['cost']:.4f}  exact {result['correct']}/{len(cards)}")
+
+    stats = results["routed"]["stats"]
+    for route, route_stats in sorted(stats["routes"].items()):
+        print(f"  {route:10s} {route_stats['calls']:3d} cards  p50 {route_stats['p50_seconds']:5.2f}s  "
+              f"mean ${route_stats['mean_cost_usd']:.5f}")
+    print(f"  escalation rate {stats['escalation_rate']}, reasons {stats['escalation_reasons']}")
+    saved = 1 - results["routed"]["cost"] / results["full only"]["cost"]
+    print(f"routed: {saved:.0%} cheaper, p50 {results['routed']['p50'] / results['full only']['p50']:.2f}x of full-only")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, default=40)
+    parser.add_argument("--hard", type=float, default=0.3, help="share of cards the fast model gets wrong")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.WARNING)
+
+    cards = make_cards(args.cards, args.hard)
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+    full_model = os.getenv("OPENAI_MODEL", "gpt-4o")
+    with BackgroundServer(create_routing_fake(cards, full_model)) as fake:
+        os.environ["OPENAI_BASE_URL"] = f"{fake.url}/v1"
+        import main as backend
+        asyncio.run(run(backend, cards, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
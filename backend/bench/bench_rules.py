@@ -0,0 +1,146 @@
+"""Micro-benchmark: compiled rule index vs the original linear FORMULA_DATA scan.
+
+Usage (from backend/):
+    python bench/bench_rules.py --records 100000
+
+Checks that apply_formula produces exactly the same rows as the original
+implementation (kept below as legacy_apply_formula) before timing both.
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as backend
+from columnar import calculate_frame
+from rules import determine_lob
+
+# classify_payin warns on every unparseable payin; keep the report readable
+logging.disable(logging.WARNING)
+
+SEGMENTS = [
+    "TW TP", "TW SAOD + COMP", "1+5", "PVT CAR TP", "PVT CAR COMP + SAOD",
+    "All GVW & PCV 3W, GCV 3W", "SCHOOL BUS", "STAFF BUS", "TAXI", "Misd, Tractor",
+    "2W", "Scooter", "GCV 3W", "Unknown segment"
+]
+PAYINS = [5, 19.5, 20, 20.5, 25, 30, 33.3, 50, 52.5, 63, "63%", "-4%", "N/A", "", "abc"]
+
+
+def legacy_apply_formula(policy_data):
+    """apply_formula as it was before the rule index (matching + PO parsing per record)"""
+    calculated_data = []
+    for record in policy_data:
+        segment = str(record.get('segment', ''))
+        payin_value = record.get('Payin_Value', 0)
+        payin_category = record.get('Payin_Category', '')
+        lob = determine_lob(segment)
+        segment_upper = segment.upper()
+        matched_rule = None
+        for rule in backend.FORMULA_DATA:
+            if rule["LOB"] != lob:
+                continue
+            rule_segment = rule["SEGMENT"].upper()
+            if rule_segment not in segment_upper:
+                continue
+            remarks = rule.get("REMARKS", "")
+            if remarks == "NIL" or payin_category in remarks:
+                matched_rule = rule
+                break
+        if matched_rule:
+            po_formula = matched_rule["PO"]
+            calculated_payout = payin_value
+            if "90% of Payin" in po_formula:
+                calculated_payout *= 0.9
+            elif "88% of Payin" in po_formula:
+                calculated_payout *= 0.88
+            elif "Less 2%" in po_formula or "-2%" in po_formula:
+                calculated_payout -= 2
+            elif "-3%" in po_formula:
+                calculated_payout -= 3
+            elif "-4%" in po_formula:
+                calculated_payout -= 4
+            elif "-5%" in po_formula:
+                calculated_payout -= 5
+            calculated_payout = max(0, calculated_payout)
+            formula_used = po_formula
+            rule_explanation = f"Match: LOB={lob}, Segment={rule_segment}, {remarks}"
+        else:
+            calculated_payout = payin_value
+            formula_used = "No matching rule"
+            rule_explanation = f"No rule for LOB={lob}, Segment={segment_upper}"
+        remark_value = record.get('remark', '')
+        if isinstance(remark_value, list):
+            remark_value = '; '.join(str(r) for r in remark_value)
+        calculated_data.append({
+            'segment': segment,
+            'policy type': record.get('policy_type', 'Comp'),
+            'location': record.get('location', 'N/A'),
+            'payin': f"{payin_value:.2f}%",
+            'remark': str(remark_value),
+            'Calculated Payout': f"{calculated_payout:.2f}%",
+            'Formula Used': formula_used,
+            'Rule Explanation': rule_explanation
+        })
+    return calculated_data
+
+
+def make_records(count: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        record = {
+            "segment": rng.choice(SEGMENTS),
+            "policy_type": rng.choice(["Comp", "TP"]),
+            "location": f"LOCATION {i % 500}",
+            "payin": rng.choice(PAYINS) if i % 3 else round(rng.uniform(0, 80), 2),
+            "remark": ""
+        }
+        record["Payin_Value"], record["Payin_Category"] = backend.classify_payin(record["payin"])
+        records.append(record)
+    return records
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=100000)
+    args = parser.parse_args()
+
+    records = make_records(args.records)
+
+    legacy, legacy_seconds = timed(legacy_apply_formula, records)
+    indexed, indexed_seconds = timed(backend.apply_formula, records)
+    assert indexed == legacy, "apply_formula output differs from the legacy implementation"
+
+    parsed = [{k: v for k, v in r.items() if k not in ("Payin_Value", "Payin_Category")} for r in records]
+    row_parsed = [dict(r) for r in parsed]
+    _, row_seconds = timed(lambda data: pd.DataFrame(backend.calculate_records(data)), row_parsed)
+    frame, frame_seconds = timed(calculate_frame, parsed, backend.RULE_INDEX)
+    assert frame.to_dict('records') == legacy, "calculate_frame output differs from the legacy implementation"
+    assert [(r["Payin_Value"], r["Payin_Category"]) for r in parsed] == [(r["Payin_Value"], r["Payin_Category"]) for r in records]
+
+    report = [
+        ("legacy apply_formula", legacy_seconds),
+        ("indexed apply_formula", indexed_seconds),
+        ("per-row classify + apply_formula + DataFrame", row_seconds),
+        ("calculate_frame (columnar)", frame_seconds),
+    ]
+    print(f"{'records':46s} {args.records}")
+    for label, seconds in report:
+        print(f"{label:46s} {seconds * 1000:8.1f}ms")
+    print(f"{'output identical':46s} yes")
+
+
+if __name__ == "__main__":
+    main()
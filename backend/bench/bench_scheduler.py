@@ -0,0 +1,137 @@
+"""Benchmark the OpenAI request scheduler against a fake API that enforces a request quota.
+
+Usage (from backend/):
+    python bench/bench_scheduler.py
+    python bench/bench_scheduler.py --quota 10 --batch 60 --interactive 4 --delay 0.5
+
+The fake answers at most --quota requests per second and returns 429 with
+retry-after-ms beyond that. One "batch" user submits --batch extractions at
+once; shortly after, each of --interactive users submits two. Three runs:
+
+    retry-only  no pacing; 429s are retried after Retry-After with jitter
+    paced       RPM bucket at the quota, every call in one FIFO queue
+    fair        RPM bucket at the quota, queued per user (the default)
+
+Each run reports wall time, 429s returned, throughput against the quota and
+the p50 latency of the batch and interactive users.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("LOCAL_OCR", "off")
+os.environ.setdefault("RESULT_CACHE_BACKEND", "none")
+# The fake enforces its quota per second, so the buckets may only hold one second of it
+os.environ.setdefault("OPENAI_RATE_BURST_SECONDS", "1")
+os.environ.setdefault("OPENAI_BACKOFF_BASE_SECONDS", "0.2")
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from fakes import SAMPLE_RECORDS, BackgroundServer, chat_completion, make_png
+
+
+def create_quota_app(quota: int, delay: float) -> FastAPI:
+    """Fake chat completions allowing `quota` requests per one-second window"""
+    fake = FastAPI()
+    state = {"window": 0, "count": 0, "accepted": 0, "rejected": 0}
+    fake.state.stats = state
+
+    @fake.post("/v1/chat/completions")
+    async def completions(request: Request):
+        await request.body()
+        now = time.monotonic()
+        if int(now) != state["window"]:
+            state["window"], state["count"] = int(now), 0
+        if state["count"] >= quota:
+            state["rejected"] += 1
+            return JSONResponse(
+                status_code=429,
+                headers={"retry-after-ms": str(int((1 - now % 1) * 1000))},
+                content={"error": {"message": "Rate limit reached for requests", "type": "requests", "code": "rate_limit_exceeded"}}
+            )
+        state["count"] += 1
+        state["accepted"] += 1
+        await asyncio.sleep(delay)
+        return JSONResponse(content=chat_completion(str(SAMPLE_RECORDS).replace("'", '"'), prompt_tokens=300, completion_tokens=60))
+
+    return fake
+
+
+async def run(backend, scheduler_module, quota: int, batch: int, interactive: int, rpm: int, fair: bool) -> dict:
+    image = make_png()
+    latencies = {"batch": [], "interactive": []}
+    failures = 0
+
+    async def one(user: str, kind: str):
+        nonlocal failures
+        started = time.perf_counter()
+        with scheduler_module.user_scope(user if fair else "everyone"):
+            try:
+                await backend.request_extraction(image, "image/png")
+            except Exception:
+                failures += 1
+                return
+        latencies[kind].append(time.perf_counter() - started)
+
+    async def late(user: str):
+        await asyncio.sleep(0.5)
+        await asyncio.gather(one(user, "interactive"), one(user, "interactive"))
+
+    backend.scheduler = scheduler_module.RequestScheduler(max_concurrency=batch, rpm=rpm, tpm=0, limits={}, max_retries=20)
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(one("batch", "batch") for _ in range(batch)),
+        *(late(f"user{index}") for index in range(interactive))
+    )
+    wall = time.perf_counter() - started
+    done = len(latencies["batch"]) + len(latencies["interactive"])
+    return {
+        "wall": wall,
+        "done": done,
+        "failures": failures,
+        "rate": done / wall,
+        "batch_p50": statistics.median(latencies["batch"]) if latencies["batch"] else float("nan"),
+        "interactive_p50": statistics.median(latencies["interactive"]) if latencies["interactive"] else float("nan")
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quota", type=int, default=10, help="requests per second the fake accepts")
+    parser.add_argument("--batch", type=int, default=60)
+    parser.add_argument("--interactive", type=int, default=4)
+    parser.add_argument("--delay", type=float, default=0.5, help="fake model latency, seconds")
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.WARNING)
+    from openai import AsyncOpenAI
+
+    import main as backend
+    import scheduler
+
+    fake = create_quota_app(args.quota, args.delay)
+    with BackgroundServer(fake) as server:
+        for name, rpm, fair in (("retry-only", 0, True), ("paced", args.quota * 60, False), ("fair", args.quota * 60, True)):
+            backend.set_openai_client(AsyncOpenAI(
+                api_key="bench", base_url=f"{server.url}/v1", max_retries=0, http_client=scheduler.create_http_client()
+            ))
+            stats = fake.state.stats
+            stats.update(accepted=0, rejected=0)
+            # Start each run in a fresh quota window
+            time.sleep(1 - time.monotonic() % 1)
+            result = asyncio.run(run(backend, scheduler, args.quota, args.batch, args.interactive, rpm, fair))
+            print(f"{name:10s} {result['wall']:6.2f}s  {result['done']:4d} done  {result['failures']:3d} failed  "
+                  f"{stats['rejected']:4d} x 429  {result['rate']:5.1f} req/s of {args.quota}  "
+                  f"p50 batch {result['batch_p50']:5.2f}s  interactive {result['interactive_p50']:5.2f}s")
+    backend.set_openai_client(None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Compare the full extraction prompt with per-layout template prompts: tokens, latency and detection accuracy.
+
+Usage (from backend/):
+    python bench/bench_templates.py                          # prompt sizes only
+    python bench/bench_templates.py --samples samples/       # labelled sample set
+
+--samples expects a directory of images plus labels.json mapping each file
+name to its layout template ("other" for none). Every sample is extracted
+once with the full prompt and once through detection + template prompt,
+against the configured OpenAI endpoint (OPENAI_BASE_URL/OPENAI_API_KEY);
+prompt tokens come from the API's usage block.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from templates import LAYOUT_PROMPT, TEMPLATES, template_prompt
+
+
+def count_tokens(text: str) -> int:
+    """tiktoken count when installed, otherwise the usual ~4 characters per token"""
+    try:
+        import tiktoken
+        return len(tiktoken.get_encoding("o200k_base").encode(text))
+    except Exception:
+        return len(text) // 4
+
+
+def report_prompt_sizes():
+    import main as backend
+
+    full = count_tokens(backend.EXTRACTION_PROMPT)
+    print(f"{'full prompt':24s} {full:6d} tokens")
+    print(f"{'layout detection':24s} {count_tokens(LAYOUT_PROMPT):6d} tokens")
+    for name in TEMPLATES:
+        tokens = count_tokens(template_prompt(name))
+        print(f"{name:24s} {tokens:6d} tokens  ({100 * (1 - tokens / full):.0f}% smaller)")
+
+
+async def timed_completion(backend, image_bytes: bytes, mime_type: str, prompt: str, **options):
+    started = time.perf_counter()
+    response = await backend.get_openai_client().chat.completions.create(
+        messages=backend.build_messages(image_bytes, mime_type, prompt, options.pop("detail", None)),
+        temperature=0.0,
+        **options
+    )
+    return response, time.perf_counter() - started
+
+
+async def run_samples(directory: str):
+    import main as backend
+    from preprocess import preprocess_image
+    from templates import LAYOUT_MAX_TOKENS, LAYOUT_MODEL, parse_layout_reply
+
+    labels = json.load(open(os.path.join(directory, "labels.json")))
+    totals = {"full_tokens": 0, "full_seconds": 0.0, "template_tokens": 0, "template_seconds": 0.0, "correct": 0, "same": 0}
+    for filename, label in labels.items():
+        raw = open(os.path.join(directory, filename), "rb").read()
+        image_bytes, mime_type = preprocess_image(raw)
+        mime_type = mime_type or f"image/{filename.rsplit('.', 1)[-1].lower()}"
+
+        full, full_seconds = await timed_completion(
+            backend, image_bytes, mime_type, backend.EXTRACTION_PROMPT, model=backend.OPENAI_MODEL, max_tokens=4000
+        )
+        detection, detect_seconds = await timed_completion(
+            backend, image_bytes, mime_type, LAYOUT_PROMPT, model=LAYOUT_MODEL, max_tokens=LAYOUT_MAX_TOKENS, detail="low"
+        )
+        layout = parse_layout_reply(detection.choices[0].message.content)
+        # Undetected layouts pay for detection and then the full prompt, as in production
+        prompt = template_prompt(layout) if layout else backend.EXTRACTION_PROMPT
+        extraction, extract_seconds = await timed_completion(
+            backend, image_bytes, mime_type, prompt, model=backend.OPENAI_MODEL, max_tokens=4000
+        )
+
+        template_tokens = detection.usage.prompt_tokens + extraction.usage.prompt_tokens
+        template_seconds = detect_seconds + extract_seconds
+        correct = (layout or "other") == label
+        same = backend.clean_model_output(full.choices[0].message.content) == backend.clean_model_output(extraction.choices[0].message.content)
+        totals["full_tokens"] += full.usage.prompt_tokens
+        totals["full_seconds"] += full_seconds
+        totals["template_tokens"] += template_tokens
+        totals["template_seconds"] += template_seconds
+        totals["correct"] += correct
+        totals["same"] += same
+        print(f"{filename:32s} {label:18s} → {layout or 'other':18s} {'ok ' if correct else 'BAD'}  "
+              f"tokens {full.usage.prompt_tokens:6d} → {template_tokens:6d}  "
+              f"time {full_seconds:5.2f}s → {template_seconds:5.2f}s  same_output={same}")
+
+    if labels:
+        print(f"\ndetection accuracy {totals['correct']}/{len(labels)}")
+        # LAYOUT_DETECTION=auto is only worth enabling when the templates reproduce the full prompt's records
+        print(f"same records as the full prompt {totals['same']}/{len(labels)}")
+        print(f"prompt tokens {totals['full_tokens']} → {totals['template_tokens']} "
+              f"({100 * (1 - totals['template_tokens'] / max(1, totals['full_tokens'])):.0f}% fewer)")
+        print(f"latency {totals['full_seconds']:.2f}s → {totals['template_seconds']:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", help="directory with images and labels.json")
+    args = parser.parse_args()
+
+    report_prompt_sizes()
+    if args.samples:
+        print()
+        asyncio.run(run_samples(args.samples))
+
+
+if __name__ == "__main__":
+    main()
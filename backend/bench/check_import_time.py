@@ -0,0 +1,67 @@
+"""Cold-import budget check for main.py.
+
+Usage (from backend/):
+    python bench/check_import_time.py --budget-ms 1500
+
+Runs `python -X importtime -c "import main"` in a fresh interpreter with
+OPENAI_API_KEY unset, then fails (exit 1) if the import raises, the
+cumulative import time passes the budget, or any of the heavy modules that
+are meant to load on first use (pandas, numpy, openai, openpyxl, PIL) were
+pulled in at import.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAZY_MODULES = ("pandas", "numpy", "openai", "openpyxl", "PIL")
+
+
+def measure_import(module: str) -> tuple:
+    """Return (cumulative microseconds, top-level packages imported) for a cold import of module"""
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"❌ import {module} failed:\n{result.stderr[-2000:]}")
+
+    total_us = 0
+    packages = set()
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        packages.add(name.strip().split(".")[0])
+        if not name.startswith("  "):
+            total_us += int(cumulative)
+    return total_us, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--budget-ms", type=float, default=1500.0)
+    args = parser.parse_args()
+
+    total_us, packages = measure_import(args.module)
+    eager = sorted(set(LAZY_MODULES) & packages)
+    print(f"import {args.module}: {total_us / 1000:.1f} ms (budget {args.budget_ms:.0f} ms)")
+
+    failed = False
+    if eager:
+        print(f"❌ Heavy modules imported eagerly: {', '.join(eager)}")
+        failed = True
+    if total_us / 1000 > args.budget_ms:
+        print("❌ Cold import is over budget")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("✅ Cold import within budget")
+
+
+if __name__ == "__main__":
+    main()
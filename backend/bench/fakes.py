@@ -0,0 +1,166 @@
+"""Local stand-ins used by the benchmark scripts (no OpenAI key needed)"""
+import asyncio
+import json
+import socket
+import struct
+import threading
+import time
+import zlib
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+SAMPLE_RECORDS = [
+    {"segment": "TW TP", "policy_type": "TP", "location": "PUNE", "payin": 63.0, "remark": ""},
+    {"segment": "TW SAOD + COMP", "policy_type": "Comp", "location": "MUMBAI", "payin": 28.0, "remark": "Other make"},
+    {"segment": "PVT CAR TP", "policy_type": "TP", "location": "NAGPUR", "payin": 45.5, "remark": ""},
+]
+
+
+def make_png(width: int = 64, height: int = 64, shade: int = 255) -> bytes:
+    """Build a valid grayscale PNG without any imaging library"""
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+    raw = b"".join(b"\x00" + bytes([shade]) * width for _ in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+
+def free_port() -> int:
+    """Ask the OS for an unused TCP port"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def chat_completion(content: str, model: str = "gpt-4o", prompt_tokens: int = 0, completion_tokens: int = 0) -> dict:
+    """Shape a chat.completion payload the way the OpenAI API returns it"""
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+
+def chat_completion_chunk(delta: str, model: str = "gpt-4o", finish_reason: str = None) -> dict:
+    """Shape one chat.completion.chunk of a streamed reply"""
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "delta": {"content": delta} if delta else {},
+            "finish_reason": finish_reason
+        }]
+    }
+
+
+def prompt_text(body: dict) -> str:
+    """Text parts of a chat request's messages"""
+    return "".join(
+        part.get("text", "")
+        for message in body.get("messages", [])
+        for part in (message["content"] if isinstance(message["content"], list) else [{"text": message["content"]}])
+    )
+
+
+def create_fake_openai_app(delay: float = 2.0, records: list = None, layout: str = "other",
+                           truncate_after: int = None) -> FastAPI:
+    """Fake OpenAI server whose chat completions take `delay` seconds.
+
+    Streamed requests spread the same delay across one chunk per record, so
+    time-to-first-record is roughly delay / len(records). Layout detection
+    requests are answered with `layout` immediately. Usage counts ~4 prompt
+    characters per token.
+
+    With truncate_after, extraction replies stop halfway through the record
+    after that many, like a reply cut off at max_tokens; continuation requests
+    get the remaining records, starting with a repeat of the last one seen.
+    """
+    fake = FastAPI()
+    records = records if records is not None else SAMPLE_RECORDS
+    calls = {"extraction": 0, "continuation": 0}
+    fake.state.calls = calls
+
+    def reply_records(prompt: str) -> tuple:
+        """(records, cut off) for an extraction or continuation prompt"""
+        if truncate_after is None:
+            return records, False
+        if "CONTINUATION:" in prompt:
+            calls["continuation"] += 1
+            return records[truncate_after - 1:], False
+        calls["extraction"] += 1
+        return records[:truncate_after + 1], True
+
+    def render(items: list, cut_off: bool) -> str:
+        text = json.dumps(items)
+        if cut_off:
+            text = text[:text.rindex("{") + 12]
+        return text
+
+    @fake.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "gpt-4o")
+        prompt = prompt_text(body)
+        if prompt.startswith("Which layout"):
+            return JSONResponse(content=chat_completion(layout, model=model, prompt_tokens=len(prompt) // 4, completion_tokens=2))
+        items, cut_off = reply_records(prompt)
+        if not body.get("stream"):
+            await asyncio.sleep(delay)
+            payload = render(items, cut_off)
+            return JSONResponse(content=chat_completion(
+                payload, model=model, prompt_tokens=len(prompt) // 4, completion_tokens=len(payload) // 4
+            ))
+
+        async def events():
+            pieces = ["["] + [json.dumps(r) + ("," if i < len(items) - 1 else "") for i, r in enumerate(items)] + ["]"]
+            if cut_off:
+                pieces[-2:] = [pieces[-2][:12]]
+            for piece in pieces:
+                await asyncio.sleep(delay / max(1, len(items)))
+                yield f"data: {json.dumps(chat_completion_chunk(piece, model))}\n\n"
+            yield f"data: {json.dumps(chat_completion_chunk('', model, 'stop'))}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return fake
+
+
+class BackgroundServer:
+    """Runs an ASGI app with uvicorn on its own thread and event loop"""
+
+    def __init__(self, app, port: int = None):
+        self.port = port or free_port()
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
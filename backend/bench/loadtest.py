@@ -0,0 +1,83 @@
+"""Load test: N parallel /process uploads against a fake OpenAI server.
+
+Usage (from backend/):
+    python bench/loadtest.py --uploads 8 --delay 2
+    python bench/loadtest.py --uploads 8 --identical
+
+With a non-blocking extraction path, N uploads should finish in roughly the
+time of one (as long as N <= OPENAI_MAX_CONCURRENCY), and /health stays fast
+while they are in flight. Each upload is a different image unless
+--identical, which shows concurrent duplicates coalescing into one run.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Every upload should reach the model path
+os.environ.setdefault("RESULT_CACHE_BACKEND", "none")
+
+import httpx
+
+from fakes import BackgroundServer, create_fake_openai_app, make_png
+
+
+async def upload(http: httpx.AsyncClient, url: str, image: bytes, index: int) -> float:
+    started = time.perf_counter()
+    response = await http.post(
+        f"{url}/process",
+        data={"company_name": "Liberty"},
+        files={"policy_file": (f"card_{index}.png", image, "image/png")}
+    )
+    response.raise_for_status()
+    return time.perf_counter() - started
+
+
+async def health_latency(http: httpx.AsyncClient, url: str) -> float:
+    started = time.perf_counter()
+    (await http.get(f"{url}/health")).raise_for_status()
+    return time.perf_counter() - started
+
+
+async def run(url: str, uploads: int, identical: bool):
+    images = [make_png(256, 256, shade=0 if identical else i) for i in range(uploads)]
+    async with httpx.AsyncClient(timeout=None) as http:
+        single = await upload(http, url, make_png(256, 256), 0)
+
+        started = time.perf_counter()
+        batch = asyncio.gather(*(upload(http, url, image, i) for i, image in enumerate(images)))
+        await asyncio.sleep(0.2)
+        health = await health_latency(http, url)
+        per_upload = await batch
+        wall = time.perf_counter() - started
+        coalesced = [line for line in (await http.get(f"{url}/metrics")).text.splitlines()
+                     if line.startswith("policy_coalesced_total")]
+
+    print(f"single upload:          {single:.2f}s")
+    print(f"{uploads} parallel uploads:    {wall:.2f}s wall (slowest {max(per_upload):.2f}s)")
+    print(f"/health during load:    {health * 1000:.1f}ms")
+    print(f"parallel / single:      {wall / single:.2f}x")
+    print(f"coalesced uploads:      {coalesced[0].split()[-1] if coalesced else 0}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uploads", type=int, default=8)
+    parser.add_argument("--delay", type=float, default=2.0, help="fake model latency in seconds")
+    parser.add_argument("--identical", action="store_true", help="upload the same image every time")
+    args = parser.parse_args()
+
+    with BackgroundServer(create_fake_openai_app(delay=args.delay)) as fake_openai:
+        os.environ["OPENAI_BASE_URL"] = f"{fake_openai.url}/v1"
+        os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+
+        import main as backend
+        with BackgroundServer(backend.app) as api:
+            asyncio.run(run(api.url, args.uploads, args.identical))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Record real chat-completion responses once, replay them offline through a fake client or HTTP stub.
+
+Usage (from backend/):
+    # needs OPENAI_API_KEY; runs each image through process_files and saves every model call
+    python bench/replay.py record samples/*.png --fixtures bench/fixtures/corpus
+
+    # replays those calls; no key, no network
+    python bench/replay.py check samples/*.png --fixtures bench/fixtures/corpus
+
+A fixture is one JSON file per distinct request, named by a fingerprint of the
+model, messages (prompt text and image bytes), max_tokens and stream flag.
+Streamed calls store their chunks so replays stream the same way.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FINGERPRINT_FIELDS = ("model", "messages", "max_tokens", "temperature", "stream")
+
+
+def fingerprint(request: dict) -> str:
+    """Stable key for a chat.completions.create call"""
+    relevant = {field: request.get(field) for field in FINGERPRINT_FIELDS}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode("utf-8")).hexdigest()[:24]
+
+
+class FixtureStore:
+    """Directory of recorded responses keyed by request fingerprint"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def save(self, request: dict, response=None, chunks: list = None):
+        os.makedirs(self.directory, exist_ok=True)
+        fixture = {
+            "model": request.get("model"),
+            "stream": bool(request.get("stream")),
+            "response": response,
+            "chunks": chunks
+        }
+        with open(self.path(fingerprint(request)), "w", encoding="utf-8") as handle:
+            json.dump(fixture, handle, indent=1)
+
+    def load(self, request: dict) -> dict:
+        key = fingerprint(request)
+        try:
+            with open(self.path(key), encoding="utf-8") as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            raise LookupError(
+                f"No recorded response {key} for model={request.get('model')} in {self.directory}; "
+                "record it with 'python bench/replay.py record'"
+            ) from None
+
+
+class _Completions:
+    def __init__(self, create):
+        self.create = create
+
+
+class _Chat:
+    def __init__(self, create):
+        self.completions = _Completions(create)
+
+
+class RecordingClient:
+    """Wraps a real AsyncOpenAI client and saves every chat completion it returns"""
+
+    def __init__(self, client, store: FixtureStore):
+        self.client = client
+        self.store = store
+        self.chat = _Chat(self._create)
+
+    async def _create(self, **request):
+        response = await self.client.chat.completions.create(**request)
+        if not request.get("stream"):
+            self.store.save(request, response=response.model_dump(mode="json"))
+            return response
+        return self._record_stream(request, response)
+
+    async def _record_stream(self, request: dict, stream):
+        chunks = []
+        async for chunk in stream:
+            chunks.append(chunk.model_dump(mode="json"))
+            yield chunk
+        self.store.save(request, chunks=chunks)
+
+
+class ReplayClient:
+    """Drop-in AsyncOpenAI stand-in answering from recorded fixtures.
+
+    latency adds a fixed delay per call (spread across chunks when streaming),
+    so benchmarks can model the API without calling it.
+    """
+
+    def __init__(self, store: FixtureStore, latency: float = 0.0):
+        self.store = store
+        self.latency = latency
+        self.calls = 0
+        self.chat = _Chat(self._create)
+
+    async def _create(self, **request):
+        from openai.types.chat import ChatCompletion
+
+        fixture = self.store.load(request)
+        self.calls += 1
+        if not request.get("stream"):
+            await asyncio.sleep(self.latency)
+            return ChatCompletion.model_validate(fixture["response"])
+        return self._replay_stream(fixture["chunks"])
+
+    async def _replay_stream(self, chunks: list):
+        from openai.types.chat import ChatCompletionChunk
+
+        for chunk in chunks:
+            await asyncio.sleep(self.latency / max(1, len(chunks)))
+            yield ChatCompletionChunk.model_validate(chunk)
+
+
+def create_replay_app(store: FixtureStore, latency: float = 0.0):
+    """HTTP stub serving recorded fixtures on /v1/chat/completions (point OPENAI_BASE_URL at it)"""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    stub = FastAPI()
+
+    @stub.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        try:
+            fixture = store.load(body)
+        except LookupError as e:
+            return JSONResponse(status_code=404, content={"error": {"message": str(e), "type": "fixture_missing"}})
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            return JSONResponse(content=fixture["response"])
+
+        async def events():
+            for chunk in fixture["chunks"]:
+                await asyncio.sleep(latency / max(1, len(fixture["chunks"])))
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return stub
+
+
+async def run_corpus(paths: list, company_name: str) -> dict:
+    """process_files over each image; {file name: calculated_data}"""
+    import main as backend
+
+    results = {}
+    for path in paths:
+        with open(path, "rb") as handle:
+            image = handle.read()
+        started = time.perf_counter()
+        result = await backend.process_files(image, os.path.basename(path), "", company_name)
+        results[os.path.basename(path)] = result["calculated_data"]
+        print(f"{os.path.basename(path):40s} {len(result['calculated_data']):5d} records  {time.perf_counter() - started:6.2f}s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("mode", choices=["record", "check"])
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--fixtures", default="bench/fixtures/corpus")
+    parser.add_argument("--company", default="Liberty")
+    args = parser.parse_args()
+
+    # Every image must reach the model path for its calls to be recorded
+    os.environ["RESULT_CACHE_BACKEND"] = "none"
+    os.environ.setdefault("LOCAL_OCR", "off")
+    import main as backend
+
+    store = FixtureStore(args.fixtures)
+    expected_path = os.path.join(args.fixtures, "expected.json")
+    if args.mode == "record":
+        backend.set_openai_client(RecordingClient(backend.get_openai_client(), store))
+        results = asyncio.run(run_corpus(args.images, args.company))
+        with open(expected_path, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=1)
+        print(f"\nRecorded fixtures and expected output in {args.fixtures}")
+        return
+
+    replay = ReplayClient(store)
+    backend.set_openai_client(replay)
+    results = asyncio.run(run_corpus(args.images, args.company))
+    with open(expected_path, encoding="utf-8") as handle:
+        expected = json.load(handle)
+    mismatched = [name for name, records in results.items() if expected.get(name) != records]
+    print(f"\nReplayed {replay.calls} calls; {len(results) - len(mismatched)}/{len(results)} outputs match the recording")
+    if mismatched:
+        print("Mismatched: " + ", ".join(mismatched))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Stress test: concurrent large scans against a worker with a fixed upload memory budget.
+
+Usage (from backend/):
+    python bench/stress_uploads.py                        # 20 concurrent 20 MB TIFFs, 160 MB budget
+    python bench/stress_uploads.py --uploads 10 --budget-mb 96
+
+Runs the API in a separate uvicorn process (so only the worker's memory is
+measured) against a fake OpenAI server, once with the budget off and once
+with it on. Each run uploads the same uncompressed TIFF --uploads times at
+once, under different company names so the uploads are not coalesced, and
+reports the worker's peak RSS growth over its idle baseline. Exits non-zero
+when the budgeted run grows past --budget-mb.
+
+The worker runs with glibc's mmap threshold pinned at 1 MB and two malloc
+arenas, as the containers should. With the defaults glibc raises the
+threshold after the first large free, so later upload-sized buffers come
+from the heap and freed ones stay resident: the budgeted run then peaks
+~100 MB higher. --default-malloc shows that.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from fakes import BackgroundServer, create_fake_openai_app, free_port, make_png
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Large buffers go straight to mmap and back to the OS on free; fewer per-thread arenas to fragment
+MALLOC_ENV = {"MALLOC_MMAP_THRESHOLD_": str(2 ** 20), "MALLOC_ARENA_MAX": "2"}
+
+
+def make_scan(path: str, megabytes: int):
+    """An uncompressed RGB TIFF of about `megabytes`, ruled like a rate card"""
+    from PIL import Image, ImageDraw
+
+    side = int((megabytes * 2 ** 20 / 3) ** 0.5)
+    image = Image.new("RGB", (side, side), "white")
+    draw = ImageDraw.Draw(image)
+    for y in range(side // 20, side - side // 20, 40):
+        draw.line((side // 20, y, side - side // 20, y), fill="black")
+    image.save(path, format="TIFF")
+
+
+def gauge(metrics: str, name: str) -> int:
+    line = next(line for line in metrics.splitlines() if line.startswith(name + " "))
+    return int(float(line.split()[-1]))
+
+
+async def upload(http: httpx.AsyncClient, url: str, path: str, index: int) -> int:
+    with open(path, "rb") as scan:
+        response = await http.post(
+            f"{url}/process",
+            data={"company_name": f"Company {index}"},
+            files={"policy_file": (f"scan_{index}.tiff", scan, "image/tiff")}
+        )
+    return response.status_code
+
+
+async def load(url: str, path: str, uploads: int) -> tuple:
+    async with httpx.AsyncClient(timeout=None) as http:
+        # One small upload first, so imports and connection pools are in the baseline
+        await http.post(f"{url}/process", data={"company_name": "warmup"},
+                        files={"policy_file": ("warmup.png", make_png(256, 256), "image/png")})
+        baseline = gauge((await http.get(f"{url}/metrics")).text, "process_resident_memory_bytes")
+
+        started = time.perf_counter()
+        statuses = await asyncio.gather(*(upload(http, url, path, index) for index in range(uploads)))
+        wall = time.perf_counter() - started
+
+        metrics = (await http.get(f"{url}/metrics")).text
+        budget = (await http.get(f"{url}/health")).json()["memory_budget"]
+    return statuses, wall, gauge(metrics, "process_peak_rss_bytes") - baseline, budget
+
+
+def run_worker(fake_url: str, budget_bytes: int, path: str, uploads: int, malloc_env: dict) -> tuple:
+    port = free_port()
+    env = dict(
+        os.environ,
+        OPENAI_BASE_URL=f"{fake_url}/v1",
+        OPENAI_API_KEY="sk-fake",
+        RESULT_CACHE_BACKEND="none",
+        LOCAL_OCR="off",
+        EXTRACTION_HISTORY="off",
+        UPLOAD_MEMORY_BUDGET_BYTES=str(budget_bytes),
+        **malloc_env
+    )
+    worker = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        while True:
+            try:
+                httpx.get(f"{url}/health").raise_for_status()
+                break
+            except httpx.HTTPError:
+                if worker.poll() is not None:
+                    raise RuntimeError("API worker exited during start-up")
+                time.sleep(0.2)
+        return asyncio.run(load(url, path, uploads))
+    finally:
+        worker.terminate()
+        worker.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uploads", type=int, default=20)
+    parser.add_argument("--size-mb", type=int, default=20)
+    parser.add_argument("--budget-mb", type=int, default=160)
+    parser.add_argument("--delay", type=float, default=1.0, help="fake model latency in seconds")
+    parser.add_argument("--default-malloc", action="store_true", help="run the worker without the malloc settings")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory, BackgroundServer(create_fake_openai_app(delay=args.delay)) as fake:
+        path = os.path.join(directory, "scan.tiff")
+        make_scan(path, args.size_mb)
+        print(f"{args.uploads} concurrent uploads of a {os.path.getsize(path) / 2 ** 20:.1f} MB TIFF")
+
+        growth = None
+        for name, budget_mb in (("unbounded", 0), (f"{args.budget_mb} MB budget", args.budget_mb)):
+            statuses, wall, growth, budget = run_worker(
+                fake.url, budget_mb * 2 ** 20, path, args.uploads, {} if args.default_malloc else MALLOC_ENV
+            )
+            ok = sum(status == 200 for status in statuses)
+            print(f"{name:16s} {wall:6.2f}s  {ok}/{len(statuses)} ok  peak RSS +{growth / 2 ** 20:6.1f} MB  "
+                  f"reserved peak {budget['peak'] / 2 ** 20:6.1f} MB")
+
+        within = growth <= args.budget_mb * 2 ** 20
+        print(f"budgeted run {'stayed within' if within else 'EXCEEDED'} {args.budget_mb} MB")
+        sys.exit(0 if within else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""Content-addressed cache for extraction results, and single-flight coalescing of identical in-flight work"""
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from telemetry import COALESCED
+
+logger = logging.getLogger(__name__)
+
+# A hit refreshes an entry's LRU position at most this often, so reads rarely write
+SQLITE_TOUCH_SECONDS = float(os.getenv("RESULT_CACHE_TOUCH_SECONDS", "3600"))
+
+
+def make_cache_key(file_bytes: bytes, version: str) -> str:
+    """Key = hash of the image bytes + prompt/model version"""
+    digest = hashlib.sha256(file_bytes).hexdigest()
+    return f"{version}:{digest}"
+
+
+class ResultCache:
+    """Base class: tracks hit/miss counts, subclasses do the storage"""
+
+    name = "none"
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        # Lookups run on worker threads
+        self._counts_lock = threading.Lock()
+
+    def get(self, key: str):
+        value = self._get(key)
+        with self._counts_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: str):
+        self._set(key, value)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "hits": self.hits, "misses": self.misses}
+
+    def _get(self, key: str):
+        return None
+
+    def _set(self, key: str, value: str):
+        pass
+
+
+class MemoryResultCache(ResultCache):
+    """In-process LRU with size and TTL eviction"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 86400):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if self.ttl_seconds and time.time() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteResultCache(ResultCache):
+    """On-disk cache that survives restarts.
+
+    Every call can wait on another process's write (up to the 30 s busy
+    timeout), so callers on the event loop go through asyncio.to_thread.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str, max_entries: int = 100000, ttl_seconds: float = 30 * 86400,
+                 touch_seconds: float = SQLITE_TOUCH_SECONDS):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.touch_seconds = touch_seconds
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Several worker processes may share the file; wait out their writes instead of failing
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS result_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS result_cache_lru ON result_cache (last_access)")
+        self._conn.commit()
+
+    def _get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at, last_access FROM result_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at, last_access = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            if now - last_access > self.touch_seconds:
+                self._conn.execute("UPDATE result_cache SET last_access = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+            return value
+
+    def _set(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO result_cache (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            overflow = self._conn.execute("SELECT COUNT(*) FROM result_cache").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM result_cache WHERE key IN "
+                    "(SELECT key FROM result_cache ORDER BY last_access LIMIT ?)",
+                    (overflow,)
+                )
+            self._conn.commit()
+
+
+def create_result_cache() -> ResultCache:
+    """Build the cache backend selected by RESULT_CACHE_BACKEND (memory, sqlite, none)"""
+    backend = os.getenv("RESULT_CACHE_BACKEND", "memory").lower()
+    max_entries = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+    ttl_seconds = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "86400"))
+
+    if backend == "sqlite":
+        path = os.getenv("RESULT_CACHE_PATH", "data/result_cache.sqlite3")
+        # On disk, shared by every worker: sized well past what one process could keep in memory
+        sqlite_max_entries = int(os.getenv("RESULT_CACHE_SQLITE_MAX_ENTRIES", "100000"))
+        logger.info(f"✅ Using SQLite result cache at {path}")
+        return SQLiteResultCache(path, max_entries=sqlite_max_entries, ttl_seconds=ttl_seconds)
+    if backend == "memory":
+        return MemoryResultCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+    return ResultCache()
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """At most one run per key at a time; concurrent callers with the same key share its result.
+
+    The work runs in its own task, so the caller that started it can be
+    cancelled (a client disconnect) without failing the others. It is only
+    cancelled once every caller has gone away.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.leaders = 0
+        self.followers = 0
+        self._flights = {}
+
+    async def run(self, key: str, factory):
+        """Result of `await factory()`, started now or joined if a run for `key` is already in flight"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight(asyncio.create_task(factory()))
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.leaders += 1
+        else:
+            self.followers += 1
+            COALESCED.inc(operation=self.name)
+            logger.info(f"🔁 Joined in-flight {self.name} ({flight.waiters} waiting)")
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Nobody is left to use the result; new callers start afresh
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._flights), "leaders": self.leaders, "coalesced": self.followers}
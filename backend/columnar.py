@@ -0,0 +1,155 @@
+"""Columnar payin classification and payout computation over pandas/NumPy"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+from rules import OUTPUT_COLUMNS, PAGE_COLUMN, PAYIN_BAND_BOUNDS, PAYIN_CATEGORIES
+from telemetry import stage
+
+logger = logging.getLogger(__name__)
+
+NUMBER_TYPES = (int, float, bool, np.integer, np.floating)
+
+
+def _float_or_zero(text: str) -> float:
+    """Slow path for the few payin strings pandas could not parse (same rules as classify_payin)"""
+    if not text or text.upper() == 'N/A':
+        return 0.0
+    try:
+        return float(text)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def record_column(policy_data: list, key: str, default) -> list:
+    """One field of every record as a plain list, record.get(key, default) as apply_formula reads it.
+
+    Built in Python rather than through a DataFrame: pandas' string dtype
+    turns both absent keys and explicit None into NaN, which the row path
+    tells apart.
+    """
+    return [record.get(key, default) for record in policy_data]
+
+
+def parse_payin_column(payin: pd.Series) -> np.ndarray:
+    """Vectorized classify_payin value parsing: numbers as-is, strings stripped of %, spaces and '-'"""
+    if pd.api.types.is_numeric_dtype(payin.dtype):
+        return payin.to_numpy(dtype=float)
+
+    all_text = pd.api.types.infer_dtype(payin, skipna=False) == 'string'
+    if all_text:
+        numeric_mask = np.zeros(len(payin), dtype=bool)
+    else:
+        numeric_mask = payin.map(lambda v: isinstance(v, NUMBER_TYPES)).to_numpy(dtype=bool)
+    values = np.zeros(len(payin), dtype=float)
+    if numeric_mask.any():
+        values[numeric_mask] = payin[numeric_mask].astype(float).to_numpy()
+
+    text_mask = ~numeric_mask
+    if text_mask.any():
+        texts = payin[text_mask]
+        if not all_text:
+            # str() per value as classify_payin does; astype(str) would turn None into NaN
+            texts = texts.map(str)
+        cleaned = (
+            texts
+            .str.replace('%', '', regex=False)
+            .str.replace(' ', '', regex=False)
+            .str.replace('-', '', regex=False)
+            .str.strip()
+        )
+        parsed = pd.to_numeric(cleaned, errors='coerce')
+        failed = parsed.isna()
+        if failed.any():
+            parsed[failed] = cleaned[failed].map(_float_or_zero)
+            unparsed = int((parsed[failed] == 0).sum())
+            if unparsed:
+                logger.warning(f"Could not parse {unparsed} payin values, using 0")
+        values[text_mask] = parsed.to_numpy(dtype=float)
+
+    return values
+
+
+def classify_payin_column(values: np.ndarray) -> np.ndarray:
+    """Payin band index (into PAYIN_CATEGORIES) per value; NaN falls through to the top band"""
+    low, mid, high = PAYIN_BAND_BOUNDS
+    return np.select([values <= low, values <= mid, values <= high], [0, 1, 2], default=3)
+
+
+def compute_payouts(segments: pd.Series, values: np.ndarray, bands: np.ndarray, rule_index) -> tuple:
+    """(payout, formula_used, rule_explanation) arrays; rules are resolved once per distinct (segment, band)"""
+    segment_codes, segment_uniques = pd.factorize(segments)
+    pair_codes, codes = np.unique(segment_codes * len(PAYIN_CATEGORIES) + bands, return_inverse=True)
+
+    operations, amounts, formulas, explanations = [], [], [], []
+    for pair in pair_codes.tolist():
+        segment = segment_uniques[pair // len(PAYIN_CATEGORIES)]
+        category = PAYIN_CATEGORIES[pair % len(PAYIN_CATEGORIES)]
+        rule = rule_index.match(segment, category)
+        if rule is None:
+            lob, segment_upper, _ = rule_index.segment_info(segment)
+            operations.append("unmatched")
+            amounts.append(0.0)
+            formulas.append("No matching rule")
+            explanations.append(f"No rule for LOB={lob}, Segment={segment_upper}")
+        else:
+            operations.append(rule.operation)
+            amounts.append(rule.amount)
+            formulas.append(rule.po)
+            explanations.append(rule.explanation)
+
+    operation = np.asarray(operations, dtype=object)[codes]
+    amount = np.asarray(amounts, dtype=float)[codes]
+
+    payout = np.where(operation == "multiply", values * amount,
+                      np.where(operation == "subtract", values - amount, values))
+    # max(0, x) on matched rows; like Python's max(0, nan) this yields 0 for NaN
+    matched = operation != "unmatched"
+    clamped = np.where(np.isnan(payout), 0.0, np.maximum(payout, 0.0))
+    payout = np.where(matched, clamped, payout)
+
+    return payout, np.asarray(formulas, dtype=object)[codes], np.asarray(explanations, dtype=object)[codes]
+
+
+def _remark_text(value) -> str:
+    if isinstance(value, list):
+        return '; '.join(str(r) for r in value)
+    return str(value)
+
+
+def calculate_frame(policy_data: list, rule_index) -> pd.DataFrame:
+    """Columnar equivalent of classify_payin + apply_formula, record for record.
+
+    Also writes Payin_Value / Payin_Category back onto each parsed record so
+    the parsed_data in the response keeps its shape.
+    """
+    with stage("classify_payin"):
+        # Missing payin counts as 0, like record.get('payin', 0); null fails to parse and also gives 0
+        payins = pd.Series(record_column(policy_data, 'payin', 0), dtype=object)
+        values = parse_payin_column(payins)
+        bands = classify_payin_column(values)
+        categories = np.asarray(PAYIN_CATEGORIES, dtype=object)[bands]
+
+    with stage("apply_formula"):
+        segments = pd.Series([str(segment) for segment in record_column(policy_data, 'segment', '')], dtype=object)
+        payout, formulas, explanations = compute_payouts(segments, values, bands, rule_index)
+
+    for record, value, category in zip(policy_data, values.tolist(), categories.tolist()):
+        record['Payin_Value'] = value
+        record['Payin_Category'] = category
+
+    pages = {}
+    if any(PAGE_COLUMN in record for record in policy_data):
+        pages[PAGE_COLUMN] = pd.Series(record_column(policy_data, PAGE_COLUMN, None), dtype=object)
+    return pd.DataFrame({
+        **pages,
+        'segment': segments,
+        'policy type': pd.Series(record_column(policy_data, 'policy_type', 'Comp'), dtype=object),
+        'location': pd.Series(record_column(policy_data, 'location', 'N/A'), dtype=object),
+        'payin': [f"{v:.2f}%" for v in values.tolist()],
+        'remark': pd.Series([_remark_text(remark) for remark in record_column(policy_data, 'remark', '')], dtype=object),
+        'Calculated Payout': [f"{v:.2f}%" for v in payout.tolist()],
+        'Formula Used': formulas,
+        'Rule Explanation': explanations
+    }, columns=list(pages) + OUTPUT_COLUMNS)
@@ -0,0 +1,240 @@
+"""CPU-bound result building (formulas, DataFrame, workbook, base64, CSV, JSON) in a process pool.
+
+On the event loop these hold the GIL for hundreds of milliseconds on a big
+card and stall every other request in the worker. Each pipeline step here
+is one pool call: the parsed records go in, and only what the response
+needs comes back, already serialized (a workbook meant for download comes
+back as a temporary file path rather than bytes). Stage timings recorded in
+the pool process are returned with the result and merged into the request's.
+"""
+import asyncio
+import base64
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from telemetry import observe_stage, stage, track_request
+
+logger = logging.getLogger(__name__)
+
+# Pool processes per API worker; auto = its share of the cores (WEB_CONCURRENCY workers), at most 4.
+# 0 runs the same functions on a thread: the event loop keeps serving, but shares the GIL with them
+CPU_POOL_WORKERS = os.getenv("CPU_POOL_WORKERS", "auto").lower()
+CPU_POOL_MAX_AUTO_WORKERS = 4
+
+
+def pool_size(setting: str = CPU_POOL_WORKERS) -> int:
+    if setting != "auto":
+        return max(0, int(setting))
+    # Even on one core a process is worth its ~80 MB: the OS preempts it, whereas a thread
+    # holds the GIL through long pandas/openpyxl calls and stalls the loop for ~100 ms at a time
+    cores = os.cpu_count() or 1
+    web_workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    return min(CPU_POOL_MAX_AUTO_WORKERS, max(1, cores // web_workers))
+
+
+# Compiled per rules version in each process, so the rules travel as plain data
+_rule_indexes = {}
+
+
+def _rule_index(formula_data: list, rules_version: str):
+    index = _rule_indexes.get(rules_version)
+    if index is None:
+        from rules import compile_formula_data
+        index = _rule_indexes[rules_version] = compile_formula_data(formula_data)
+    return index
+
+
+def build_excel(df, company_name: str) -> bytes:
+    """Render the calculated records as a titled Excel workbook"""
+    from excel_export import frame_sheet, workbook_bytes
+    return workbook_bytes([frame_sheet(df, 'Policy Data', f"{company_name} - Policy Data")])
+
+
+def build_outputs(policy_data: list, formula_data: list, rules_version: str, company_name: str,
+                  outputs: tuple = ()) -> dict:
+    """Calculate the records and render the requested outputs.
+
+    Always returns policy_data (with Payin_Value / Payin_Category added) and
+    calculated_data; outputs adds "excel" (base64), "xlsx_file" (path of a
+    temporary workbook the caller removes), "csv" and "json" (indented).
+    """
+    from columnar import calculate_frame
+
+    df = calculate_frame(policy_data, _rule_index(formula_data, rules_version))
+    result = {"policy_data": policy_data, "calculated_data": df.to_dict('records')}
+    if "excel" in outputs:
+        with stage("excel_build"):
+            result["excel_data"] = base64.b64encode(build_excel(df, company_name)).decode('utf-8')
+    if "xlsx_file" in outputs:
+        result["xlsx_file"] = write_xlsx_file(df, company_name)
+    if "csv" in outputs:
+        with stage("csv_build"):
+            result["csv_data"] = df.to_csv(index=False)
+    if "json" in outputs:
+        with stage("json_build"):
+            result["json_data"] = json.dumps(result["calculated_data"], indent=2)
+    return result
+
+
+def calculated_frame(calculated_data: list):
+    import pandas as pd
+    from rules import output_columns
+    return pd.DataFrame(calculated_data, columns=output_columns(calculated_data))
+
+
+def write_xlsx_file(df, company_name: str) -> str:
+    """Path of a temporary workbook of df (the caller removes it)"""
+    from excel_export import frame_sheet, write_workbook
+    with stage("excel_build"), tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as workbook:
+        write_workbook(workbook, [frame_sheet(df, 'Policy Data', f"{company_name} - Policy Data")])
+    return workbook.name
+
+
+def records_xlsx_file(calculated_data: list, company_name: str) -> str:
+    """write_xlsx_file for already calculated records"""
+    return write_xlsx_file(calculated_frame(calculated_data), company_name)
+
+
+def build_batch_outputs(files: list, company_name: str) -> dict:
+    """Consolidate (sheet name, filename, calculated_data) per file: one sheet each plus a consolidated sheet"""
+    import pandas as pd
+    from excel_export import frame_sheet, workbook_bytes
+
+    frames = [(sheet_name, filename, calculated_frame(calculated_data)) for sheet_name, filename, calculated_data in files]
+    consolidated = pd.concat([df.assign(**{"source file": filename}) for _, filename, df in frames], ignore_index=True)
+    consolidated = consolidated[["source file"] + [c for c in consolidated.columns if c != "source file"]]
+    with stage("excel_build"):
+        excel_bytes = workbook_bytes(
+            [frame_sheet(consolidated, 'Consolidated', f"{company_name} - Consolidated Policy Data")]
+            + [frame_sheet(df, sheet_name, f"{company_name} - {filename}") for sheet_name, filename, df in frames]
+        )
+    return {
+        "calculated_data": consolidated.to_dict('records'),
+        "excel_data": base64.b64encode(excel_bytes).decode('utf-8'),
+        "unique_segments": len(set(consolidated['segment']))
+    }
+
+
+def records_excel(calculated_data: list, company_name: str) -> str:
+    """Base64 workbook straight from calculated records (the streamed response's final event)"""
+    from excel_export import workbook_bytes
+    from rules import output_columns
+    with stage("excel_build"):
+        excel_bytes = workbook_bytes(
+            [('Policy Data', f"{company_name} - Policy Data", output_columns(calculated_data), calculated_data)]
+        )
+    return base64.b64encode(excel_bytes).decode('utf-8')
+
+
+def render_artifact(fmt: str, calculated_data: list, company_name: str) -> bytes:
+    """One download format of a slim response's records"""
+    if fmt == "xlsx":
+        return build_excel(calculated_frame(calculated_data), company_name)
+    if fmt == "csv":
+        return calculated_frame(calculated_data).to_csv(index=False).encode('utf-8')
+    return json.dumps(calculated_data).encode('utf-8')
+
+
+# How often a pool process checks that the API worker that started it is still there
+PARENT_CHECK_SECONDS = 1.0
+
+
+def _exit_with_parent(parent_pid: int):
+    while os.getppid() == parent_pid:
+        time.sleep(PARENT_CHECK_SECONDS)
+    os._exit(0)
+
+
+def _warm(parent_pid: int):
+    """Pool initializer: import the heavy modules before the first call needs them.
+
+    Also exits the process once its API worker is gone (killed, OOM), which
+    would otherwise leave it blocked on the call queue, holding the worker's stdout.
+    """
+    threading.Thread(target=_exit_with_parent, args=(parent_pid,), daemon=True).start()
+    import columnar  # noqa: F401 (pandas, numpy)
+    import openpyxl  # noqa: F401
+
+
+def _traced(fn, args: tuple) -> tuple:
+    """Run fn in a pool process: (its result, the stage timings it recorded)"""
+    with track_request() as timings:
+        result = fn(*args)
+    return result, timings.stages
+
+
+class CPUPool:
+    """Runs build functions in worker processes (or on a thread when it has none)"""
+
+    def __init__(self, workers: int = None):
+        self.workers = pool_size() if workers is None else workers
+        self._executor = None
+
+    def start(self):
+        if self.workers and self._executor is None:
+            # spawn: a forked child would inherit the event loop's threads' locks in whatever state they were
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=_warm,
+                initargs=(os.getpid(),)
+            )
+            logger.info(f"✅ CPU pool with {self.workers} processes")
+
+    async def warm(self):
+        """Start every pool process now rather than on the first requests"""
+        self.start()
+        if self._executor is not None:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(self._executor, time.sleep, 0.05) for _ in range(self.workers)))
+
+    def shutdown(self, wait: bool = False):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+    def _merge(self, result: tuple):
+        value, stages = result
+        for name, seconds in stages.items():
+            observe_stage(name, seconds)
+        return value
+
+    def _broken(self):
+        # A pool process died (usually the OOM killer); later calls get a fresh pool
+        logger.error("❌ A CPU pool process died, restarting the pool")
+        self.shutdown()
+
+    async def run(self, fn, *args):
+        """await fn(*args) off the event loop"""
+        started = time.perf_counter()
+        try:
+            if not self.workers:
+                return await asyncio.to_thread(fn, *args)
+            self.start()
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(self._executor, _traced, fn, args)
+            except BrokenProcessPool:
+                self._broken()
+                raise
+            return self._merge(result)
+        finally:
+            observe_stage("cpu_pool", time.perf_counter() - started)
+
+    def call(self, fn, *args):
+        """fn(*args) from a worker thread (not the event loop), blocking only that thread"""
+        if not self.workers:
+            return fn(*args)
+        self.start()
+        try:
+            return self._merge(self._executor.submit(_traced, fn, args).result())
+        except BrokenProcessPool:
+            self._broken()
+            raise
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "mode": "process" if self.workers else "thread"}
@@ -0,0 +1,72 @@
+"""Streaming, write-only Excel export that bypasses pandas' ExcelWriter"""
+import tempfile
+from functools import lru_cache
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# Spool the finished workbook in memory up to this size, then on disk
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+
+@lru_cache(maxsize=None)
+def _styles() -> dict:
+    """Predefined styles matching what the old pandas builder produced cell by cell (openpyxl loaded on first use)"""
+    from openpyxl.styles import Alignment, Font
+    return {
+        "header_font": Font(bold=True),
+        "title_font": Font(bold=True, size=14),
+        "title_alignment": Alignment(horizontal="center")
+    }
+
+
+def _styled(worksheet, value, font, alignment=None):
+    from openpyxl.cell import WriteOnlyCell
+    cell = WriteOnlyCell(worksheet, value=value)
+    cell.font = font
+    if alignment is not None:
+        cell.alignment = alignment
+    return cell
+
+
+def _clean(value):
+    # NaN/None become empty cells, like DataFrame.to_excel
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return value
+
+
+def write_sheet(workbook, sheet_name: str, title: str, columns: list, rows):
+    """Append a titled sheet: title (merged) on row 1, headers on row 3, then one row per item of rows"""
+    from openpyxl.utils import get_column_letter
+    styles = _styles()
+    worksheet = workbook.create_sheet(sheet_name)
+    worksheet.append([_styled(worksheet, title, styles["title_font"], styles["title_alignment"])])
+    worksheet.append([])
+    worksheet.append([_styled(worksheet, column, styles["header_font"]) for column in columns])
+    for row in rows:
+        if isinstance(row, dict):
+            row = [row.get(column) for column in columns]
+        worksheet.append([_clean(value) for value in row])
+    worksheet.merged_cells.add(f"A1:{get_column_letter(max(1, len(columns)))}1")
+    return worksheet
+
+
+def write_workbook(fileobj, sheets: list):
+    """Write (sheet_name, title, columns, rows) sheets to a binary file object"""
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    for sheet_name, title, columns, rows in sheets:
+        write_sheet(workbook, sheet_name, title, columns, rows)
+    workbook.save(fileobj)
+
+
+def workbook_bytes(sheets: list) -> bytes:
+    """The workbook as a single bytes object"""
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+        write_workbook(spool, sheets)
+        spool.seek(0)
+        return spool.read()
+
+
+def frame_sheet(df, sheet_name: str, title: str) -> tuple:
+    """Sheet spec for a DataFrame, streaming its rows as plain tuples"""
+    return sheet_name, title, list(df.columns), df.itertuples(index=False, name=None)
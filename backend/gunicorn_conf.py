@@ -0,0 +1,43 @@
+"""Multi-worker deployment: several API processes on one host, sharing state through local storage.
+
+    gunicorn -c gunicorn_conf.py main:app      # WEB_CONCURRENCY workers, default one per core
+    WEB_CONCURRENCY=4 python main.py           # the same with uvicorn's own process manager
+
+Each worker is a separate process with its own event loop and CPU pool
+(cpu_pool.py sizes the pool to the worker's share of the cores). What must
+be seen by every worker lives under data/, in SQLite (WAL mode: safe across
+processes on one host, not on a network filesystem) or plain files:
+
+- extraction results: RESULT_CACHE_BACKEND=sqlite, at RESULT_CACHE_PATH
+  (RESULT_CACHE_SQLITE_MAX_ENTRIES, not the in-memory RESULT_CACHE_MAX_ENTRIES)
+- slim-response downloads: ARTIFACT_STORE_PATH
+- background jobs: JOB_DB_PATH; every worker runs job workers unless
+  JOB_WORKERS_IN_PROCESS=0, and claims are atomic
+- extraction history: EXTRACTION_HISTORY_PATH
+
+Still per worker: coalescing of identical uploads, the upload memory budget
+(size UPLOAD_MEMORY_BUDGET_BYTES as the host's budget / workers), /metrics and
+/routing/stats (scrape each worker). OpenAI RPM/TPM limits are the key's quota;
+each worker paces itself to 1/WEB_CONCURRENCY of it.
+"""
+import multiprocessing
+import os
+
+# Set for the workers unless already configured; the in-process defaults would give each worker its own copy
+MULTI_WORKER_DEFAULTS = {
+    "RESULT_CACHE_BACKEND": "sqlite",
+    "ARTIFACT_STORE_PATH": "data/artifacts"
+}
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+# uvicorn-worker package: uvicorn.workers.UvicornWorker is deprecated
+worker_class = "uvicorn_worker.UvicornWorker"
+# Extractions can wait on the model (and its retries) for minutes
+timeout = 300
+graceful_timeout = 60
+
+# Read by each worker: cpu_pool.py sizes its pool and the scheduler splits the rate limits with it
+os.environ.setdefault("WEB_CONCURRENCY", str(workers))
+for name, value in MULTI_WORKER_DEFAULTS.items():
+    os.environ.setdefault(name, value)
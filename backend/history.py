@@ -0,0 +1,337 @@
+"""Persisted extraction history: payouts recomputed when the rules change, and indexed lookups over past rate cards.
+
+Every processed upload keeps its parsed records (segment, payin and the
+pass-through columns) with the image hash, company and timestamp, one run per
+(image, company). When FORMULA_DATA is corrected, recompute re-runs the payin
+bands and formula rules column-wise over every stored record and reports the
+payouts that changed (records without a parsed payin, or whose calculation
+failed, are left as stored):
+
+    python history.py recompute                      # dry run, print the diff summary
+    python history.py recompute --output diff.csv    # write every changed row
+    python history.py recompute --company Liberty --apply
+
+Records also carry normalized location / segment / LOB / policy type keys and
+their effective date (the upload day), each indexed together with the date,
+so query() filters and aggregates through an index range instead of a scan:
+
+    python history.py query --location Pune --segment "TW TP" --date-from 2025-04-01 --date-to 2025-06-30
+    python history.py query --lob TW --group-by location
+"""
+import argparse
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from rules import determine_lob
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_HISTORY = os.getenv("EXTRACTION_HISTORY", "on").lower()
+EXTRACTION_HISTORY_PATH = os.getenv("EXTRACTION_HISTORY_PATH", "data/history.sqlite3")
+
+# Query filters / group-by names -> indexed record columns
+QUERY_FILTERS = {
+    "location": "location_key",
+    "segment": "segment_key",
+    "lob": "lob",
+    "policy_type": "policy_type_key",
+    "company_name": "company_name"
+}
+GROUP_BY_COLUMNS = dict(QUERY_FILTERS, date="effective_date", month="substr(effective_date, 1, 7)")
+ROW_COLUMNS = ["effective_date", "company_name", "segment", "lob", "policy_type", "location", "remark", "payin", "payout", "formula"]
+QUERY_MAX_ROWS = int(os.getenv("HISTORY_QUERY_MAX_ROWS", "10000"))
+
+# Each filter leads an index with the date next, so a filter + date range is one index range. The
+# common lookups also carry payout/payin, so aggregates are answered from the index without table reads.
+INDEXES = {
+    "records_location": "location_key, segment_key, effective_date, payout, payin",
+    "records_segment": "segment_key, effective_date, location_key, payout, payin",
+    "records_lob": "lob, effective_date, location_key, payout, payin",
+    "records_policy_type": "policy_type_key, effective_date",
+    "records_company_name": "company_name, effective_date",
+    "records_date": "effective_date"
+}
+
+# Columns added after the first release of the store, backfilled on open
+INDEXED_COLUMNS = {
+    "company_name": "TEXT", "effective_date": "TEXT", "location_key": "TEXT",
+    "segment_key": "TEXT", "lob": "TEXT", "policy_type_key": "TEXT"
+}
+
+DIFF_COLUMNS = [
+    "image_hash", "company_name", "filename", "position", "segment", "payin",
+    "old_payout", "new_payout", "old_formula", "new_formula"
+]
+
+
+def normalize_key(text) -> str:
+    """'  Pune ' / 'PUNE' / 'pune.' -> 'PUNE'; 'TW-TP' -> 'TW TP'"""
+    return re.sub(r'[^0-9A-Z+&]+', ' ', str(text or '').upper()).strip()
+
+
+def effective_date(timestamp: float) -> str:
+    return time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+
+
+def payout_number(text):
+    """63.0 for '63.00%'; None for 'Error' and other non-numbers"""
+    try:
+        return float(str(text).rstrip('%'))
+    except ValueError:
+        return None
+
+
+class HistoryStore:
+    """SQLite tables of runs and their records; payouts are stored as numbers, rounded like the output"""
+
+    def __init__(self, path: str = EXTRACTION_HISTORY_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            "id INTEGER PRIMARY KEY, image_hash TEXT NOT NULL, company_name TEXT NOT NULL, filename TEXT, "
+            "created_at REAL NOT NULL, rules_version TEXT, UNIQUE (image_hash, company_name))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "run_id INTEGER NOT NULL, position INTEGER NOT NULL, segment TEXT, policy_type TEXT, location TEXT, "
+            "remark TEXT, payin REAL, payout REAL, formula TEXT, company_name TEXT, effective_date TEXT, "
+            "location_key TEXT, segment_key TEXT, lob TEXT, policy_type_key TEXT, PRIMARY KEY (run_id, position)) WITHOUT ROWID"
+        )
+        self._add_indexed_columns()
+        for name, columns in INDEXES.items():
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON records ({columns})")
+        self._conn.commit()
+
+    def _add_indexed_columns(self):
+        """Add and backfill the query columns on a store created before they existed"""
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(records)")}
+        missing = [column for column in INDEXED_COLUMNS if column not in existing]
+        if not missing:
+            return
+        for column in missing:
+            self._conn.execute(f"ALTER TABLE records ADD COLUMN {column} {INDEXED_COLUMNS[column]}")
+        rows = self._conn.execute(
+            "SELECT r.run_id, r.position, r.segment, r.location, r.policy_type, runs.company_name, runs.created_at "
+            "FROM records r JOIN runs ON runs.id = r.run_id"
+        ).fetchall()
+        self._conn.executemany(
+            "UPDATE records SET company_name = ?, effective_date = ?, location_key = ?, segment_key = ?, lob = ?, "
+            "policy_type_key = ? WHERE run_id = ? AND position = ?",
+            [(company, effective_date(created_at), normalize_key(location), normalize_key(segment),
+              determine_lob(segment or ''), normalize_key(policy_type), run_id, position)
+             for run_id, position, segment, location, policy_type, company, created_at in rows]
+        )
+        logger.info(f"✅ Added query columns to {len(rows)} stored records")
+
+    def save(self, image_hash: str, company_name: str, filename: str, calculated_data: list,
+             payin_values: list, rules_version: str, created_at: float = None):
+        """Store (or replace) the records of one upload; calculated_data rows use OUTPUT_COLUMNS keys"""
+        now = created_at or time.time()
+        day = effective_date(now)
+        rows = [
+            (row["segment"], row["policy type"], row["location"], row["remark"], payin,
+             payout_number(row["Calculated Payout"]), row["Formula Used"], company_name, day,
+             normalize_key(row["location"]), normalize_key(row["segment"]), determine_lob(str(row["segment"] or '')),
+             normalize_key(row["policy type"]))
+            for row, payin in zip(calculated_data, payin_values)
+        ]
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO runs (image_hash, company_name, filename, created_at, rules_version) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (image_hash, company_name) DO UPDATE SET "
+                "filename = excluded.filename, created_at = excluded.created_at, rules_version = excluded.rules_version",
+                (image_hash, company_name, filename, now, rules_version)
+            )
+            run_id = self._conn.execute(
+                "SELECT id FROM runs WHERE image_hash = ? AND company_name = ?", (image_hash, company_name)
+            ).fetchone()[0]
+            self._conn.execute("DELETE FROM records WHERE run_id = ?", (run_id,))
+            self._conn.executemany(
+                "INSERT INTO records (run_id, position, segment, policy_type, location, remark, payin, payout, formula, "
+                "company_name, effective_date, location_key, segment_key, lob, policy_type_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, index) + row for index, row in enumerate(rows)]
+            )
+
+    def load(self, company_name: str = None):
+        """Every stored record with its run columns, as one DataFrame"""
+        import pandas as pd
+
+        query = (
+            "SELECT r.run_id, r.position, runs.image_hash, runs.company_name, runs.filename, "
+            "r.segment, r.payin, r.payout, r.formula "
+            "FROM records r JOIN runs ON runs.id = r.run_id"
+        )
+        params = ()
+        if company_name:
+            query += " WHERE runs.company_name = ?"
+            params = (company_name,)
+        with self._lock:
+            return pd.read_sql_query(query + " ORDER BY r.run_id, r.position", self._conn, params=params)
+
+    def recompute(self, rule_index, rules_version: str, company_name: str = None, apply: bool = False) -> dict:
+        """Re-run the payin bands and rules over stored records: summary plus a DataFrame of changed rows.
+
+        Records without a parsed payin (stored as NULL) and records whose
+        calculation failed ("Error") are skipped and keep their stored payout;
+        re-classifying them would turn them into 0% payins. With apply, the
+        changed payouts are written back and rules_version is set on the runs
+        that had records recomputed, not on runs made only of skipped records.
+        """
+        import numpy as np
+        from columnar import classify_payin_column, compute_payouts
+
+        started = time.perf_counter()
+        loaded = self.load(company_name)
+        recomputable = loaded["payin"].notna() & (loaded["formula"] != "Error")
+        frame = loaded[recomputable].reset_index(drop=True)
+        values = frame["payin"].to_numpy(dtype=float)
+        payout, formulas, _ = compute_payouts(frame["segment"].fillna(""), values, classify_payin_column(values), rule_index)
+        # Compare at the precision the output shows
+        new_payout = np.round(payout, 2)
+        old_payout = frame["payout"].to_numpy(dtype=float)
+        changed = ~np.isclose(old_payout, new_payout, equal_nan=True) | (frame["formula"].to_numpy() != formulas)
+
+        diff = frame.loc[changed, ["image_hash", "company_name", "filename", "position", "segment", "payin"]].assign(
+            old_payout=old_payout[changed], new_payout=new_payout[changed],
+            old_formula=frame["formula"].to_numpy()[changed], new_formula=formulas[changed]
+        )[DIFF_COLUMNS]
+
+        run_ids = sorted(set(frame["run_id"].tolist()))
+        if apply and run_ids:
+            updates = list(zip(new_payout[changed].tolist(), formulas[changed].tolist(),
+                               frame["run_id"][changed].tolist(), frame["position"][changed].tolist()))
+            with self._lock, self._conn:
+                self._conn.executemany("UPDATE records SET payout = ?, formula = ? WHERE run_id = ? AND position = ?", updates)
+                self._conn.executemany("UPDATE runs SET rules_version = ? WHERE id = ?", [(rules_version, i) for i in run_ids])
+
+        summary = {
+            "rules_version": rules_version,
+            "runs": int(loaded["run_id"].nunique()),
+            "records": len(loaded),
+            "skipped_records": int((~recomputable).sum()),
+            "changed_records": len(diff),
+            "changed_runs": int(frame["run_id"][changed].nunique()),
+            "applied": bool(apply),
+            "updated_runs": len(run_ids) if apply else 0,
+            "seconds": round(time.perf_counter() - started, 3)
+        }
+        logger.info(f"🔁 Recomputed {summary['records'] - summary['skipped_records']} records from {summary['runs']} runs "
+                    f"({summary['skipped_records']} skipped): {summary['changed_records']} changed")
+        return {"summary": summary, "diff": diff}
+
+
+    def query(self, filters: dict = None, date_from: str = None, date_to: str = None,
+              group_by: list = (), limit: int = 1000) -> dict:
+        """Matching records (newest first), or count/avg/min/max payout per group_by combination.
+
+        filters maps QUERY_FILTERS names to values (normalized like the stored
+        keys); dates are inclusive YYYY-MM-DD bounds on the effective date.
+        """
+        sql, params = self._query_sql(filters, date_from, date_to, group_by, limit)
+        started = time.perf_counter()
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            columns = [description[0] for description in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        return {"rows": rows, "count": len(rows), "truncated": len(rows) == params[-1],
+                "seconds": round(time.perf_counter() - started, 4)}
+
+    def explain(self, filters: dict = None, date_from: str = None, date_to: str = None, group_by: list = ()) -> list:
+        """SQLite's plan for the same query() call, e.g. to check which index it searches"""
+        sql, params = self._query_sql(filters, date_from, date_to, group_by, QUERY_MAX_ROWS)
+        with self._lock:
+            return [row[-1] for row in self._conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+    def _query_sql(self, filters: dict, date_from: str, date_to: str, group_by: list, limit: int) -> tuple:
+        unknown = [name for name in filters or {} if name not in QUERY_FILTERS]
+        unknown += [name for name in group_by if name not in GROUP_BY_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown query field(s): {', '.join(unknown)}")
+
+        where, params = [], []
+        for name, value in (filters or {}).items():
+            if value:
+                where.append(f"{QUERY_FILTERS[name]} = ?")
+                params.append(value if name == "company_name" else normalize_key(value))
+        if date_from:
+            where.append("effective_date >= ?")
+            params.append(date_from)
+        if date_to:
+            where.append("effective_date <= ?")
+            params.append(date_to)
+        clause = f" WHERE {' AND '.join(where)}" if where else ""
+        params.append(max(1, min(int(limit), QUERY_MAX_ROWS)))
+
+        if group_by:
+            # Group by the key expressions: names like "location" are also raw columns and would win over an alias
+            keys = ", ".join(GROUP_BY_COLUMNS[name] for name in group_by)
+            groups = ", ".join(f"{GROUP_BY_COLUMNS[name]} AS {name}" for name in group_by)
+            sql = (
+                f"SELECT {groups}, COUNT(*) AS records, ROUND(AVG(payout), 2) AS avg_payout, MIN(payout) AS min_payout, "
+                f"MAX(payout) AS max_payout, ROUND(AVG(payin), 2) AS avg_payin FROM records{clause} "
+                f"GROUP BY {keys} ORDER BY {keys} LIMIT ?"
+            )
+        else:
+            sql = f"SELECT {', '.join(ROW_COLUMNS)} FROM records{clause} ORDER BY effective_date DESC LIMIT ?"
+        return sql, params
+
+
+def recompute_command(args):
+    from main import RULES_VERSION, RULE_INDEX
+
+    result = args.store.recompute(RULE_INDEX, RULES_VERSION, args.company, args.apply)
+    for key, value in result["summary"].items():
+        print(f"{key:16s} {value}")
+    if args.output:
+        result["diff"].to_csv(args.output, index=False)
+        print(f"\nWrote {len(result['diff'])} changed rows to {args.output}")
+    elif len(result["diff"]):
+        print("\n" + result["diff"].head(20).to_string(index=False))
+
+
+def query_command(args):
+    filters = {name: getattr(args, name) for name in QUERY_FILTERS}
+    group_by = [name.strip() for name in args.group_by.split(",") if name.strip()] if args.group_by else []
+    result = args.store.query(filters, args.date_from, args.date_to, group_by, args.limit)
+    if result["rows"]:
+        import pandas as pd
+        print(pd.DataFrame(result["rows"]).to_string(index=False))
+    print(f"\n{result['count']} rows{' (truncated)' if result['truncated'] else ''} in {result['seconds'] * 1000:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute or query the extraction history")
+    parser.add_argument("--path", default=EXTRACTION_HISTORY_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    recompute = commands.add_parser("recompute", help="recompute stored payouts with the current formula rules")
+    recompute.add_argument("--company", help="only this company's runs")
+    recompute.add_argument("--apply", action="store_true", help="write the new payouts back to the store")
+    recompute.add_argument("--output", help="write the changed rows as CSV")
+    recompute.set_defaults(handler=recompute_command)
+
+    query = commands.add_parser("query", help="look up or aggregate stored payouts")
+    for name in QUERY_FILTERS:
+        query.add_argument(f"--{name.replace('_', '-')}", dest=name)
+    query.add_argument("--date-from")
+    query.add_argument("--date-to")
+    query.add_argument("--group-by", help=f"comma-separated: {', '.join(GROUP_BY_COLUMNS)}")
+    query.add_argument("--limit", type=int, default=50)
+    query.set_defaults(handler=query_command)
+
+    args = parser.parse_args()
+    args.store = HistoryStore(args.path)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""Restart-safe background job queue for long extractions.
+
+Jobs live in a SQLite database, so they survive restarts and can be shared
+by several processes. Workers run in-process (JOB_WORKERS_IN_PROCESS=1, the
+default) or as separate processes:
+
+    python jobs.py worker --concurrency 4
+
+Finished jobs (with their results) are deleted JOB_RETENTION_SECONDS after
+they finish, by the same periodic sweep that requeues orphaned jobs.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "data/jobs.sqlite3")
+JOB_WORKERS_IN_PROCESS = os.getenv("JOB_WORKERS_IN_PROCESS", "1") == "1"
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "4"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "2"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "60"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "0.5"))
+# Workers touch their running jobs, and sweep for ones nobody touches, this often
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+# A running job untouched for this long lost its worker (crash, kill, redeploy) and is requeued
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120"))
+# Succeeded / failed jobs, results included, are kept this long for clients to fetch (0 keeps them forever)
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Errors worth retrying: timeouts, connection drops, 429s and 5xx from OpenAI"""
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    try:
+        import openai
+    except ImportError:
+        return False
+    return isinstance(error, (
+        openai.APIConnectionError,
+        openai.APITimeoutError,
+        openai.RateLimitError,
+        openai.InternalServerError
+    ))
+
+
+def retry_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter for the given (1-based) attempt"""
+    return random.uniform(0, min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * 2 ** (attempt - 1)))
+
+
+class JobStore:
+    """SQLite-backed job table shared by the API and any worker processes"""
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, company_name TEXT, filename TEXT, content_type TEXT, "
+            "file BLOB, attempts INTEGER NOT NULL DEFAULT 0, progress TEXT, error TEXT, result TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, next_run_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, next_run_at)")
+
+    def submit(self, file_bytes: bytes, filename: str, content_type: str, company_name: str) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, company_name, filename, content_type, file, progress, created_at, updated_at, next_run_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, company_name, filename, content_type, file_bytes, "queued", now, now, now)
+            )
+        return job_id
+
+    def get(self, job_id: str, with_file: bool = False):
+        columns = "*" if with_file else (
+            "id, status, company_name, filename, content_type, attempts, progress, error, result, created_at, updated_at, next_run_at"
+        )
+        with self._lock:
+            row = self._conn.execute(f"SELECT {columns} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def claim_next(self):
+        """Atomically move the oldest due job to running and return it (with its file), or None"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? AND next_run_at <= ? ORDER BY created_at LIMIT 1",
+                    (QUEUED, now)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, progress = ?, updated_at = ? WHERE id = ?",
+                    (RUNNING, "starting", now, row["id"])
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        job = dict(row)
+        job["attempts"] += 1
+        return job
+
+    def heartbeat(self, job_id: str):
+        """Mark a running job as still owned by a live worker"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET updated_at = ? WHERE id = ? AND status = ?", (time.time(), job_id, RUNNING)
+            )
+
+    def set_progress(self, job_id: str, progress: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (progress, time.time(), job_id, RUNNING)
+            )
+
+    def succeed(self, job_id: str, result: dict):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, progress = ?, result = ?, error = NULL, file = NULL, updated_at = ? WHERE id = ?",
+                (SUCCEEDED, "done", json.dumps(result), time.time(), job_id)
+            )
+
+    def fail(self, job_id: str, error: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, progress = ?, error = ?, file = NULL, updated_at = ? WHERE id = ?",
+                (FAILED, "failed", error, time.time(), job_id)
+            )
+
+    def retry_later(self, job_id: str, error: str, delay: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, progress = ?, error = ?, updated_at = ?, next_run_at = ? WHERE id = ?",
+                (QUEUED, f"retrying in {delay:.1f}s", error, now, now + delay, job_id)
+            )
+
+    def requeue(self, job_id: str):
+        """Hand a running job back to the queue untried (its worker is shutting down)"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, progress = ?, attempts = MAX(0, attempts - 1), updated_at = ?, next_run_at = ? "
+                "WHERE id = ? AND status = ?",
+                (QUEUED, "requeued after worker shutdown", now, now, job_id, RUNNING)
+            )
+
+    def requeue_stale(self, stale_seconds: float = JOB_STALE_SECONDS) -> int:
+        """Put running jobs whose worker stopped updating them back on the queue.
+
+        A job that has already used up JOB_MAX_ATTEMPTS (one that keeps killing
+        its worker, say) fails instead.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, progress = ?, error = ?, file = NULL, updated_at = ? "
+                "WHERE status = ? AND updated_at < ? AND attempts >= ?",
+                (FAILED, "failed", "worker lost on every attempt", now, RUNNING, now - stale_seconds, JOB_MAX_ATTEMPTS)
+            )
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, progress = ?, updated_at = ?, next_run_at = ? WHERE status = ? AND updated_at < ?",
+                (QUEUED, "requeued after losing its worker", now, now, RUNNING, now - stale_seconds)
+            )
+        return cursor.rowcount
+
+    def delete_finished(self, retention_seconds: float = JOB_RETENTION_SECONDS) -> int:
+        """Delete succeeded and failed jobs that finished more than retention_seconds ago"""
+        if retention_seconds <= 0:
+            return 0
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (SUCCEEDED, FAILED, time.time() - retention_seconds)
+            )
+        return cursor.rowcount
+
+
+class JobWorkerPool:
+    """Runs `handler(job, report_progress)` for queued jobs on N asyncio workers.
+
+    Running jobs get a heartbeat every heartbeat_seconds, and the pool sweeps
+    as often for jobs whose worker (in this or any other process) stopped
+    sending one, so orphans are picked up again while the service runs. The
+    sweep also deletes jobs that finished more than retention_seconds ago.
+
+    report_progress only records the latest stage; the job's heartbeat task
+    writes it to the store off the event loop.
+    """
+
+    def __init__(self, store: JobStore, handler, concurrency: int = JOB_WORKER_CONCURRENCY,
+                 heartbeat_seconds: float = JOB_HEARTBEAT_SECONDS, stale_seconds: float = JOB_STALE_SECONDS,
+                 retention_seconds: float = JOB_RETENTION_SECONDS):
+        self.store = store
+        self.handler = handler
+        self.concurrency = concurrency
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_seconds = stale_seconds
+        self.retention_seconds = retention_seconds
+        self._tasks = []
+        self._stopping = False
+
+    def start(self):
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._worker(index)) for index in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._sweeper()))
+        logger.info(f"✅ Started {self.concurrency} job workers")
+
+    async def stop(self):
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def run_forever(self):
+        self.start()
+        try:
+            await asyncio.gather(*self._tasks)
+        finally:
+            await self.stop()
+
+    async def sweep(self) -> int:
+        requeued = await asyncio.to_thread(self.store.requeue_stale, self.stale_seconds)
+        if requeued:
+            logger.info(f"♻️ Requeued {requeued} stale jobs")
+        deleted = await asyncio.to_thread(self.store.delete_finished, self.retention_seconds)
+        if deleted:
+            logger.info(f"🧹 Deleted {deleted} finished jobs past retention")
+        return requeued
+
+    async def _sweeper(self):
+        while not self._stopping:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.warning(f"⚠️ Stale job sweep failed: {str(e)}")
+            await asyncio.sleep(self.heartbeat_seconds)
+
+    async def _heartbeat(self, job_id: str, progress: dict, changed: asyncio.Event):
+        """Write reported progress as it comes (each write also counts as a heartbeat), else a plain heartbeat"""
+        while True:
+            try:
+                await asyncio.wait_for(changed.wait(), self.heartbeat_seconds)
+            except asyncio.TimeoutError:
+                pass
+            changed.clear()
+            stage = progress.pop("stage", None)
+            try:
+                if stage is None:
+                    await asyncio.to_thread(self.store.heartbeat, job_id)
+                else:
+                    await asyncio.to_thread(self.store.set_progress, job_id, stage)
+            except Exception as e:
+                logger.warning(f"⚠️ Heartbeat for job {job_id} failed: {str(e)}")
+
+    async def _worker(self, index: int):
+        while not self._stopping:
+            job = await asyncio.to_thread(self.store.claim_next)
+            if job is None:
+                await asyncio.sleep(JOB_POLL_SECONDS)
+                continue
+            await self._run(job)
+
+    async def _run(self, job: dict):
+        job_id = job["id"]
+        logger.info(f"🛠️ Job {job_id} attempt {job['attempts']} ({job['filename']})")
+
+        # Called on the event loop: keep the latest stage for the heartbeat task to write
+        progress, changed = {}, asyncio.Event()
+
+        def report_progress(stage: str):
+            progress["stage"] = stage
+            changed.set()
+
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, progress, changed))
+        try:
+            result = await self.handler(job, report_progress)
+            await asyncio.to_thread(self.store.succeed, job_id, result)
+            logger.info(f"✅ Job {job_id} succeeded")
+        except asyncio.CancelledError:
+            # Shutting down: hand it straight back (synchronously, the task is being cancelled)
+            self.store.requeue(job_id)
+            logger.info(f"♻️ Job {job_id} requeued on shutdown")
+            raise
+        except Exception as e:
+            if is_transient_error(e) and job["attempts"] < JOB_MAX_ATTEMPTS:
+                delay = retry_delay(job["attempts"])
+                logger.warning(f"⚠️ Job {job_id} hit a transient error, retrying in {delay:.1f}s: {str(e)}")
+                await asyncio.to_thread(self.store.retry_later, job_id, str(e), delay)
+            else:
+                logger.error(f"❌ Job {job_id} failed: {str(e)}")
+                await asyncio.to_thread(self.store.fail, job_id, str(e))
+        finally:
+            heartbeat.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run policy extraction job workers")
+    parser.add_argument("command", choices=["worker"])
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKER_CONCURRENCY)
+    args = parser.parse_args()
+
+    from main import get_job_store, run_policy_job
+
+    asyncio.run(JobWorkerPool(get_job_store(), run_policy_job, args.concurrency).run_forever())
+
+
+if __name__ == "__main__":
+    main()
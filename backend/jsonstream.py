@@ -0,0 +1,109 @@
+"""Incremental parser for a JSON array that arrives in pieces"""
+import json
+from typing import NamedTuple
+
+
+class JSONArrayStreamParser:
+    """Feed text chunks of a top-level JSON array, get each element as soon as it is complete.
+
+    Anything before the opening '[' (markdown fences, chatter) is ignored.
+    Only object/array elements are emitted; scalars between them are skipped.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.element_start = None
+        self.started = False
+        self.finished = False
+        self.count = 0
+        self.skipped = 0
+        # Characters dropped from the front of the buffer so far
+        self.offset = 0
+        # Offset in the fed text just past the last complete element
+        self.consumed = 0
+
+    def feed(self, chunk: str) -> list:
+        """Consume a chunk and return the elements it completed"""
+        elements = []
+        if self.finished or not chunk:
+            return elements
+
+        self.buffer += chunk
+        buffer = self.buffer
+        index = self.pos
+        while index < len(buffer):
+            char = buffer[index]
+
+            if not self.started:
+                if char == "[":
+                    self.started = True
+                    self.depth = 1
+                index += 1
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                if self.depth == 1:
+                    self.element_start = index
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 1 and self.element_start is not None:
+                    try:
+                        elements.append(json.loads(buffer[self.element_start:index + 1]))
+                        self.count += 1
+                    except ValueError:
+                        # One malformed element should not cost us the rest of the array
+                        self.skipped += 1
+                    self.element_start = None
+                    self.consumed = self.offset + index + 1
+                elif self.depth == 0:
+                    self.finished = True
+                    index += 1
+                    break
+            index += 1
+
+        # Drop text we no longer need so the buffer stays small
+        keep_from = self.element_start if self.element_start is not None else index
+        self.buffer = buffer[keep_from:]
+        self.offset += keep_from
+        self.pos = index - keep_from
+        if self.element_start is not None:
+            self.element_start = 0
+        return elements
+
+
+class SalvagedArray(NamedTuple):
+    records: list
+    # Whether the closing ']' was reached (False: the reply was cut off)
+    complete: bool
+    # Malformed elements that were dropped
+    skipped: int
+    # Offset just past the last complete element, where a cut-off reply stopped being usable
+    truncated_at: int
+
+
+def salvage_json_array(text: str) -> SalvagedArray:
+    """Recover every complete element of a truncated or partly malformed JSON array reply"""
+    parser = JSONArrayStreamParser()
+    records = parser.feed(text)
+    if not parser.started:
+        # A lone object instead of an array
+        try:
+            value = json.loads(text)
+        except ValueError:
+            return SalvagedArray([], False, 0, 0)
+        return SalvagedArray([value] if isinstance(value, dict) else [], True, 0, len(text))
+    return SalvagedArray(records, parser.finished, parser.skipped, parser.consumed)
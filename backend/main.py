@@ -1,16 +1,62 @@
-from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi import FastAPI, File, UploadFile, Form, Request
+from fastapi.responses import FileResponse, JSONResponse, HTMLResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from io import BytesIO
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
+import asyncio
 import base64
+import hashlib
 import json
 import os  
-from dotenv import load_dotenv
 import logging
 import re
-import pandas as pd
-from openai import OpenAI
+import time
+import zipfile
 from pathlib import Path
+from typing import TYPE_CHECKING
+
+from artifacts import ARTIFACT_TTL_SECONDS, MEDIA_TYPES, create_artifact_store
+from batch import BATCH_MAX_CONCURRENCY, BATCH_MAX_FILES, expand_zip, is_zip_upload, unique_sheet_name
+from cache import SingleFlight, create_result_cache, make_cache_key
+from cpu_pool import CPUPool, build_batch_outputs, build_outputs, records_excel, records_xlsx_file, render_artifact
+from history import EXTRACTION_HISTORY, HistoryStore
+from excel_export import XLSX_MEDIA_TYPE
+from jobs import (
+    FAILED, JOB_POLL_SECONDS, JOB_WORKERS_IN_PROCESS, QUEUED, SUCCEEDED,
+    JobStore, JobWorkerPool, is_transient_error
+)
+from jsonstream import JSONArrayStreamParser, salvage_json_array
+from ocr import OCR_VERSION, extract_local
+from telemetry import (
+    RequestTimingMiddleware, observe_stage, record_bytes, record_tokens, render_metrics, stage, track_request,
+    track_usage
+)
+from routing import (
+    ROUTE_FAST_MODEL, ROUTING_VERSION, RouteStats, choose_route, expected_records, reply_token_budget,
+    validate_records
+)
+from rules import PAYIN_BAND_BOUNDS, compile_formula_data, determine_lob
+from scheduler import (
+    RequestScheduler, RequestUserMiddleware, create_http_client, estimate_prompt_tokens, image_dimensions,
+    user_scope, warm_connections
+)
+from pages import PAGE_MAX_CONCURRENCY, PAGES_VERSION, is_pdf, page_count, render_page
+from preprocess import PREPROCESS_VERSION, data_url, preprocess_image
+from templates import (
+    LAYOUT_DETECTION, LAYOUT_MAX_TOKENS, LAYOUT_MODEL, LAYOUT_PROMPT, TEMPLATES_VERSION,
+    parse_layout_reply, parse_row_count, template_prompt
+)
+from tiling import (
+    TILE_PROMPT_SUFFIX, TILED_EXTRACTION, TILING_VERSION, can_tile, merge_tile_records, should_tile, split_into_tiles
+)
+from uploads import (
+    MAX_BATCH_UPLOAD_BYTES, MAX_UPLOAD_BYTES, MemoryBudget, UploadLimitMiddleware, UploadRoute,
+    UploadTooLarge, bytes_memory, keep_reservation, payload_memory, read_upload, retain, upload_memory, upload_size
+)
+
+# pandas, numpy, openpyxl and openai are imported on first use to keep cold starts fast
+if TYPE_CHECKING:
+    import pandas as pd
 
 # Configure logging
 logging.basicConfig(
@@ -20,23 +66,116 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Load environment variables
-load_dotenv()
-
-# Load OpenAI API key
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    logger.error("⚠️ OPENAI_API_KEY environment variable not set")
-    raise RuntimeError("OPENAI_API_KEY environment variable not set")
-
-# Initialize OpenAI client
 try:
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    logger.info("✅ OpenAI client initialized successfully")
-except Exception as e:
-    logger.error(f"❌ Failed to initialize OpenAI client: {str(e)}")
-    raise RuntimeError(f"Failed to initialize OpenAI client: {str(e)}")
-
-app = FastAPI(title="Insurance Policy Processing System")
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+# Extraction model / timeout settings (concurrency, quota and retries live in scheduler.py)
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "120"))
+EXTRACTION_MAX_TOKENS = 4000
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "1.0"))
+# Follow-up requests for the rest of a reply that was cut off mid-array
+EXTRACTION_MAX_CONTINUATIONS = int(os.getenv("EXTRACTION_MAX_CONTINUATIONS", "2"))
+# Accepted values of /process's response_format
+RESPONSE_FORMATS = ("slim", "full", "xlsx")
+
+# OpenAI client, built on first use (async, so the vision call never blocks the event loop)
+_openai_client = None
+
+def get_openai_client():
+    """Return the shared AsyncOpenAI client, creating it on first call"""
+    global _openai_client
+    if _openai_client is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            logger.error("⚠️ OPENAI_API_KEY environment variable not set")
+            raise RuntimeError("OPENAI_API_KEY environment variable not set")
+        try:
+            from openai import AsyncOpenAI
+            # Retries go through the scheduler, which knows about the shared quota
+            _openai_client = AsyncOpenAI(
+                api_key=api_key,
+                timeout=OPENAI_TIMEOUT_SECONDS,
+                max_retries=0,
+                http_client=create_http_client()
+            )
+            logger.info("✅ OpenAI client initialized successfully")
+        except Exception as e:
+            logger.error(f"❌ Failed to initialize OpenAI client: {str(e)}")
+            raise RuntimeError(f"Failed to initialize OpenAI client: {str(e)}")
+    return _openai_client
+
+def set_openai_client(client):
+    """Inject a client (fake, replay or custom-transport); None resets to the default"""
+    global _openai_client
+    _openai_client = client
+
+# Paces vision calls per worker: concurrency cap, RPM/TPM buckets, fair queueing across users
+scheduler = RequestScheduler()
+
+# Extraction results keyed by image hash + prompt/model version
+result_cache = create_result_cache()
+
+# Identical uploads arriving together (a circular shared in a team group) are processed once
+upload_flights = SingleFlight("process")
+
+# Uploads wait, spooled on disk, until their estimated decode/encode peak fits in the worker's budget
+memory_budget = MemoryBudget()
+
+# Latency, cost and escalations of the fast/full model routes
+route_stats = RouteStats()
+
+# Formulas, workbooks, CSV and JSON are built here rather than on the event loop
+cpu_pool = CPUPool()
+
+# Background jobs for uploads that would outlive an HTTP request
+_job_store = None
+job_pool = None
+
+def get_job_store() -> JobStore:
+    """Open the job database on first use"""
+    global _job_store
+    if _job_store is None:
+        _job_store = JobStore()
+    return _job_store
+
+# Parsed records of every run, for recomputing payouts when the rules change
+_history_store = None
+
+def get_history_store():
+    """Open the extraction history on first use; None when EXTRACTION_HISTORY=off"""
+    global _history_store
+    if _history_store is None and EXTRACTION_HISTORY != "off":
+        _history_store = HistoryStore()
+    return _history_store
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start in-process job workers (and warm the OpenAI connections) with the app; stop them on shutdown"""
+    global job_pool
+    await cpu_pool.warm()
+    if JOB_WORKERS_IN_PROCESS:
+        job_pool = JobWorkerPool(get_job_store(), run_policy_job)
+        job_pool.start()
+    # Without a key the app still starts; local OCR and cached results keep working
+    warmup = asyncio.create_task(warm_connections(get_openai_client())) if os.getenv("OPENAI_API_KEY") else None
+    yield
+    if warmup is not None:
+        warmup.cancel()
+    if job_pool is not None:
+        await job_pool.stop()
+    # Waits for the pool processes to exit (queued work is cancelled), so none outlive the worker
+    await asyncio.to_thread(cpu_pool.shutdown, True)
+
+app = FastAPI(title="Insurance Policy Processing System", lifespan=lifespan)
+# Upload parts over UPLOAD_SPOOL_BYTES go to disk while the body streams in
+app.router.route_class = UploadRoute
+
+# Inside CORS, so a 413 still carries the CORS headers the browser needs to read it
+app.add_middleware(UploadLimitMiddleware, limits={"/process/batch": MAX_BATCH_UPLOAD_BYTES})
 
 # Add CORS middleware
 app.add_middleware(
@@ -46,6 +185,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestTimingMiddleware)
+app.add_middleware(RequestUserMiddleware)
 
 # Simplified Formula Data - Only for Digit
 # FORMULA_DATA = [
@@ -116,17 +257,14 @@ FORMULA_DATA = [
     {"LOB": "MISD", "SEGMENT": "Misd, Tractor", "PO": "88% of Payin", "REMARKS": "NIL"}
 ]
 
-def extract_text_from_file(file_bytes: bytes, filename: str, content_type: str) -> str:
-    """Extract text from uploaded image file using GPT-4o"""
-    file_extension = filename.split('.')[-1].lower() if '.' in filename else ''
-    
-    if file_extension not in ['png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'] and not content_type.startswith('image/'):
-        raise ValueError(f"Unsupported file type: {filename}")
-    
-    try:
-        image_base64 = base64.b64encode(file_bytes).decode('utf-8')
-        
-        prompt = """
+# FORMULA_DATA compiled once into an index (rebuild it if the rules change at runtime)
+RULE_INDEX = compile_formula_data(FORMULA_DATA)
+# Segments a fast-model reply may use; anything else escalates to the full model
+KNOWN_SEGMENTS = frozenset(rule["SEGMENT"] for rule in FORMULA_DATA)
+# Stored with each run in the extraction history, so recomputes can tell which rules produced a payout
+RULES_VERSION = hashlib.sha256(json.dumps([FORMULA_DATA, PAYIN_BAND_BOUNDS], sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+EXTRACTION_PROMPT = """
 You are extracting insurance policy data from an image. Return a JSON array with these exact keys: segment, policy_type, location, payin, remark.
 
 STEP-BY-STEP EXTRACTION:
@@ -355,39 +493,417 @@ Do not output Comp/TP from elsewhere. All entries use:
 
 
 """
-       
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/{file_extension};base64,{image_base64}"}}
-                ]
-            }],
-            temperature=0.0,
-            max_tokens=4000
+
+CONTINUATION_PROMPT_SUFFIX = """
+
+CONTINUATION:
+An earlier reply for this image was cut off after {count} rows. The last row it returned was:
+{last}
+Return ONLY a JSON array of the rows that come AFTER that row, in table order. Do not repeat earlier rows.
+"""
+
+# Part of every cache key, so editing the prompt or model invalidates old results
+EXTRACTION_VERSION = hashlib.sha256(
+    f"{OPENAI_MODEL}\n{PREPROCESS_VERSION}\n{TILING_VERSION}\n{TEMPLATES_VERSION}\n{OCR_VERSION}\n{PAGES_VERSION}\n"
+    f"{ROUTING_VERSION}\n"
+    f"{EXTRACTION_MAX_CONTINUATIONS}\n{EXTRACTION_PROMPT}{CONTINUATION_PROMPT_SUFFIX}".encode('utf-8')
+).hexdigest()[:16]
+
+def clean_model_output(extracted_text: str) -> str:
+    """Strip markdown fences and surrounding chatter from a model reply"""
+    # Clean markdown formatting
+    cleaned_text = re.sub(r'```json\s*|\s*```', '', extracted_text.strip()).strip()
+    
+    # Extract JSON array
+    start_idx = cleaned_text.find('[')
+    end_idx = cleaned_text.rfind(']') + 1
+    if start_idx != -1 and end_idx > start_idx:
+        cleaned_text = cleaned_text[start_idx:end_idx]
+    
+    return cleaned_text
+
+def build_messages(image_bytes: bytes, mime_type: str, prompt: str, detail: str = None) -> list:
+    """Chat messages for one image + extraction prompt"""
+    with stage("base64_encode"):
+        image_url = {"url": data_url(image_bytes, mime_type)}
+    record_bytes("model_request", len(image_url["url"]) + len(prompt))
+    if detail:
+        image_url["detail"] = detail
+    return [{
+        "role": "user",
+        "content": [
+            {"type": "text", "text": prompt},
+            {"type": "image_url", "image_url": image_url}
+        ]
+    }]
+
+async def detect_layout(image_bytes: bytes, mime_type: str) -> tuple:
+    """Cheap first pass: (matching layout template or None for the full prompt, table rows or None)"""
+    if LAYOUT_DETECTION == "off":
+        return None, None
+    
+    async def send():
+        with stage("layout_detection"):
+            return await asyncio.wait_for(
+                get_openai_client().chat.completions.create(
+                    model=LAYOUT_MODEL,
+                    messages=build_messages(image_bytes, mime_type, LAYOUT_PROMPT, detail="low"),
+                    temperature=0.0,
+                    max_tokens=LAYOUT_MAX_TOKENS
+                ),
+                timeout=OPENAI_TIMEOUT_SECONDS
+            )
+    
+    try:
+        prompt_tokens = estimate_prompt_tokens(LAYOUT_MODEL, LAYOUT_PROMPT, image_bytes, detail="low")
+        response = await scheduler.call(LAYOUT_MODEL, prompt_tokens, LAYOUT_MAX_TOKENS, send)
+        record_tokens(LAYOUT_MODEL, response.usage)
+        reply = response.choices[0].message.content
+        layout, rows = parse_layout_reply(reply), parse_row_count(reply)
+    except Exception as e:
+        logger.warning(f"⚠️ Layout detection failed, using the full prompt: {str(e)}")
+        return None, None
+    
+    logger.info(f"🗂️ Detected layout: {layout or 'unknown'}, {rows if rows is not None else 'uncounted'} rows")
+    return layout, rows
+
+async def request_extraction(image_bytes: bytes, mime_type: str, prompt: str = EXTRACTION_PROMPT,
+                             model: str = OPENAI_MODEL, max_tokens: int = EXTRACTION_MAX_TOKENS) -> str:
+    """Send one image to the vision model and return the cleaned reply"""
+    # Encoded once granted, so queued calls do not each hold a base64 copy of their image
+    async def send():
+        messages = build_messages(image_bytes, mime_type, prompt)
+        with stage("model_call"):
+            return await asyncio.wait_for(
+                get_openai_client().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0.0,
+                    max_tokens=max_tokens
+                ),
+                timeout=OPENAI_TIMEOUT_SECONDS
+            )
+    
+    prompt_tokens = estimate_prompt_tokens(model, prompt, image_bytes)
+    response = await scheduler.call(model, prompt_tokens, max_tokens, send)
+    record_tokens(model, response.usage)
+    
+    with stage("json_cleanup"):
+        return clean_model_output(response.choices[0].message.content)
+
+async def stream_extraction(image_bytes: bytes, mime_type: str, prompt: str = EXTRACTION_PROMPT):
+    """Stream the vision model reply, yielding text deltas as they arrive"""
+    started = None
+    
+    async def send():
+        nonlocal started
+        messages = build_messages(image_bytes, mime_type, prompt)
+        started = time.perf_counter()
+        return await asyncio.wait_for(
+            get_openai_client().chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=messages,
+                temperature=0.0,
+                max_tokens=EXTRACTION_MAX_TOKENS,
+                stream=True,
+                stream_options={"include_usage": True}
+            ),
+            timeout=OPENAI_TIMEOUT_SECONDS
         )
+    
+    # The grant is held until the stream is consumed (or abandoned)
+    prompt_tokens = estimate_prompt_tokens(OPENAI_MODEL, prompt, image_bytes)
+    async with scheduler.request(OPENAI_MODEL, prompt_tokens, EXTRACTION_MAX_TOKENS, send) as grant:
+        try:
+            first_token = True
+            async for chunk in grant.response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first_token:
+                        first_token = False
+                        observe_stage("model_first_token", time.perf_counter() - started)
+                    yield chunk.choices[0].delta.content
+                if getattr(chunk, "usage", None):
+                    grant.settle(chunk.usage)
+                    record_tokens(OPENAI_MODEL, chunk.usage)
+        finally:
+            observe_stage("model_call", time.perf_counter() - started)
+
+async def extract_tiled(image_bytes: bytes, prompt: str = EXTRACTION_PROMPT) -> str:
+    """Extract overlapping horizontal tiles concurrently and merge their records"""
+    tiles = await asyncio.to_thread(split_into_tiles, image_bytes)
+    if len(tiles) < 2:
+        raise ValueError("Image is too small to split into tiles")
+    
+    replies = await asyncio.gather(
+        *(request_extraction(tile, "image/png", prompt + TILE_PROMPT_SUFFIX) for tile in tiles),
+        return_exceptions=True
+    )
+    
+    tile_records = []
+    for index, reply in enumerate(replies, 1):
+        try:
+            if isinstance(reply, BaseException):
+                raise reply
+            # Keep the complete rows of a cut-off tile; the overlap usually covers the rest
+            records = salvage_json_array(reply).records
+        except Exception as e:
+            logger.warning(f"⚠️ Tile {index}/{len(tiles)} failed: {str(e)}")
+            records = []
+        tile_records.append(records)
+    
+    merged = merge_tile_records(tile_records)
+    logger.info(f"🧩 Merged {sum(len(r) for r in tile_records)} tile records into {len(merged)}")
+    return json.dumps(merged)
+
+async def continue_extraction(image_bytes: bytes, mime_type: str, prompt: str, records: list) -> tuple:
+    """Ask only for the rows after the last recovered one: (all records, whether the array is now complete)"""
+    for attempt in range(1, EXTRACTION_MAX_CONTINUATIONS + 1):
+        continuation = prompt + CONTINUATION_PROMPT_SUFFIX.format(count=len(records), last=json.dumps(records[-1]))
+        try:
+            salvaged = salvage_json_array(await request_extraction(image_bytes, mime_type, continuation))
+        except Exception as e:
+            if is_transient_error(e):
+                raise
+            logger.warning(f"⚠️ Continuation {attempt} failed: {str(e)}")
+            break
         
-        extracted_text = response.choices[0].message.content.strip()
+        # The model sometimes repeats the row it was told about
+        count = len(records)
+        records = merge_tile_records([records, salvaged.records])
+        logger.info(f"🔗 Continuation {attempt} added {len(records) - count} records")
+        if salvaged.complete:
+            return records, True
+        if len(records) == count:
+            break
+    return records, False
+
+async def extract_with_prompt(image_bytes: bytes, mime_type: str, prompt: str, extraction_info: dict = None,
+                              tiled: bool = False) -> str:
+    """Single-shot or tiled (see should_tile) extraction with one prompt; returns the validated JSON text"""
+    if tiled:
+        return await extract_tiled(image_bytes, prompt)
+    
+    cleaned_text = await request_extraction(image_bytes, mime_type, prompt)
+    try:
+        json.loads(cleaned_text)
+        return cleaned_text
+    except ValueError:
+        pass
+    
+    # Usually a reply cut off at max_tokens on a big table, sometimes one malformed row
+    salvaged = salvage_json_array(cleaned_text)
+    if salvaged.records:
+        records, complete = salvaged.records, salvaged.complete
+        if salvaged.skipped:
+            logger.warning(f"⚠️ Dropped {salvaged.skipped} malformed records from the reply")
+        if not complete:
+            logger.warning(f"⚠️ Reply cut off after {len(records)} records (offset {salvaged.truncated_at}), requesting the rest")
+            records, complete = await continue_extraction(image_bytes, mime_type, prompt, records)
+        if extraction_info is not None:
+            extraction_info["salvage"] = {"skipped": salvaged.skipped, "truncated": not salvaged.complete, "complete": complete}
+        return json.dumps(records)
+    
+    if TILED_EXTRACTION == "off":
+        raise ValueError("Model reply contains no complete records")
+    logger.warning("⚠️ Single-shot reply has no usable records, retrying as tiles")
+    return await extract_tiled(image_bytes, prompt)
+
+async def extract_fast(image_bytes: bytes, mime_type: str, prompt: str, expected: int) -> tuple:
+    """One call to the fast model without tiling or continuations: (JSON text, reasons to escalate)"""
+    try:
+        cleaned_text = await request_extraction(
+            image_bytes, mime_type, prompt, model=ROUTE_FAST_MODEL,
+            max_tokens=reply_token_budget(expected, EXTRACTION_MAX_TOKENS)
+        )
+    except Exception as e:
+        if is_transient_error(e):
+            raise
+        logger.warning(f"⚠️ {ROUTE_FAST_MODEL} call failed: {str(e)}")
+        return None, ["error"]
+    
+    try:
+        records = json.loads(cleaned_text)
+    except ValueError:
+        # Usually cut off at the reply budget, which the full model (with continuations) handles
+        return None, ["truncated"]
+    return cleaned_text, validate_records(records, expected, KNOWN_SEGMENTS)
+
+async def extract_with_layout(image_bytes: bytes, mime_type: str, extraction_info: dict = None) -> str:
+    """Extract with the detected layout's compact prompt, trying the fast model first when the image qualifies"""
+    layout, rows = await detect_layout(image_bytes, mime_type)
+    if extraction_info is not None:
+        extraction_info["layout"] = layout
+    
+    started = time.perf_counter()
+    with track_usage() as usage:
+        tiled = await asyncio.to_thread(should_tile, image_bytes, rows)
+        route = choose_route(*image_dimensions(image_bytes), rows=rows, tiled=tiled)
+        reasons = []
+        if route == "fast":
+            prompt = template_prompt(layout) if layout else EXTRACTION_PROMPT
+            with stage("fast_route"):
+                cleaned_text, reasons = await extract_fast(image_bytes, mime_type, prompt, expected_records(layout, rows))
+            if not reasons:
+                route_stats.observe("fast", time.perf_counter() - started, usage["cost_usd"])
+                if extraction_info is not None:
+                    extraction_info["route"] = {"route": "fast", "model": ROUTE_FAST_MODEL}
+                return cleaned_text
+            logger.warning(f"↗️ {ROUTE_FAST_MODEL} reply failed validation ({', '.join(reasons)}), escalating to {OPENAI_MODEL}")
+            route = "escalated"
         
-        # Clean markdown formatting
-        cleaned_text = re.sub(r'```json\s*|\s*```', '', extracted_text).strip()
+        cleaned_text = await extract_full(image_bytes, mime_type, layout, extraction_info, tiled, rows)
+    route_stats.observe(route, time.perf_counter() - started, usage["cost_usd"], reasons)
+    if extraction_info is not None:
+        extraction_info["route"] = {"route": route, "model": OPENAI_MODEL, **({"reasons": reasons} if reasons else {})}
+    return cleaned_text
+
+async def extract_full(image_bytes: bytes, mime_type: str, layout: str, extraction_info: dict = None,
+                       tiled: bool = False, rows: int = None) -> str:
+    """Extract with OPENAI_MODEL and the layout's compact prompt, falling back to the full prompt"""
+    if layout is not None:
+        try:
+            cleaned_text = await extract_with_prompt(image_bytes, mime_type, template_prompt(layout), extraction_info, tiled)
+            # Held to the same checks as a fast-model reply: a wrong layout can still return records
+            reasons = validate_records(json.loads(cleaned_text), expected_records(layout, rows), KNOWN_SEGMENTS)
+            if not reasons:
+                return cleaned_text
+            logger.warning(f"⚠️ '{layout}' prompt reply failed validation ({', '.join(reasons)}), retrying with the full prompt")
+        except Exception as e:
+            if is_transient_error(e):
+                raise
+            logger.warning(f"⚠️ '{layout}' prompt failed, retrying with the full prompt: {str(e)}")
+        if extraction_info is not None:
+            extraction_info["layout"] = None
+    
+    return await extract_with_prompt(image_bytes, mime_type, EXTRACTION_PROMPT, extraction_info, tiled)
+
+def get_file_extension(filename: str, content_type: str) -> str:
+    """Validate the upload type and return its lowercase extension"""
+    file_extension = filename.split('.')[-1].lower() if '.' in filename else ''
+    
+    if (file_extension not in ['png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'pdf']
+            and not content_type.startswith('image/') and content_type != 'application/pdf'):
+        raise ValueError(f"Unsupported file type: {filename}")
+    
+    return file_extension
+
+async def extract_image(image_bytes: bytes, file_extension: str, extraction_info: dict) -> str:
+    """Local OCR, else the vision model, for one image; "[]" (with extraction_info["error"]) when the model path fails"""
+    # Clean tables in a known layout are parsed locally, without a model call
+    with stage("local_ocr"):
+        local = await asyncio.to_thread(extract_local, image_bytes)
+    if local is not None:
+        extraction_info.update(engine="local", layout=local.layout)
+        return json.dumps(local.records)
+    extraction_info["engine"] = "vision"
+    
+    # Fail loudly (not as an empty extraction) when the key is missing
+    get_openai_client()
+    
+    try:
+        # Shrink the payload before encoding (CPU-bound, keep it off the event loop)
+        with stage("preprocess"):
+            payload, mime_type = await asyncio.to_thread(preprocess_image, image_bytes)
+        mime_type = mime_type or f"image/{file_extension}"
+        # The decoded frames are gone; only the upload and the payload's encodings (and tiles) remain
+        tiled = await asyncio.to_thread(can_tile, payload)
+        retain(len(image_bytes) + payload_memory(payload, tiled))
         
-        # Extract JSON array
-        start_idx = cleaned_text.find('[')
-        end_idx = cleaned_text.rfind(']') + 1
-        if start_idx != -1 and end_idx > start_idx:
-            cleaned_text = cleaned_text[start_idx:end_idx]
+        cleaned_text = await extract_with_layout(payload, mime_type, extraction_info)
         
         # Validate JSON
         json.loads(cleaned_text)
         return cleaned_text
         
     except Exception as e:
+        # Let retryable failures surface so callers (job workers, clients) can retry
+        if is_transient_error(e):
+            logger.warning(f"⚠️ Transient error in OCR extraction: {str(e)}")
+            raise
         logger.error(f"Error in OCR extraction: {str(e)}")
+        extraction_info["error"] = str(e)
         return "[]"
 
+async def iter_pages(file_bytes: bytes, pages: int, extraction_info: dict):
+    """Render and extract the pages of a PDF / multi-frame TIFF concurrently, yielding
+    (page number, records) in page order as soon as each page and those before it are done"""
+    semaphore = asyncio.Semaphore(PAGE_MAX_CONCURRENCY)
+    page_infos = [{"page": number} for number in range(1, pages + 1)]
+    extraction_info["pages"] = page_infos
+    
+    async def extract_page(index: int) -> list:
+        info = page_infos[index]
+        async with semaphore:
+            # Pages share the upload's memory reservation; one finishing must not shrink it for the rest
+            with keep_reservation():
+                try:
+                    with stage("page_render"):
+                        page_bytes = await asyncio.to_thread(render_page, file_bytes, index)
+                except Exception as e:
+                    logger.error(f"Could not render page {index + 1}: {str(e)}")
+                    info["error"] = str(e)
+                    return []
+                records = json.loads(await extract_image(page_bytes, "png", info))
+        records = [records] if isinstance(records, dict) else records
+        info["records"] = len(records)
+        return [dict(record, page=index + 1) if isinstance(record, dict) else record for record in records]
+    
+    tasks = [asyncio.ensure_future(extract_page(index)) for index in range(pages)]
+    try:
+        for number, task in enumerate(tasks, 1):
+            yield number, await task
+    finally:
+        # A transient failure (or a consumer that stopped listening) abandons the remaining pages
+        for task in tasks:
+            task.cancel()
+    
+    # One summary for the metrics: an incomplete or failed page keeps the result out of the cache
+    engines = {info.get("engine") for info in page_infos}
+    layouts = {info.get("layout") for info in page_infos}
+    extraction_info.update(
+        engine=engines.pop() if len(engines) == 1 else "mixed",
+        layout=layouts.pop() if len(layouts) == 1 else None
+    )
+    salvages = [info["salvage"] for info in page_infos if "salvage" in info]
+    if salvages or any("error" in info for info in page_infos):
+        extraction_info["salvage"] = {
+            "skipped": sum(salvage["skipped"] for salvage in salvages),
+            "truncated": any(salvage["truncated"] for salvage in salvages),
+            "complete": all(salvage["complete"] for salvage in salvages) and not any("error" in info for info in page_infos)
+        }
+
+async def extract_pages(file_bytes: bytes, pages: int, extraction_info: dict) -> str:
+    """Every page's records in page order, each tagged with its page number"""
+    started = time.perf_counter()
+    records = []
+    async for _, page_records in iter_pages(file_bytes, pages, extraction_info):
+        records.extend(page_records)
+    logger.info(f"📄 Extracted {pages} pages into {len(records)} records in {time.perf_counter() - started:.1f}s")
+    return json.dumps(records)
+
+async def extract_text_from_file(file_bytes: bytes, filename: str, content_type: str, cache_info: dict = None) -> str:
+    """Extract text from uploaded image file using GPT-4o"""
+    file_extension = get_file_extension(filename, content_type)
+    cache_info = cache_info if cache_info is not None else {}
+    
+    cache_key = make_cache_key(file_bytes, EXTRACTION_VERSION)
+    cached_text = await asyncio.to_thread(result_cache.get, cache_key)
+    cache_info["hit"] = cached_text is not None
+    if cached_text is not None:
+        logger.info(f"⚡ Cache hit for {filename}")
+        return cached_text
+    
+    pages = await asyncio.to_thread(page_count, file_bytes)
+    if pages > 1 or is_pdf(file_bytes):
+        cleaned_text = await extract_pages(file_bytes, pages, cache_info)
+    else:
+        cleaned_text = await extract_image(file_bytes, file_extension, cache_info)
+    
+    # A failed or still-incomplete extraction is returned but not cached, so a re-upload tries again
+    if "error" not in cache_info and cache_info.get("salvage", {}).get("complete", True):
+        await asyncio.to_thread(result_cache.set, cache_key, cleaned_text)
+    return cleaned_text
+
 def classify_payin(payin_value):
     """Classify payin into categories"""
     try:
@@ -411,25 +927,6 @@ def classify_payin(payin_value):
         logger.warning(f"Could not parse payin: {payin_value}, error: {e}")
         return 0.0, "Payin Below 20%"
 
-def determine_lob(segment: str) -> str:
-    """Determine LOB from segment"""
-    segment_upper = segment.upper()
-    
-    if 'BUS' in segment_upper:
-        return "BUS"
-    elif any(kw in segment_upper for kw in ['TW', '2W', 'MC', 'SC', '1+5']):
-        return "TW"
-    elif any(kw in segment_upper for kw in ['PVT CAR', 'CAR', 'PCI']):
-        return "PVT CAR"
-    elif any(kw in segment_upper for kw in ['CV', 'GVW', 'PCV', 'GCV']):
-        return "CV"
-    elif 'TAXI' in segment_upper:
-        return "TAXI"
-    elif any(kw in segment_upper for kw in ['MISD', 'TRACTOR']):
-        return "MISD"
-    
-    return "UNKNOWN"
-
 def apply_formula(policy_data):
     """Apply formula rules and calculate payouts"""
     if not policy_data:
@@ -443,52 +940,8 @@ def apply_formula(policy_data):
             payin_value = record.get('Payin_Value', 0)
             payin_category = record.get('Payin_Category', '')
             
-            lob = determine_lob(segment)
-            segment_upper = segment.upper()
-            
-            # Find matching rule
-            matched_rule = None
-            for rule in FORMULA_DATA:
-                # Match LOB
-                if rule["LOB"] != lob:
-                    continue
-                
-                # Match Segment
-                rule_segment = rule["SEGMENT"].upper()
-                if rule_segment not in segment_upper:
-                    continue
-                
-                # Match Payin Category or NIL
-                remarks = rule.get("REMARKS", "")
-                if remarks == "NIL" or payin_category in remarks:
-                    matched_rule = rule
-                    break
-            
-            # Calculate payout
-            if matched_rule:
-                po_formula = matched_rule["PO"]
-                calculated_payout = payin_value
-                
-                if "90% of Payin" in po_formula:
-                    calculated_payout *= 0.9
-                elif "88% of Payin" in po_formula:
-                    calculated_payout *= 0.88           
-                elif "Less 2%" in po_formula or "-2%" in po_formula:
-                    calculated_payout -= 2
-                elif "-3%" in po_formula:   
-                    calculated_payout -= 3
-                elif "-4%" in po_formula:
-                    calculated_payout -= 4
-                elif "-5%" in po_formula:
-                    calculated_payout -= 5
-                 
-                calculated_payout = max(0, calculated_payout)
-                formula_used = po_formula
-                rule_explanation = f"Match: LOB={lob}, Segment={rule_segment}, {remarks}"
-            else:
-                calculated_payout = payin_value
-                formula_used = "No matching rule"
-                rule_explanation = f"No rule for LOB={lob}, Segment={segment_upper}"
+            # O(1) lookup in the compiled rule index
+            calculated_payout, formula_used, rule_explanation = RULE_INDEX.evaluate(segment, payin_value, payin_category)
             
             # Format remark
             remark_value = record.get('remark', '')
@@ -496,6 +949,7 @@ def apply_formula(policy_data):
                 remark_value = '; '.join(str(r) for r in remark_value)
             
             calculated_data.append({
+                **({'page': record['page']} if 'page' in record else {}),
                 'segment': segment,
                 'policy type': record.get('policy_type', 'Comp'),
                 'location': record.get('location', 'N/A'),
@@ -509,6 +963,7 @@ def apply_formula(policy_data):
         except Exception as e:
             logger.error(f"Error processing record {record}: {str(e)}")
             calculated_data.append({
+                **({'page': record['page']} if 'page' in record else {}),
                 'segment': str(record.get('segment', 'Unknown')),
                 'policy type': record.get('policy_type', 'Comp'),
                 'location': record.get('location', 'N/A'),
@@ -521,91 +976,214 @@ def apply_formula(policy_data):
     
     return calculated_data
 
-def process_files(policy_file_bytes: bytes, policy_filename: str, policy_content_type: str, company_name: str):
-    """Main processing function"""
+def calculate_records(policy_data: list) -> list:
+    """Classify payin on each parsed record and apply the formula rules"""
+    for record in policy_data:
+        payin_val, payin_cat = classify_payin(record.get('payin', 0))
+        record['Payin_Value'] = payin_val
+        record['Payin_Category'] = payin_cat
+    
+    return apply_formula(policy_data)
+
+# Lazily rendered downloads for slim /process responses, kept as their calculated records.
+# Renders run on a download thread, which waits for the CPU pool
+artifact_store = create_artifact_store({
+    fmt: lambda calculated_data, company_name, fmt=fmt: cpu_pool.call(render_artifact, fmt, calculated_data, company_name)
+    for fmt in MEDIA_TYPES
+})
+
+def build_metrics(policy_data: list, calculated_data: list, company_name: str, cache_info: dict = None) -> dict:
+    """Summary block returned alongside the records"""
+    avg_payin = sum([r['Payin_Value'] for r in policy_data]) / len(policy_data) if policy_data else 0.0
+    formula_summary = {}
+    for record in calculated_data:
+        formula = record['Formula Used']
+        formula_summary[formula] = formula_summary.get(formula, 0) + 1
+    
+    return {
+        "total_records": len(calculated_data),
+        "avg_payin": round(avg_payin, 1),
+        "unique_segments": len(set([r['segment'] for r in calculated_data])),
+        "company_name": company_name,
+        "formula_summary": formula_summary,
+        "cache": {"hit": (cache_info or {}).get("hit", False), **result_cache.stats()},
+        "layout": (cache_info or {}).get("layout"),
+        "engine": (cache_info or {}).get("engine"),
+        "salvage": (cache_info or {}).get("salvage"),
+        "pages": (cache_info or {}).get("pages"),
+        "route": (cache_info or {}).get("route")
+    }
+
+async def extract_policy_records(policy_file_bytes: bytes, policy_filename: str, policy_content_type: str):
+    """Extract one upload: (extracted_text, parsed policy_data, cache_info)"""
+    # Extract text
+    cache_info = {}
+    extracted_text = await extract_text_from_file(policy_file_bytes, policy_filename, policy_content_type, cache_info)
+    
+    if not extracted_text or extracted_text == "[]":
+        raise ValueError("No text extracted from image")
+    
+    # Parse JSON
+    with stage("json_cleanup"):
+        policy_data = json.loads(extracted_text)
+    if isinstance(policy_data, dict):
+        policy_data = [policy_data]
+    
+    if not policy_data:
+        raise ValueError("No policy data found")
+    
+    logger.info(f"✅ Parsed {len(policy_data)} records")
+    return extracted_text, policy_data, cache_info
+
+async def calculate_outputs(policy_data: list, company_name: str, outputs: tuple = ()) -> dict:
+    """Classify payins and apply the formulas column-wise, plus the requested renders, in the CPU pool
+    (see cpu_pool.build_outputs); policy_data comes back with Payin_Value / Payin_Category"""
+    result = await cpu_pool.run(build_outputs, policy_data, FORMULA_DATA, RULES_VERSION, company_name, outputs)
+    if not result["calculated_data"]:
+        raise ValueError("No data after formula application")
+    
+    logger.info(f"✅ Calculated {len(result['calculated_data'])} records")
+    return result
+
+async def record_history(file_bytes: bytes, filename: str, company_name: str, policy_data: list, calculated_data: list):
+    """Persist a run's parsed records; a failure here never fails the upload"""
+    store = get_history_store()
+    if store is None:
+        return
+    try:
+        payin_values = [record.get('Payin_Value', 0.0) for record in policy_data]
+        await asyncio.to_thread(
+            store.save, hashlib.sha256(file_bytes).hexdigest(), company_name, filename,
+            calculated_data, payin_values, RULES_VERSION
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ Could not save {filename} to the extraction history: {str(e)}")
+
+async def process_files(policy_file_bytes: bytes, policy_filename: str, policy_content_type: str, company_name: str,
+                        on_progress=None, response_format: str = "full"):
+    """Main processing function.
+
+    response_format="slim" returns only the records and metrics plus links to
+    lazily rendered XLSX/CSV/JSON downloads; "full" embeds every artifact;
+    "xlsx" returns the records and metrics for the caller to render its own
+    workbook file. Concurrent calls for the same image, company and format share one run.
+    """
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError(f"Unknown response_format {response_format!r}; expected one of {', '.join(RESPONSE_FORMATS)}")
+    key = f"{response_format}:{company_name}:{hashlib.sha256(policy_file_bytes).hexdigest()}"
+    results = await upload_flights.run(key, lambda: run_process_files(
+        policy_file_bytes, policy_filename, policy_content_type, company_name, on_progress, response_format
+    ))
+    # Callers add their own keys (timings), so each gets its own dict
+    return dict(results)
+
+async def run_process_files(policy_file_bytes: bytes, policy_filename: str, policy_content_type: str, company_name: str,
+                            on_progress=None, response_format: str = "full"):
+    """One uncoalesced run of the pipeline behind process_files"""
+    report_progress = on_progress or (lambda stage: None)
     try:
         logger.info(f"🚀 Processing {policy_filename} for {company_name}")
         
-        # Extract text
-        extracted_text = extract_text_from_file(policy_file_bytes, policy_filename, policy_content_type)
-        
-        if not extracted_text or extracted_text == "[]":
-            raise ValueError("No text extracted from image")
-        
-        # Parse JSON
-        policy_data = json.loads(extracted_text)
-        if isinstance(policy_data, dict):
-            policy_data = [policy_data]
-        
-        if not policy_data:
-            raise ValueError("No policy data found")
-        
-        logger.info(f"✅ Parsed {len(policy_data)} records")
-        
-        # Classify payin
-        for record in policy_data:
-            payin_val, payin_cat = classify_payin(record.get('payin', 0))
-            record['Payin_Value'] = payin_val
-            record['Payin_Category'] = payin_cat
-        
-        # Apply formulas
-        calculated_data = apply_formula(policy_data)
-        
-        if not calculated_data:
-            raise ValueError("No data after formula application")
-        
-        logger.info(f"✅ Calculated {len(calculated_data)} records")
-        
-        # Create Excel
-        df = pd.DataFrame(calculated_data)
-        output = BytesIO()
-        
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Policy Data', startrow=2, index=False)
-            worksheet = writer.sheets['Policy Data']
-            
-            # Format headers
-            for col_num, value in enumerate(df.columns, 1):
-                cell = worksheet.cell(row=3, column=col_num, value=value)
-                cell.font = cell.font.copy(bold=True)
-            
-            # Add title
-            title_cell = worksheet.cell(row=1, column=1, value=f"{company_name} - Policy Data")
-            worksheet.merge_cells(start_row=1, start_column=1, end_row=1, end_column=len(df.columns))
-            title_cell.font = title_cell.font.copy(bold=True, size=14)
-            title_cell.alignment = title_cell.alignment.copy(horizontal='center')
-        
-        output.seek(0)
-        excel_data_base64 = base64.b64encode(output.read()).decode('utf-8')
+        report_progress("extracting")
+        extracted_text, policy_data, cache_info = await extract_policy_records(
+            policy_file_bytes, policy_filename, policy_content_type
+        )
+        if response_format == "full":
+            report_progress("building excel")
+        outputs = await calculate_outputs(
+            policy_data, company_name, ("excel", "csv", "json") if response_format == "full" else ()
+        )
+        policy_data, calculated_data = outputs["policy_data"], outputs["calculated_data"]
+        metrics = build_metrics(policy_data, calculated_data, company_name, cache_info)
+        await record_history(policy_file_bytes, policy_filename, company_name, policy_data, calculated_data)
         
-        # Calculate metrics
-        avg_payin = sum([r['Payin_Value'] for r in policy_data]) / len(policy_data)
-        formula_summary = {}
-        for record in calculated_data:
-            formula = record['Formula Used']
-            formula_summary[formula] = formula_summary.get(formula, 0) + 1
+        if response_format == "slim":
+            # Pickled into the shared directory in multi-worker mode
+            artifact_id = await asyncio.to_thread(artifact_store.put, calculated_data, company_name)
+            return {
+                "calculated_data": calculated_data,
+                "metrics": metrics,
+                "artifacts": artifact_store.links(artifact_id),
+                "artifacts_expire_in": int(ARTIFACT_TTL_SECONDS)
+            }
+        if response_format == "xlsx":
+            return {"calculated_data": calculated_data, "metrics": metrics}
         
         return {
             "extracted_text": extracted_text,
             "parsed_data": policy_data,
             "calculated_data": calculated_data,
-            "excel_data": excel_data_base64,
-            "csv_data": df.to_csv(index=False),
-            "json_data": json.dumps(calculated_data, indent=2),
+            "excel_data": outputs["excel_data"],
+            "csv_data": outputs["csv_data"],
+            "json_data": outputs["json_data"],
             "formula_data": FORMULA_DATA,
-            "metrics": {
-                "total_records": len(calculated_data),
-                "avg_payin": round(avg_payin, 1),
-                "unique_segments": len(set([r['segment'] for r in calculated_data])),
-                "company_name": company_name,
-                "formula_summary": formula_summary
-            }
+            "metrics": metrics
         }
     
     except Exception as e:
         logger.error(f"Error in process_files: {str(e)}", exc_info=True)
         raise
 
+async def process_batch(uploads: list, company_name: str):
+    """Process many (filename, bytes, content_type) uploads concurrently into one workbook"""
+    logger.info(f"🚀 Processing batch of {len(uploads)} files for {company_name}")
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    batch_started = time.perf_counter()
+    
+    async def run_one(filename: str, file_bytes: bytes, content_type: str):
+        async with semaphore, memory_budget.reserve(await asyncio.to_thread(bytes_memory, file_bytes)):
+            started = time.perf_counter()
+            try:
+                _, policy_data, cache_info = await extract_policy_records(file_bytes, filename, content_type)
+                outputs = await calculate_outputs(policy_data, company_name)
+                await record_history(file_bytes, filename, company_name, outputs["policy_data"], outputs["calculated_data"])
+                return {
+                    "filename": filename,
+                    "status": "ok",
+                    "records": len(outputs["calculated_data"]),
+                    "seconds": round(time.perf_counter() - started, 3),
+                    "cache_hit": cache_info.get("hit", False),
+                    "calculated_data": outputs["calculated_data"]
+                }
+            except Exception as e:
+                logger.error(f"❌ Batch file {filename} failed: {str(e)}")
+                return {
+                    "filename": filename,
+                    "status": "failed",
+                    "records": 0,
+                    "seconds": round(time.perf_counter() - started, 3),
+                    "error": str(e)
+                }
+    
+    results = await asyncio.gather(*(run_one(*upload) for upload in uploads))
+    succeeded = [r for r in results if r["status"] == "ok"]
+    
+    if not succeeded:
+        raise ValueError("No records extracted from any file in the batch")
+    
+    used_names = set()
+    files = [
+        (unique_sheet_name(result["filename"], used_names), result["filename"], result.pop("calculated_data"))
+        for result in succeeded
+    ]
+    consolidated = await cpu_pool.run(build_batch_outputs, files, company_name)
+    calculated_data = consolidated["calculated_data"]
+    
+    return {
+        "files": results,
+        "calculated_data": calculated_data,
+        "excel_data": consolidated["excel_data"],
+        "metrics": {
+            "total_files": len(results),
+            "succeeded": len(succeeded),
+            "failed": len(results) - len(succeeded),
+            "total_records": len(calculated_data),
+            "unique_segments": consolidated["unique_segments"],
+            "company_name": company_name,
+            "seconds": round(time.perf_counter() - batch_started, 3)
+        }
+    }
+
 @app.get("/", response_class=HTMLResponse)
 async def root():
     """Serve HTML frontend"""
@@ -614,29 +1192,432 @@ async def root():
         return HTMLResponse(content=html_path.read_text(encoding="utf-8"))
     return HTMLResponse(content="<h1>Insurance Policy Processing System</h1><p>Upload via POST /process</p>")
 
+class ClientDisconnected(Exception):
+    """Raised when the client goes away before processing finishes"""
+
+async def run_until_disconnected(request: Request, coro):
+    """Run coro, cancelling it if the client disconnects before it completes"""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                logger.warning("⚠️ Client disconnected, cancelled processing")
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+
+async def admit_upload(upload: UploadFile):
+    """Wait until the upload's estimated peak memory fits in the budget; enter the result to hold it"""
+    # Reading the headers (page counts take the pdfium lock the renders hold) stays off the event loop
+    amount = await asyncio.to_thread(upload_memory, upload)
+    with stage("memory_wait"):
+        return await memory_budget.acquire(amount)
+
 @app.post("/process")
-async def process_policy(company_name: str = Form(...), policy_file: UploadFile = File(...)):
-    """Process policy image"""
+async def process_policy(request: Request, company_name: str = Form(...), policy_file: UploadFile = File(...),
+                         response_format: str = Form("slim"), include_timings: bool = Form(False)):
+    """Process policy image.
+
+    response_format: slim (records + artifact links, default), full (old
+    embed-everything payload) or xlsx (the workbook streamed as the response body).
+    include_timings adds per-stage timings, token usage, payload sizes and a memory report to JSON responses.
+    """
+    if response_format not in RESPONSE_FORMATS:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Unknown response_format {response_format!r}; expected one of {', '.join(RESPONSE_FORMATS)}"}
+        )
     try:
-        policy_file_bytes = await policy_file.read()
+        with track_request() as timings, await admit_upload(policy_file):
+            with stage("upload_read"):
+                policy_file_bytes = await read_upload(policy_file)
+            if not policy_file_bytes:
+                return JSONResponse(status_code=400, content={"error": "Empty file"})
+            record_bytes("upload", len(policy_file_bytes))
+            
+            results = await run_until_disconnected(
+                request,
+                process_files(policy_file_bytes, policy_file.filename, policy_file.content_type, company_name,
+                              response_format=response_format)
+            )
+            
+            if response_format == "xlsx":
+                # Written to a temporary file by the CPU pool and streamed from there. Rendered per
+                # response rather than in the shared run: each response deletes the file it streamed
+                xlsx_file = await run_until_disconnected(
+                    request, cpu_pool.run(records_xlsx_file, results["calculated_data"], company_name)
+                )
+                return FileResponse(
+                    xlsx_file,
+                    media_type=XLSX_MEDIA_TYPE,
+                    filename="policy_data.xlsx",
+                    background=BackgroundTask(os.remove, xlsx_file)
+                )
+            if include_timings:
+                results["timings"] = timings.as_dict()
+            with stage("response_serialization"):
+                response = JSONResponse(content=results)
+            record_bytes("response", len(response.body))
+            return response
+        
+    except ClientDisconnected:
+        return JSONResponse(status_code=499, content={"error": "Client disconnected"})
+    except UploadTooLarge as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        if is_transient_error(e):
+            return JSONResponse(status_code=503, content={"error": f"Model temporarily unavailable, please retry: {str(e)}"})
+        logger.error(f"Error: {str(e)}", exc_info=True)
+        return JSONResponse(status_code=500, content={"error": f"Processing failed: {str(e)}"})
+
+@app.get("/artifacts/{artifact_id}.{fmt}")
+async def download_artifact(artifact_id: str, fmt: str):
+    """Download a result as XLSX/CSV/JSON; rendered on first fetch, then reused until it expires"""
+    try:
+        with stage("artifact_render"):
+            content = await asyncio.to_thread(artifact_store.render, artifact_id, fmt)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    if content is None:
+        return JSONResponse(status_code=404, content={"error": "Artifact not found or expired"})
+    return Response(
+        content=content,
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="policy_data_{artifact_id[:8]}.{fmt}"'}
+    )
+
+async def run_policy_job(job: dict, report_progress) -> dict:
+    """Job handler: run the normal /process pipeline for a queued upload"""
+    # Background jobs share one fair-queueing slot, so interactive uploads are not stuck behind them
+    with user_scope("jobs"):
+        async with memory_budget.reserve(await asyncio.to_thread(bytes_memory, job["file"])):
+            return await process_files(
+                job["file"], job["filename"], job["content_type"] or '', job["company_name"], on_progress=report_progress
+            )
+
+def job_status(job: dict) -> dict:
+    """Public view of a job row"""
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "attempts": job["attempts"],
+        "error": job["error"],
+        "filename": job["filename"],
+        "company_name": job["company_name"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "result_url": f"/jobs/{job['id']}/result" if job["status"] == SUCCEEDED else None,
+        "excel_url": f"/jobs/{job['id']}/excel" if job["status"] == SUCCEEDED else None
+    }
+
+@app.post("/jobs")
+async def submit_job(company_name: str = Form(...), policy_file: UploadFile = File(...)):
+    """Queue a policy image for background processing and return its job id immediately"""
+    try:
+        get_file_extension(policy_file.filename, policy_file.content_type or '')
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    
+    # Only stored here (the bytes and SQLite's copy of them); the worker reserves for decoding
+    async with memory_budget.reserve(2 * upload_size(policy_file)):
+        try:
+            policy_file_bytes = await read_upload(policy_file)
+        except UploadTooLarge as e:
+            return JSONResponse(status_code=413, content={"error": str(e)})
         if not policy_file_bytes:
             return JSONResponse(status_code=400, content={"error": "Empty file"})
+        job_id = await asyncio.to_thread(
+            get_job_store().submit, policy_file_bytes, policy_file.filename, policy_file.content_type or '', company_name
+        )
+    logger.info(f"📥 Queued job {job_id} for {policy_file.filename}")
+    return JSONResponse(status_code=202, content={
+        "job_id": job_id,
+        "status": QUEUED,
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events"
+    })
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Poll a job's status and progress"""
+    job = await asyncio.to_thread(get_job_store().get, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    return JSONResponse(content=job_status(job))
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Full /process-style result of a finished job"""
+    job = await asyncio.to_thread(get_job_store().get, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    if job["status"] != SUCCEEDED:
+        return JSONResponse(status_code=409, content=job_status(job))
+    return Response(content=job["result"], media_type="application/json")
+
+@app.get("/jobs/{job_id}/excel")
+async def get_job_excel(job_id: str):
+    """Download a finished job's workbook as a binary file"""
+    job = await asyncio.to_thread(get_job_store().get, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    if job["status"] != SUCCEEDED:
+        return JSONResponse(status_code=409, content=job_status(job))
+    excel_bytes = base64.b64decode(json.loads(job["result"])["excel_data"])
+    return Response(
+        content=excel_bytes,
+        media_type=XLSX_MEDIA_TYPE,
+        headers={"Content-Disposition": f'attachment; filename="{job_id}.xlsx"'}
+    )
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """Server-sent events with each status/progress change until the job finishes"""
+    async def events():
+        last = None
+        while not await request.is_disconnected():
+            job = await asyncio.to_thread(get_job_store().get, job_id)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Job not found'})}\n\n"
+                return
+            status = job_status(job)
+            snapshot = (status["status"], status["progress"], status["attempts"])
+            if snapshot != last:
+                last = snapshot
+                yield f"data: {json.dumps(status)}\n\n"
+            if job["status"] in (SUCCEEDED, FAILED):
+                return
+            await asyncio.sleep(JOB_POLL_SECONDS)
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.post("/process/batch")
+async def process_policy_batch(request: Request, company_name: str = Form(...), policy_files: list[UploadFile] = File(...)):
+    """Process several policy images (or ZIP archives of images) into one combined workbook"""
+    try:
+        uploads = []
+        for policy_file in policy_files:
+            content_type = policy_file.content_type or ''
+            is_zip = is_zip_upload(policy_file.filename, content_type)
+            file_bytes = await read_upload(policy_file, MAX_BATCH_UPLOAD_BYTES if is_zip else MAX_UPLOAD_BYTES)
+            if not file_bytes:
+                continue
+            if is_zip:
+                uploads.extend(expand_zip(file_bytes, policy_file.filename))
+            else:
+                uploads.append((policy_file.filename, file_bytes, content_type))
+        
+        if not uploads:
+            return JSONResponse(status_code=400, content={"error": "No files uploaded"})
+        if len(uploads) > BATCH_MAX_FILES:
+            return JSONResponse(status_code=400, content={"error": f"Too many files ({len(uploads)} > {BATCH_MAX_FILES})"})
         
-        results = process_files(policy_file_bytes, policy_file.filename, policy_file.content_type, company_name)
+        results = await run_until_disconnected(request, process_batch(uploads, company_name))
         return JSONResponse(content=results)
         
-    except ValueError as e:
+    except ClientDisconnected:
+        return JSONResponse(status_code=499, content={"error": "Client disconnected"})
+    except UploadTooLarge as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    except (ValueError, zipfile.BadZipFile) as e:
         return JSONResponse(status_code=400, content={"error": str(e)})
     except Exception as e:
         logger.error(f"Error: {str(e)}", exc_info=True)
-        return JSONResponse(status_code=500, content={"error": f"Processing failed: {str(e)}"})
+        return JSONResponse(status_code=500, content={"error": f"Batch processing failed: {str(e)}"})
+
+def ndjson_event(event: str, **payload) -> str:
+    """One line of the /process/stream NDJSON output"""
+    return json.dumps({"event": event, **payload}) + "\n"
+
+async def stream_policy_events(policy_file_bytes: bytes, policy_filename: str, policy_content_type: str, company_name: str):
+    """Yield NDJSON events: each calculated record as soon as the model finishes it, then the Excel file"""
+    yield ndjson_event("start", filename=policy_filename, company_name=company_name)
+    try:
+        file_extension = get_file_extension(policy_filename, policy_content_type)
+        cache_key = make_cache_key(policy_file_bytes, EXTRACTION_VERSION)
+        cached_text = await asyncio.to_thread(result_cache.get, cache_key)
+        cache_info = {"hit": cached_text is not None}
+        
+        async def extracted_records():
+            if cached_text is not None:
+                records = json.loads(cached_text)
+                for record in ([records] if isinstance(records, dict) else records):
+                    yield record
+                return
+            
+            # Pages are extracted concurrently and streamed page by page, in order
+            pages = await asyncio.to_thread(page_count, policy_file_bytes)
+            if pages > 1 or is_pdf(policy_file_bytes):
+                async for _, page_records in iter_pages(policy_file_bytes, pages, cache_info):
+                    for record in page_records:
+                        yield record
+                return
+            
+            with stage("local_ocr"):
+                local = await asyncio.to_thread(extract_local, policy_file_bytes)
+            if local is not None:
+                cache_info.update(engine="local", layout=local.layout)
+                for record in local.records:
+                    yield record
+                return
+            cache_info["engine"] = "vision"
+            
+            with stage("preprocess"):
+                image_bytes, mime_type = await asyncio.to_thread(preprocess_image, policy_file_bytes)
+            mime_type = mime_type or f"image/{file_extension}"
+            retain(len(policy_file_bytes) + payload_memory(image_bytes))
+            # Streams go to the full model with the full prompt: a fast reply could only be validated once it had
+            # been streamed, and layout detection would hold back the first record by a whole model call
+            cache_info["layout"] = None
+            parser = JSONArrayStreamParser()
+            streamed = []
+            async for delta in stream_extraction(image_bytes, mime_type, EXTRACTION_PROMPT):
+                for record in parser.feed(delta):
+                    # Copy: the consumer adds calculated fields to the yielded record
+                    streamed.append(dict(record))
+                    yield record
+            if streamed and not parser.finished:
+                logger.warning(f"⚠️ Stream cut off after {len(streamed)} records, requesting the rest")
+                records, complete = await continue_extraction(image_bytes, mime_type, EXTRACTION_PROMPT, streamed)
+                cache_info["salvage"] = {"skipped": parser.skipped, "truncated": True, "complete": complete}
+                for record in records[len(streamed):]:
+                    yield record
+            elif parser.skipped:
+                cache_info["salvage"] = {"skipped": parser.skipped, "truncated": False, "complete": True}
+        
+        raw_records = []
+        policy_data = []
+        calculated_data = []
+        async for record in extracted_records():
+            if not isinstance(record, dict):
+                continue
+            raw_records.append(dict(record))
+            calculated = calculate_records([record])
+            policy_data.append(record)
+            calculated_data.extend(calculated)
+            for row in calculated:
+                yield ndjson_event("record", index=len(calculated_data) - 1, data=row)
+        
+        if not calculated_data:
+            raise ValueError("No policy data found")
+        
+        if cached_text is None and cache_info.get("salvage", {}).get("complete", True):
+            await asyncio.to_thread(result_cache.set, cache_key, json.dumps(raw_records))
+        await record_history(policy_file_bytes, policy_filename, company_name, policy_data, calculated_data)
+        
+        logger.info(f"✅ Streamed {len(calculated_data)} records")
+        excel_data = await cpu_pool.run(records_excel, calculated_data, company_name)
+        yield ndjson_event(
+            "complete",
+            excel_data=excel_data,
+            metrics=build_metrics(policy_data, calculated_data, company_name, cache_info)
+        )
+    
+    except Exception as e:
+        logger.error(f"Error in stream processing: {str(e)}", exc_info=True)
+        yield ndjson_event("error", error=str(e))
+
+@app.post("/process/stream")
+async def process_policy_stream(company_name: str = Form(...), policy_file: UploadFile = File(...)):
+    """Process policy image, streaming records as NDJSON while the model produces them"""
+    reservation = await admit_upload(policy_file)
+    try:
+        policy_file_bytes = await read_upload(policy_file)
+    except UploadTooLarge as e:
+        reservation.release()
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    if not policy_file_bytes:
+        reservation.release()
+        return JSONResponse(status_code=400, content={"error": "Empty file"})
+    
+    async def events():
+        with reservation:
+            async for event in stream_policy_events(policy_file_bytes, policy_file.filename, policy_file.content_type, company_name):
+                yield event
+    
+    # The background release covers a client that disconnects before the body is iterated
+    return StreamingResponse(events(), media_type="application/x-ndjson", background=BackgroundTask(reservation.release))
+
+@app.post("/history/recompute")
+async def recompute_history(company_name: str = Form(None), apply: bool = Form(False), diff_format: str = Form("json")):
+    """Re-run the current rules over every stored extraction (no model calls) and return the changed payouts.
+
+    apply=true writes the new payouts back; diff_format=csv downloads the changed rows.
+    """
+    store = get_history_store()
+    if store is None:
+        return JSONResponse(status_code=404, content={"error": "Extraction history is disabled (EXTRACTION_HISTORY=off)"})
+    if diff_format not in ("json", "csv"):
+        return JSONResponse(status_code=400, content={"error": f"Unsupported diff_format: {diff_format}"})
+    
+    with stage("history_recompute"):
+        result = await asyncio.to_thread(store.recompute, RULE_INDEX, RULES_VERSION, company_name, apply)
+    if diff_format == "csv":
+        return Response(
+            content=result["diff"].to_csv(index=False),
+            media_type=MEDIA_TYPES["csv"],
+            headers={"Content-Disposition": f'attachment; filename="payout_diff_{RULES_VERSION}.csv"'}
+        )
+    return JSONResponse(content={
+        "summary": result["summary"],
+        "diff": json.loads(result["diff"].to_json(orient="records"))
+    })
+
+@app.get("/history/query")
+async def query_history(location: str = None, segment: str = None, lob: str = None, policy_type: str = None,
+                        company_name: str = None, date_from: str = None, date_to: str = None,
+                        group_by: str = None, limit: int = 1000):
+    """Look up stored payouts (newest first), or aggregate them with group_by=location,month,...
+
+    Filters match normalized values ('pune' finds 'PUNE '); dates are inclusive YYYY-MM-DD effective dates.
+    """
+    store = get_history_store()
+    if store is None:
+        return JSONResponse(status_code=404, content={"error": "Extraction history is disabled (EXTRACTION_HISTORY=off)"})
+    
+    filters = {"location": location, "segment": segment, "lob": lob, "policy_type": policy_type, "company_name": company_name}
+    groups = [name.strip() for name in group_by.split(",") if name.strip()] if group_by else []
+    try:
+        with stage("history_query"):
+            result = await asyncio.to_thread(store.query, filters, date_from, date_to, groups, limit)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return JSONResponse(content=result)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage latencies, token usage, payload sizes, request latency, peak memory"""
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/routing/stats")
+async def routing_stats():
+    """Per-route calls, latency, estimated cost and escalation rate/reasons since the worker started"""
+    return JSONResponse(content=route_stats.stats())
 
 @app.get("/health")
 async def health_check():
     """Health check"""
-    return JSONResponse(content={"status": "healthy"})
+    return JSONResponse(content={
+        "status": "healthy", "memory_budget": memory_budget.stats(), "cpu_pool": cpu_pool.stats(), "pid": os.getpid()
+    })
 
 if __name__ == "__main__":
     import uvicorn
-    logger.info("🚀 Starting server at http://localhost:8000")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    web_workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    logger.info(f"🚀 Starting server at http://localhost:8000 with {web_workers} worker(s)")
+    if web_workers > 1:
+        # Separate processes sharing caches, artifacts and jobs through data/ (see gunicorn_conf.py)
+        from gunicorn_conf import MULTI_WORKER_DEFAULTS
+        for name, value in MULTI_WORKER_DEFAULTS.items():
+            os.environ.setdefault(name, value)
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=web_workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
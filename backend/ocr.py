@@ -0,0 +1,450 @@
+"""Offline fast path: local OCR + deterministic parsers for the fixed table layouts.
+
+Clean, machine-generated circulars in a known layout (RTO-Statename / Revised PO,
+Required / Existing, the Geo segment Bikes/Scooter CC grid) are read with a
+local OCR engine, laid out on a cell grid from the header columns and turned
+into the same records the vision model returns. Anything that is not clearly
+one of those layouts, or reads with low confidence, goes to the model.
+
+A full read takes seconds, so uploads are turned away early: photos and blank
+images by a thumbnail's histogram, other tables by reading only the first lines
+of the top-left corner, where every layout has its location column header.
+
+The OCR engine is optional and not in requirements.txt: install
+requirements-ocr.txt (rapidocr-onnxruntime), or pytesseract with the
+tesseract binary. Without either, every upload goes to the vision model.
+"""
+import logging
+import math
+import os
+import re
+from functools import lru_cache
+from io import BytesIO
+from statistics import median
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# off: always use the vision model, auto: try the local parsers first when an OCR engine is installed
+LOCAL_OCR = os.getenv("LOCAL_OCR", "auto").lower()
+# auto picks tesseract (pytesseract + binary) when present, else rapidocr-onnxruntime
+LOCAL_OCR_ENGINE = os.getenv("LOCAL_OCR_ENGINE", "auto").lower()
+LOCAL_OCR_MIN_CONFIDENCE = float(os.getenv("LOCAL_OCR_MIN_CONFIDENCE", "0.9"))
+# Small scans are upscaled so table text is at least this many pixels on the long edge, large photos
+# downscaled to at most LOCAL_OCR_MAX_LONG_EDGE (OCR time grows with the pixels and the text boxes)
+LOCAL_OCR_MIN_LONG_EDGE = int(os.getenv("LOCAL_OCR_MIN_LONG_EDGE", "1000"))
+LOCAL_OCR_MAX_LONG_EDGE = int(os.getenv("LOCAL_OCR_MAX_LONG_EDGE", "1600"))
+# How many leading rows may hold the header (titles, notes above the table)
+HEADER_SEARCH_ROWS = 6
+# Before the full read, only this top-left corner (share of width, height) is read: every layout's
+# first column is the location, so a card without its header there costs a fraction of a full read
+HEADER_CORNER = (0.35, 0.3)
+# A clean machine-generated page is mostly paper with a little ink; photos and blank images are not
+PAPER_LEVEL = 200
+MIN_PAPER_SHARE = 0.5
+MIN_INK_SHARE = 0.002
+
+# Part of the extraction cache key
+OCR_VERSION = f"{LOCAL_OCR}:{LOCAL_OCR_ENGINE}:{LOCAL_OCR_MIN_CONFIDENCE}:{LOCAL_OCR_MIN_LONG_EDGE}:{LOCAL_OCR_MAX_LONG_EDGE}:2"
+
+
+class TextBox(NamedTuple):
+    text: str
+    left: float
+    top: float
+    right: float
+    bottom: float
+    confidence: float
+
+    @property
+    def center_x(self) -> float:
+        return (self.left + self.right) / 2
+
+    @property
+    def center_y(self) -> float:
+        return (self.top + self.bottom) / 2
+
+
+class LocalExtraction(NamedTuple):
+    layout: str
+    records: list
+    confidence: float
+
+
+# ---------------------------------------------------------------------------
+# OCR engines
+# ---------------------------------------------------------------------------
+
+@lru_cache(maxsize=1)
+def _rapidocr():
+    from rapidocr_onnxruntime import RapidOCR
+    # By default detection upscales images to at least 736px on the short side, a header strip included
+    return RapidOCR(det_limit_type="max", det_limit_side_len=LOCAL_OCR_MAX_LONG_EDGE)
+
+
+def _read_rapidocr(image) -> list:
+    import numpy as np
+    result, _ = _rapidocr()(np.asarray(image.convert("RGB")), use_cls=False)
+    boxes = []
+    for points, text, score in result or []:
+        xs = [point[0] for point in points]
+        ys = [point[1] for point in points]
+        boxes.append(TextBox(text.strip(), min(xs), min(ys), max(xs), max(ys), float(score)))
+    return boxes
+
+
+def _line_starts_rapidocr(image, lines: int) -> list:
+    """Text of the leftmost box on each of the first `lines` lines: detection over the whole image,
+    recognition (the slow part, one box at a time) only for those boxes"""
+    import numpy as np
+    pixels = np.asarray(image.convert("RGB"))
+    result, _ = _rapidocr()(pixels, use_cls=False, use_rec=False)
+    boxes = []
+    for points in result or []:
+        xs = [point[0] for point in points]
+        ys = [point[1] for point in points]
+        boxes.append(TextBox("", min(xs), min(ys), max(xs), max(ys), 1.0))
+
+    texts = []
+    for row in group_rows(boxes)[:lines]:
+        box = row[0]
+        crop = pixels[max(0, int(box.top)):math.ceil(box.bottom), max(0, int(box.left)):math.ceil(box.right)]
+        recognized, _ = _rapidocr()(crop, use_det=False, use_cls=False)
+        texts.append(recognized[0][0].strip() if recognized else "")
+    return texts
+
+
+def _read_tesseract(image) -> list:
+    """Words from tesseract, merged into phrases so one box is roughly one cell"""
+    import pytesseract
+    data = pytesseract.image_to_data(image, config="--psm 6", output_type=pytesseract.Output.DICT)
+    boxes = []
+    current = None
+    for i, text in enumerate(data["text"]):
+        text = text.strip()
+        confidence = float(data["conf"][i])
+        if not text or confidence < 0:
+            continue
+        left, top = data["left"][i], data["top"][i]
+        right, bottom = left + data["width"][i], top + data["height"][i]
+        line = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        # Words closer than ~one character height belong to the same cell
+        if current and current[0] == line and left - current[1].right < (bottom - top):
+            box = current[1]
+            merged = TextBox(
+                f"{box.text} {text}", box.left, min(box.top, top), right, max(box.bottom, bottom),
+                min(box.confidence, confidence / 100)
+            )
+            boxes[-1] = merged
+            current = (line, merged)
+        else:
+            boxes.append(TextBox(text, left, top, right, bottom, confidence / 100))
+            current = (line, boxes[-1])
+    return boxes
+
+
+@lru_cache(maxsize=1)
+def ocr_engine():
+    """Name of the usable OCR engine, or None when none is installed"""
+    candidates = ["tesseract", "rapidocr"] if LOCAL_OCR_ENGINE == "auto" else [LOCAL_OCR_ENGINE]
+    for name in candidates:
+        try:
+            if name == "tesseract":
+                import pytesseract
+                pytesseract.get_tesseract_version()
+            elif name == "rapidocr":
+                import rapidocr_onnxruntime  # noqa: F401
+            else:
+                continue
+            logger.info(f"🔎 Local OCR engine: {name}")
+            return name
+        except Exception:
+            continue
+    logger.info("🔎 No local OCR engine installed, every upload goes to the vision model")
+    return None
+
+
+def load_image(image_bytes: bytes):
+    """The upload as grayscale, its long edge scaled into LOCAL_OCR_MIN_LONG_EDGE..LOCAL_OCR_MAX_LONG_EDGE"""
+    from PIL import Image, ImageOps
+
+    image = Image.open(BytesIO(image_bytes))
+    scale = LOCAL_OCR_MAX_LONG_EDGE / max(image.size)
+    if scale < 1:
+        # JPEGs decode straight at a fraction of their size, instead of in full and then resized
+        image.draft("L", (round(image.width * scale), round(image.height * scale)))
+    image = ImageOps.exif_transpose(image).convert("L")
+
+    long_edge = max(image.size)
+    if long_edge > LOCAL_OCR_MAX_LONG_EDGE:
+        image.thumbnail((LOCAL_OCR_MAX_LONG_EDGE, LOCAL_OCR_MAX_LONG_EDGE), Image.LANCZOS)
+    elif long_edge < LOCAL_OCR_MIN_LONG_EDGE:
+        scale = LOCAL_OCR_MIN_LONG_EDGE / long_edge
+        image = image.resize((round(image.width * scale), round(image.height * scale)), Image.LANCZOS)
+    return image
+
+
+def looks_like_document(image) -> bool:
+    """Whether a grayscale image is mostly paper with some ink, read off a thumbnail"""
+    thumbnail = image.copy()
+    thumbnail.thumbnail((256, 256))
+    histogram = thumbnail.histogram()
+    pixels = sum(histogram)
+    paper = sum(histogram[PAPER_LEVEL:]) / pixels
+    return paper >= MIN_PAPER_SHARE and 1 - paper >= MIN_INK_SHARE
+
+
+def read_text_boxes(image) -> list:
+    """OCR a grayscale image into text boxes (pixel coordinates of that image)"""
+    reader = _read_tesseract if ocr_engine() == "tesseract" else _read_rapidocr
+    return [box for box in reader(image) if box.text]
+
+
+def has_location_header(image) -> bool:
+    """Whether one of the first lines of the top-left corner reads like a known layout's location header"""
+    width, height = HEADER_CORNER
+    corner = image.crop((0, 0, round(image.width * width), round(image.height * height)))
+    if ocr_engine() == "tesseract":
+        texts = [row[0].text for row in group_rows(read_text_boxes(corner))[:HEADER_SEARCH_ROWS]]
+    else:
+        texts = _line_starts_rapidocr(corner, HEADER_SEARCH_ROWS)
+    # Headers may wrap onto a second line
+    candidates = texts + [f"{first} {second}" for first, second in zip(texts, texts[1:])]
+    patterns = [layout.columns["location"] for layout in TABLE_LAYOUTS]
+    return any(re.search(pattern, normalize(text)) for text in candidates for pattern in patterns)
+
+
+# ---------------------------------------------------------------------------
+# Grid reconstruction
+# ---------------------------------------------------------------------------
+
+def group_rows(boxes: list) -> list:
+    """Cluster boxes into table rows by vertical position, each row sorted left to right"""
+    if not boxes:
+        return []
+    tolerance = 0.6 * median(box.bottom - box.top for box in boxes)
+    rows = []
+    for box in sorted(boxes, key=lambda b: b.center_y):
+        if rows and abs(box.center_y - rows[-1]["y"]) <= tolerance:
+            row = rows[-1]
+            row["boxes"].append(box)
+            row["y"] = sum(b.center_y for b in row["boxes"]) / len(row["boxes"])
+        else:
+            rows.append({"y": box.center_y, "boxes": [box]})
+    return [sorted(row["boxes"], key=lambda b: b.left) for row in rows]
+
+
+def merge_header_cells(boxes: list) -> list:
+    """Join boxes that overlap horizontally (wrapped header text) into one cell each"""
+    cells = []
+    for box in sorted(boxes, key=lambda b: b.left):
+        if cells and box.left < cells[-1][-1].right and box.right > cells[-1][0].left:
+            cells[-1].append(box)
+        else:
+            cells.append([box])
+    merged = []
+    for cell in cells:
+        ordered = sorted(cell, key=lambda b: (b.top, b.left))
+        merged.append(TextBox(
+            " ".join(b.text for b in ordered),
+            min(b.left for b in cell), min(b.top for b in cell),
+            max(b.right for b in cell), max(b.bottom for b in cell),
+            min(b.confidence for b in cell)
+        ))
+    return merged
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", "", text.lower().replace("–", "-").replace("—", "-"))
+
+
+def match_header(cells: list, columns: dict) -> dict:
+    """Map column keys to the header cells they label"""
+    matched = {}
+    for cell in cells:
+        text = normalize(cell.text)
+        for key, pattern in columns.items():
+            if key not in matched and re.search(pattern, text):
+                matched[key] = cell
+                break
+    return matched
+
+
+def assign_columns(row: list, anchors: list) -> dict:
+    """Place each box of a data row in the header column whose span is nearest its centre"""
+    values = {}
+    for box in row:
+        key = min(anchors, key=lambda anchor: _distance(box.center_x, anchor[1]))[0]
+        if key is not None:
+            values.setdefault(key, []).append(box)
+    return {key: (" ".join(b.text for b in boxes), min(b.confidence for b in boxes)) for key, boxes in values.items()}
+
+
+def _distance(x: float, cell: TextBox) -> float:
+    if cell.left <= x <= cell.right:
+        return 0.0
+    return min(abs(x - cell.left), abs(x - cell.right))
+
+
+# ---------------------------------------------------------------------------
+# Layout parsers
+# ---------------------------------------------------------------------------
+
+def parse_rate(text: str):
+    """Percentage cell as a float, None when empty, a dash or unreadable"""
+    text = (text or "").strip()
+    if re.fullmatch(r"misp", text, re.IGNORECASE):
+        return 0.0
+    match = re.fullmatch(r"-?\s*(\d+(?:\.\d+)?)\s*%?", text)
+    if not match:
+        return None
+    value = float(match.group(1))
+    return value if 0 <= value <= 100 else None
+
+
+def _parse_revised_po(row: dict) -> list:
+    revised = parse_rate(row.get("revised", ("", 1))[0])
+    latest = parse_rate(row.get("from_month", ("", 1))[0])
+    remark = row.get("remarks", ("", 1))[0]
+    location = row["location"][0]
+    excluded = re.search(r"\bEx(?:\.\s*|\s+)[A-Za-z][\w .-]*", remark)
+    if excluded:
+        location = f"{location} {excluded.group(0).strip()}"
+    payin = latest if latest is not None else revised
+    return [{"segment": "PVT CAR TP", "policy_type": "TP", "location": location, "payin": payin, "remark": remark}]
+
+
+def _parse_required_existing(row: dict) -> list:
+    required = row.get("required", ("", 1))[0].strip()
+    payin = parse_rate(row.get("existing", ("", 1))[0]) if required in ("", "-", "–") else parse_rate(required)
+    return [{"segment": "PVT CAR TP", "policy_type": "TP", "location": row["location"][0], "payin": payin, "remark": ""}]
+
+
+GEO_CATEGORIES = {
+    "bikes_lt75": "Bikes <75 CC",
+    "bikes_75_150": "Bikes >75–150 CC",
+    "bikes_150_350": "Bikes >150–350 CC",
+    "bikes_gt350": "Bikes >350 CC",
+    "scooter_lt75": "Scooter <75 CC",
+    "scooter_75_150": "Scooter >75–150 CC"
+}
+
+
+def _parse_geo_cc_grid(row: dict) -> list:
+    return [{
+        "segment": "TW SAOD + COMP",
+        "policy_type": "Comp",
+        "location": row["location"][0],
+        "doable_district": row.get("district", ("", 1))[0],
+        "vehicle_category": category,
+        "payin": parse_rate(row.get(key, ("", 1))[0]),
+        "remark": ""
+    } for key, category in GEO_CATEGORIES.items()]
+
+
+class TableLayout(NamedTuple):
+    name: str
+    # Column key -> regex on the normalized (lowercase, no whitespace) header text
+    columns: dict
+    required: tuple
+    parse_row: callable
+
+
+# Names match the layout templates in templates.py
+TABLE_LAYOUTS = [
+    TableLayout("revised_po", {
+        "location": r"rto|statename",
+        "revised": r"revised",
+        "from_month": r"^from",
+        "remarks": r"remark"
+    }, ("location", "revised"), _parse_revised_po),
+    TableLayout("required_existing", {
+        "location": r"rto|statename",
+        "required": r"required",
+        "existing": r"existing"
+    }, ("location", "required", "existing"), _parse_required_existing),
+    TableLayout("geo_cc_grid", {
+        "location": r"geo.*new",
+        "district": r"geo.*old",
+        "bikes_lt75": r"bike.*<75",
+        "bikes_75_150": r"bike.*75-150",
+        "bikes_150_350": r"bike.*150-350",
+        "bikes_gt350": r"bike.*>350",
+        "scooter_lt75": r"scoot.*<75",
+        "scooter_75_150": r"scoot.*75-150"
+    }, ("location", "bikes_lt75", "bikes_75_150", "bikes_150_350", "bikes_gt350", "scooter_lt75", "scooter_75_150"),
+        _parse_geo_cc_grid)
+]
+
+
+def find_header(rows: list, layout: TableLayout):
+    """(index of the first data row, matched header cells) for a layout, or None"""
+    for start in range(min(HEADER_SEARCH_ROWS, len(rows))):
+        # Headers may wrap onto a second line
+        for height in (1, 2):
+            if start + height > len(rows):
+                break
+            cells = merge_header_cells([box for row in rows[start:start + height] for box in row])
+            matched = match_header(cells, layout.columns)
+            if all(key in matched for key in layout.required):
+                anchors = [(next((k for k, c in matched.items() if c is cell), None), cell) for cell in cells]
+                return start + height, anchors
+    return None
+
+
+def parse_table(boxes: list):
+    """Records from OCR boxes for the first layout whose header matches, or None"""
+    rows = group_rows(boxes)
+    for layout in TABLE_LAYOUTS:
+        header = find_header(rows, layout)
+        if header is None:
+            continue
+        first_row, anchors = header
+
+        records = []
+        scores = []
+        cells = 0
+        valid = 0
+        for row in rows[first_row:]:
+            values = assign_columns(row, anchors)
+            if not values.get("location", ("", 0))[0]:
+                continue
+            scores.extend(confidence for _, confidence in values.values())
+            for record in layout.parse_row(values):
+                cells += 1
+                valid += record["payin"] is not None
+                records.append(record)
+
+        if not records:
+            return None
+        confidence = (sum(scores) / len(scores)) * (valid / cells)
+        return LocalExtraction(layout.name, records, round(confidence, 3))
+    return None
+
+
+def extract_local(image_bytes: bytes):
+    """Records for a known layout read with enough confidence, else None (use the vision model)"""
+    if LOCAL_OCR == "off" or ocr_engine() is None:
+        return None
+    try:
+        image = load_image(image_bytes)
+        # Cheap checks first: most uploads are photos or other layouts, and a full read takes seconds
+        if not looks_like_document(image):
+            logger.info("🔎 Not a clean document, using the vision model")
+            return None
+        if not has_location_header(image):
+            logger.info("🔎 No known table header found locally")
+            return None
+        result = parse_table(read_text_boxes(image))
+    except Exception as e:
+        logger.warning(f"⚠️ Local OCR failed: {str(e)}")
+        return None
+
+    if result is None:
+        logger.info("🔎 No known table layout found locally")
+        return None
+    if result.confidence < LOCAL_OCR_MIN_CONFIDENCE:
+        logger.info(f"🔎 Local '{result.layout}' parse below confidence ({result.confidence:.2f}), using the vision model")
+        return None
+    logger.info(f"🔎 Parsed {len(result.records)} '{result.layout}' records locally ({result.confidence:.2f})")
+    return result
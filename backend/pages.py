@@ -0,0 +1,102 @@
+"""Split multi-page PDFs and multi-frame TIFFs into page images"""
+import logging
+import os
+import threading
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+# PDFs are rasterized at this resolution; 200 keeps 8pt table text legible without huge pages
+PAGE_RENDER_DPI = int(os.getenv("PAGE_RENDER_DPI", "200"))
+PAGE_MAX_PAGES = int(os.getenv("PAGE_MAX_PAGES", "50"))
+# Pages of one upload extracted at once; the scheduler still caps model calls across the worker
+PAGE_MAX_CONCURRENCY = int(os.getenv("PAGE_MAX_CONCURRENCY", "10"))
+
+# Part of the extraction cache key
+PAGES_VERSION = f"{PAGE_RENDER_DPI}:{PAGE_MAX_PAGES}"
+
+# A4 rendered at PAGE_RENDER_DPI, for estimating memory before a PDF is opened
+A4_INCHES = (8.27, 11.69)
+
+# pdfium is not thread-safe; pages are rendered one at a time across the worker
+_pdfium_lock = threading.Lock()
+
+
+def is_pdf(data) -> bool:
+    """Whether bytes (or a seekable file) hold a PDF"""
+    if isinstance(data, (bytes, bytearray)):
+        return data[:5] == b"%PDF-"
+    position = data.tell()
+    head = data.read(5)
+    data.seek(position)
+    return head == b"%PDF-"
+
+
+def _pdfium():
+    try:
+        import pypdfium2
+    except ImportError:
+        raise ValueError("PDF uploads need pypdfium2 (pip install pypdfium2)")
+    return pypdfium2
+
+
+def page_count(data) -> int:
+    """Pages in a PDF or frames in a TIFF, from bytes or a seekable file; 1 for anything else"""
+    position = None if isinstance(data, (bytes, bytearray)) else data.tell()
+    try:
+        if is_pdf(data):
+            pdfium = _pdfium()
+            with _pdfium_lock:
+                try:
+                    document = pdfium.PdfDocument(data)
+                except pdfium.PdfiumError as e:
+                    raise ValueError(f"Unreadable PDF: {str(e)}")
+                try:
+                    count = len(document)
+                finally:
+                    document.close()
+        else:
+            try:
+                from PIL import Image
+                with Image.open(BytesIO(data) if position is None else data) as image:
+                    count = getattr(image, "n_frames", 1) if image.format == "TIFF" else 1
+            except Exception:
+                return 1
+    finally:
+        if position is not None:
+            data.seek(position)
+
+    if count > PAGE_MAX_PAGES:
+        raise ValueError(f"Upload has {count} pages, the limit is {PAGE_MAX_PAGES}")
+    return count
+
+
+def rendered_page_size(dpi: int = PAGE_RENDER_DPI) -> int:
+    """Bytes of one grayscale A4 page rendered at dpi, for estimating memory before rendering"""
+    width, height = (round(inches * dpi) for inches in A4_INCHES)
+    return width * height
+
+
+def render_page(file_bytes: bytes, index: int, dpi: int = PAGE_RENDER_DPI) -> bytes:
+    """One page (0-based) as PNG bytes: a PDF page rasterized at dpi, or one TIFF frame"""
+    from PIL import Image
+
+    if is_pdf(file_bytes):
+        pdfium = _pdfium()
+        with _pdfium_lock:
+            document = pdfium.PdfDocument(file_bytes)
+            try:
+                page = document[index]
+                image = page.render(scale=dpi / 72, grayscale=True).to_pil()
+                page.close()
+            finally:
+                document.close()
+    else:
+        with Image.open(BytesIO(file_bytes)) as frames:
+            frames.seek(index)
+            image = frames.copy()
+
+    # Pre-processing re-encodes it smaller; a fast PNG is enough here
+    buffer = BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
@@ -0,0 +1,120 @@
+"""Image pre-processing to shrink vision payloads before upload"""
+import binascii
+import logging
+import os
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+IMAGE_PREPROCESS = os.getenv("IMAGE_PREPROCESS", "1") == "1"
+IMAGE_MAX_LONG_EDGE = int(os.getenv("IMAGE_MAX_LONG_EDGE", "2048"))
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "PNG").upper()
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+# PNG optimize=True is ~10x slower for a few percent; a plain zlib level is the better trade
+IMAGE_PNG_COMPRESS_LEVEL = int(os.getenv("IMAGE_PNG_COMPRESS_LEVEL", "6"))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "1") == "1"
+IMAGE_CROP = os.getenv("IMAGE_CROP", "1") == "1"
+IMAGE_CROP_THRESHOLD = int(os.getenv("IMAGE_CROP_THRESHOLD", "235"))
+IMAGE_CROP_MARGIN = int(os.getenv("IMAGE_CROP_MARGIN", "16"))
+
+# Part of the extraction cache key: different settings send different pixels
+PREPROCESS_VERSION = (
+    f"{int(IMAGE_PREPROCESS)}:{IMAGE_MAX_LONG_EDGE}:{IMAGE_OUTPUT_FORMAT}:{IMAGE_JPEG_QUALITY}:"
+    f"{int(IMAGE_GRAYSCALE)}:{int(IMAGE_CROP)}:{IMAGE_CROP_THRESHOLD}:{IMAGE_CROP_MARGIN}"
+)
+
+MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg"}
+# Multiple of 3, so every chunk encodes without padding
+BASE64_CHUNK_BYTES = 3 * 2 ** 18
+
+
+def crop_to_content(image, threshold: int = IMAGE_CROP_THRESHOLD, margin: int = IMAGE_CROP_MARGIN):
+    """Crop away the near-white border around the table"""
+    gray = image if image.mode == "L" else image.convert("L")
+    mask = gray.point(lambda p: 255 if p < threshold else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return image
+    left, top, right, bottom = bbox
+    bbox = (
+        max(0, left - margin),
+        max(0, top - margin),
+        min(image.width, right + margin),
+        min(image.height, bottom + margin)
+    )
+    return image.crop(bbox)
+
+
+def encode_image(image, output_format: str = IMAGE_OUTPUT_FORMAT) -> bytes:
+    """Re-encode a PIL image as compact PNG/JPEG bytes"""
+    buffer = BytesIO()
+    if output_format == "JPEG":
+        if image.mode not in ("L", "RGB"):
+            image = image.convert("RGB")
+        image.save(buffer, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    else:
+        image.save(buffer, format="PNG", compress_level=IMAGE_PNG_COMPRESS_LEVEL)
+    return buffer.getvalue()
+
+
+def preprocess_image(file_bytes: bytes):
+    """Decode, auto-rotate, grayscale, crop, downscale and re-encode an upload.
+
+    Returns (image_bytes, mime_type). mime_type is None when the original bytes
+    are passed through untouched (Pillow missing, decode failure, or the
+    re-encoded image would not be smaller).
+    """
+    if not IMAGE_PREPROCESS:
+        return file_bytes, None
+
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        logger.warning("⚠️ Pillow not installed, sending image without pre-processing")
+        return file_bytes, None
+
+    try:
+        image = Image.open(BytesIO(file_bytes))
+        image.load()
+        # In place: otherwise an image without an orientation tag comes back as a full copy of the frame
+        ImageOps.exif_transpose(image, in_place=True)
+
+        if IMAGE_GRAYSCALE:
+            image = image.convert("L")
+        elif image.mode not in ("L", "RGB"):
+            image = image.convert("RGB")
+
+        if IMAGE_CROP:
+            image = crop_to_content(image)
+
+        if max(image.size) > IMAGE_MAX_LONG_EDGE:
+            image.thumbnail((IMAGE_MAX_LONG_EDGE, IMAGE_MAX_LONG_EDGE), Image.LANCZOS)
+
+        processed = encode_image(image)
+    except Exception as e:
+        logger.warning(f"⚠️ Image pre-processing failed, sending original: {str(e)}")
+        return file_bytes, None
+
+    if len(processed) >= len(file_bytes):
+        return file_bytes, None
+
+    logger.info(f"🗜️ Pre-processed image {len(file_bytes)} → {len(processed)} bytes ({image.width}x{image.height})")
+    return processed, MIME_TYPES.get(IMAGE_OUTPUT_FORMAT, "image/png")
+
+
+def data_url(image_bytes: bytes, mime_type: str) -> str:
+    """base64 data URL built in one buffer.
+
+    Encodes in chunks straight into a preallocated buffer and decodes that once,
+    instead of a full base64 bytes copy, its str and an f-string copy of that.
+    """
+    prefix = f"data:{mime_type};base64,".encode("ascii")
+    buffer = bytearray(len(prefix) + (len(image_bytes) + 2) // 3 * 4)
+    buffer[:len(prefix)] = prefix
+    view = memoryview(image_bytes)
+    position = len(prefix)
+    for start in range(0, len(image_bytes), BASE64_CHUNK_BYTES):
+        encoded = binascii.b2a_base64(view[start:start + BASE64_CHUNK_BYTES], newline=False)
+        buffer[position:position + len(encoded)] = encoded
+        position += len(encoded)
+    return buffer.decode("ascii")
@@ -0,0 +1,157 @@
+"""Model routing: small, simple images go to a cheaper model first and escalate when its reply fails validation.
+
+The layout detection pass also counts the table's rows, so the cheap reply
+can be checked against what the image should hold: the schema, numeric
+payins between 0 and 100, and at least ROUTE_MIN_ROW_COVERAGE of the
+expected records. Anything else goes (back) to OPENAI_MODEL.
+
+Routing is opt-in (MODEL_ROUTING=auto): validation cannot catch a plausible
+wrong value, such as a payin with its digits swapped that is still within 0-100,
+so a routed run can keep a wrong reply the full model would have read right.
+"""
+import math
+import os
+import threading
+from collections import deque
+
+from telemetry import ESCALATIONS, ROUTE_COST, ROUTE_SECONDS, ROUTES
+from templates import TEMPLATES
+
+# auto: try the fast model on images that qualify, off (default): always the full model
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "off").lower()
+# Per-patch image billing makes this several times cheaper per image than gpt-4o (gpt-4o-mini is dearer)
+ROUTE_FAST_MODEL = os.getenv("ROUTE_FAST_MODEL", "gpt-4.1-mini")
+# Larger or longer tables go straight to the full model, where the fast one rarely gets every row
+ROUTE_MAX_PIXELS = int(os.getenv("ROUTE_MAX_PIXELS", str(1600 * 1200)))
+ROUTE_MAX_ROWS = int(os.getenv("ROUTE_MAX_ROWS", "25"))
+# Detection counts rows on a low-detail image, so only a clear shortfall escalates
+ROUTE_MIN_ROW_COVERAGE = float(os.getenv("ROUTE_MIN_ROW_COVERAGE", "0.8"))
+
+# Reply budget of the fast model: generous per record, since a cut-off reply escalates
+TOKENS_PER_RECORD = 60
+REPLY_BASE_TOKENS = 200
+REQUIRED_FIELDS = ("segment", "policy_type", "location", "payin")
+# Latencies kept per route for the percentiles on /routing/stats
+ROUTE_STATS_WINDOW = 1000
+
+# Part of the extraction cache key
+ROUTING_VERSION = f"{MODEL_ROUTING}:{ROUTE_FAST_MODEL}:{ROUTE_MAX_PIXELS}:{ROUTE_MAX_ROWS}:{ROUTE_MIN_ROW_COVERAGE}"
+
+
+def expected_records(layout: str, rows: int):
+    """Objects a reply should hold for `rows` detected table rows, or None when the rows are unknown"""
+    if rows is None:
+        return None
+    template = TEMPLATES.get(layout)
+    return rows * (template.records_per_row if template else 1)
+
+
+def choose_route(width: int, height: int, rows: int = None, tiled: bool = False) -> str:
+    """"fast" for a small image with a short (or uncounted) table, otherwise "full" """
+    if MODEL_ROUTING == "off" or tiled:
+        return "full"
+    if width * height > ROUTE_MAX_PIXELS:
+        return "full"
+    if rows is not None and rows > ROUTE_MAX_ROWS:
+        return "full"
+    return "fast"
+
+
+def reply_token_budget(expected: int, ceiling: int) -> int:
+    """max_tokens for the fast model: enough for the expected records with room to spare"""
+    if expected is None:
+        return ceiling
+    return min(ceiling, REPLY_BASE_TOKENS + TOKENS_PER_RECORD * max(1, expected))
+
+
+def parse_payin(value):
+    """A payin as a float ("67.5%" included), or None when it is missing or not a number"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return None if math.isnan(value) else float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.strip().rstrip("%").strip())
+        except ValueError:
+            return None
+    return None
+
+
+def validate_records(records, expected: int = None, segments: set = None) -> list:
+    """Reasons a fast-model reply cannot be trusted (empty when it passes)"""
+    if not isinstance(records, list) or not records:
+        return ["empty"]
+    if not all(isinstance(record, dict) for record in records):
+        return ["schema"]
+
+    problems = []
+    if any(any(field not in record for field in REQUIRED_FIELDS) for record in records):
+        problems.append("schema")
+    if segments is not None and any(record.get("segment") not in segments for record in records):
+        problems.append("segment")
+
+    # Empty cells may be null (the geo grid asks for it), but a reply without a single rate is not a rate card
+    payins = [record.get("payin") for record in records if record.get("payin") not in (None, "")]
+    values = [parse_payin(payin) for payin in payins]
+    if not values or any(value is None for value in values):
+        problems.append("payin_type")
+    elif any(not 0 <= value <= 100 for value in values):
+        problems.append("payin_range")
+
+    if expected is not None and len(records) < math.floor(expected * ROUTE_MIN_ROW_COVERAGE):
+        problems.append("row_count")
+    return problems
+
+
+class RouteStats:
+    """Calls, latency, estimated cost and escalation reasons per route, for tuning the thresholds.
+
+    Routes: "fast" (the fast reply was kept), "escalated" (fast, then the
+    full model) and "full" (sent to the full model directly).
+    """
+
+    def __init__(self, window: int = ROUTE_STATS_WINDOW):
+        self.window = window
+        self._routes = {}
+        self._reasons = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route: str, seconds: float, cost: float, reasons: list = ()):
+        ROUTES.inc(route=route)
+        ROUTE_SECONDS.observe(seconds, route=route)
+        ROUTE_COST.inc(cost, route=route)
+        for reason in reasons:
+            ESCALATIONS.inc(reason=reason)
+
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = {"calls": 0, "cost_usd": 0.0, "seconds": deque(maxlen=self.window)}
+            stats["calls"] += 1
+            stats["cost_usd"] += cost
+            stats["seconds"].append(seconds)
+            for reason in reasons:
+                self._reasons[reason] = self._reasons.get(reason, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            routes = {}
+            for route, stats in self._routes.items():
+                seconds = sorted(stats["seconds"])
+                routes[route] = {
+                    "calls": stats["calls"],
+                    "cost_usd": round(stats["cost_usd"], 6),
+                    "mean_cost_usd": round(stats["cost_usd"] / stats["calls"], 6),
+                    "p50_seconds": round(seconds[len(seconds) // 2], 3),
+                    "p95_seconds": round(seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))], 3)
+                }
+            tried = sum(self._routes.get(route, {}).get("calls", 0) for route in ("fast", "escalated"))
+            escalated = self._routes.get("escalated", {}).get("calls", 0)
+            return {
+                "routing": MODEL_ROUTING,
+                "fast_model": ROUTE_FAST_MODEL,
+                "routes": routes,
+                "escalation_rate": round(escalated / tried, 3) if tried else None,
+                "escalation_reasons": dict(self._reasons)
+            }
@@ -0,0 +1,152 @@
+"""Compiled, indexed form of FORMULA_DATA"""
+import re
+from bisect import bisect_left
+from typing import NamedTuple
+
+# Upper bounds (inclusive) of the payin bands produced by classify_payin
+PAYIN_BAND_BOUNDS = [20, 30, 50]
+# Columns of the calculated records, in output order
+OUTPUT_COLUMNS = ['segment', 'policy type', 'location', 'payin', 'remark', 'Calculated Payout', 'Formula Used', 'Rule Explanation']
+# Leading column on records extracted from a multi-page PDF / TIFF
+PAGE_COLUMN = 'page'
+PAYIN_CATEGORIES = ["Payin Below 20%", "Payin 21% to 30%", "Payin 31% to 50%", "Payin Above 50%"]
+
+# Resolved (segment, category) lookups are memoized; clear if it grows past this
+MAX_RESOLVED_KEYS = 10000
+
+
+def output_columns(calculated_data: list) -> list:
+    """OUTPUT_COLUMNS, led by the page number when the records carry one"""
+    if calculated_data and PAGE_COLUMN in calculated_data[0]:
+        return [PAGE_COLUMN] + OUTPUT_COLUMNS
+    return OUTPUT_COLUMNS
+
+
+def determine_lob(segment: str) -> str:
+    """Determine LOB from segment"""
+    segment_upper = segment.upper()
+    
+    if 'BUS' in segment_upper:
+        return "BUS"
+    elif any(kw in segment_upper for kw in ['TW', '2W', 'MC', 'SC', '1+5']):
+        return "TW"
+    elif any(kw in segment_upper for kw in ['PVT CAR', 'CAR', 'PCI']):
+        return "PVT CAR"
+    elif any(kw in segment_upper for kw in ['CV', 'GVW', 'PCV', 'GCV']):
+        return "CV"
+    elif 'TAXI' in segment_upper:
+        return "TAXI"
+    elif any(kw in segment_upper for kw in ['MISD', 'TRACTOR']):
+        return "MISD"
+    
+    return "UNKNOWN"
+
+
+def payin_band(payin_value: float) -> str:
+    """Category for a numeric payin, same bands as classify_payin"""
+    if payin_value != payin_value:  # NaN fails every <= check in classify_payin
+        return PAYIN_CATEGORIES[-1]
+    return PAYIN_CATEGORIES[bisect_left(PAYIN_BAND_BOUNDS, payin_value)]
+
+
+def parse_po_formula(po_formula: str) -> tuple:
+    """Turn a PO text like '90% of Payin', '-3%' or 'Less 2% of Payin' into (operation, amount)"""
+    less = re.search(r'Less\s+(\d+(?:\.\d+)?)%', po_formula, re.IGNORECASE)
+    if less:
+        return "subtract", float(less.group(1))
+    share = re.search(r'(\d+(?:\.\d+)?)%\s+of\s+Payin', po_formula, re.IGNORECASE)
+    if share:
+        return "multiply", float(share.group(1)) / 100
+    minus = re.search(r'-\s*(\d+(?:\.\d+)?)%', po_formula)
+    if minus:
+        return "subtract", float(minus.group(1))
+    return "none", 0.0
+
+
+class CompiledRule(NamedTuple):
+    lob: str
+    segment: str
+    po: str
+    remarks: str
+    operation: str
+    amount: float
+
+    def apply(self, payin_value):
+        if self.operation == "multiply":
+            payin_value = payin_value * self.amount
+        elif self.operation == "subtract":
+            payin_value = payin_value - self.amount
+        return max(0, payin_value)
+
+    @property
+    def explanation(self) -> str:
+        return f"Match: LOB={self.lob}, Segment={self.segment}, {self.remarks}"
+
+
+class RuleIndex:
+    """FORMULA_DATA compiled once: rules grouped by LOB with parsed operations.
+
+    Matching keeps the original semantics exactly (first rule in FORMULA_DATA
+    order whose SEGMENT is contained in the record segment and whose REMARKS
+    are NIL or contain the payin category), but each distinct
+    (segment, category) pair is resolved only once and then served from a dict.
+    """
+
+    def __init__(self, formula_data: list):
+        self.rules_by_lob = {}
+        for rule in formula_data:
+            operation, amount = parse_po_formula(rule["PO"])
+            compiled = CompiledRule(
+                lob=rule["LOB"],
+                segment=rule["SEGMENT"].upper(),
+                po=rule["PO"],
+                remarks=rule.get("REMARKS", ""),
+                operation=operation,
+                amount=amount
+            )
+            self.rules_by_lob.setdefault(compiled.lob, []).append(compiled)
+        self._segments = {}
+        self._resolved = {}
+
+    def segment_info(self, segment: str) -> tuple:
+        """(lob, segment_upper, candidate rules) for a raw segment string"""
+        info = self._segments.get(segment)
+        if info is None:
+            if len(self._segments) >= MAX_RESOLVED_KEYS:
+                self._segments.clear()
+            lob = determine_lob(segment)
+            segment_upper = segment.upper()
+            candidates = tuple(r for r in self.rules_by_lob.get(lob, []) if r.segment in segment_upper)
+            info = (lob, segment_upper, candidates)
+            self._segments[segment] = info
+        return info
+
+    def match(self, segment: str, payin_category: str):
+        """Matching CompiledRule for a record, or None"""
+        key = (segment, payin_category)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+        if len(self._resolved) >= MAX_RESOLVED_KEYS:
+            self._resolved.clear()
+        matched = None
+        for rule in self.segment_info(segment)[2]:
+            if rule.remarks == "NIL" or payin_category in rule.remarks:
+                matched = rule
+                break
+        self._resolved[key] = matched
+        return matched
+
+    def evaluate(self, segment: str, payin_value, payin_category: str) -> tuple:
+        """(calculated_payout, formula_used, rule_explanation) for one record"""
+        rule = self.match(segment, payin_category)
+        if rule is None:
+            lob, segment_upper, _ = self.segment_info(segment)
+            return payin_value, "No matching rule", f"No rule for LOB={lob}, Segment={segment_upper}"
+        return rule.apply(payin_value), rule.po, rule.explanation
+
+
+def compile_formula_data(formula_data: list) -> RuleIndex:
+    """Build the lookup index used by apply_formula"""
+    return RuleIndex(formula_data)
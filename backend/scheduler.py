@@ -0,0 +1,381 @@
+"""Rate-limit-aware scheduling of OpenAI calls, and the pooled HTTP client they share.
+
+Every chat completion waits for a grant: a free slot under the concurrency
+cap plus room in its model's request and token buckets, which refill at the
+configured RPM/TPM. Waiting calls are queued per user and granted
+round-robin, so one user's batch cannot starve everyone else. A 429 pauses
+all grants for its Retry-After (plus jitter); dropped connections and 5xx
+back off exponentially.
+"""
+import asyncio
+import contextvars
+import logging
+import math
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from email.utils import parsedate_to_datetime
+from io import BytesIO
+
+from telemetry import RETRIES, observe_stage
+
+logger = logging.getLogger(__name__)
+
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+# Quota of the API key per model; 0 leaves that dimension unlimited
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "0"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "0"))
+# Per-model overrides, e.g. "gpt-4o=500/30000,gpt-4o-mini=500/200000"
+OPENAI_RATE_LIMITS = os.getenv("OPENAI_RATE_LIMITS", "")
+# API worker processes sharing the key (see gunicorn_conf.py); each paces itself to its share of the quota
+OPENAI_RATE_SHARES = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+# Bucket size in seconds of quota: OpenAI enforces limits over sub-minute windows, so minute-sized bursts still 429
+OPENAI_RATE_BURST_SECONDS = float(os.getenv("OPENAI_RATE_BURST_SECONDS", "10"))
+OPENAI_BACKOFF_BASE_SECONDS = float(os.getenv("OPENAI_BACKOFF_BASE_SECONDS", "1"))
+OPENAI_BACKOFF_MAX_SECONDS = float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", "60"))
+OPENAI_KEEPALIVE_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_SECONDS", "120"))
+OPENAI_WARM_CONNECTIONS = int(os.getenv("OPENAI_WARM_CONNECTIONS", str(min(4, OPENAI_MAX_CONCURRENCY))))
+# Fair-queueing key; falls back to the client address
+SCHEDULER_USER_HEADER = os.getenv("SCHEDULER_USER_HEADER", "x-user-id").lower()
+
+# Image tokens (base, per 512px tile) by model prefix, most specific first; detail=low costs the base only
+IMAGE_TOKEN_COSTS = [("gpt-4o-mini", (2833, 5667)), ("gpt-4o", (85, 170))]
+DEFAULT_IMAGE_TOKEN_COST = (85, 170)
+# Models billed per 32px patch (at most 1536 patches) times a multiplier, instead of per tile
+IMAGE_PATCH_MULTIPLIERS = [("gpt-4.1-mini", 1.62), ("gpt-4.1-nano", 2.46), ("o4-mini", 1.72)]
+IMAGE_MAX_PATCHES = 1536
+CHARS_PER_TOKEN = 4
+
+
+def parse_rate_limits(spec: str) -> dict:
+    """'model=rpm/tpm,...' -> {model: (rpm, tpm)}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, values = item.partition("=")
+        rpm, _, tpm = values.partition("/")
+        limits[model.strip()] = (int(rpm or 0), int(tpm or 0))
+    return limits
+
+
+def image_dimensions(image_bytes: bytes) -> tuple:
+    """(width, height) from the image header; the largest billable size if it cannot be read"""
+    try:
+        from PIL import Image
+        with Image.open(BytesIO(image_bytes)) as image:
+            return image.size
+    except Exception:
+        return 2048, 2048
+
+
+def estimate_image_tokens(model: str, width: int, height: int, detail: str = None) -> int:
+    """Prompt tokens OpenAI bills for one image"""
+    multiplier = next((factor for prefix, factor in IMAGE_PATCH_MULTIPLIERS if model.startswith(prefix)), None)
+    if multiplier is not None:
+        # Scaled down (keeping the aspect ratio) until its patches fit the cap
+        patches = math.ceil(width / 32) * math.ceil(height / 32)
+        if patches > IMAGE_MAX_PATCHES:
+            scale = math.sqrt(32 * 32 * IMAGE_MAX_PATCHES / (width * height))
+            patches = min(IMAGE_MAX_PATCHES, math.ceil(width * scale / 32) * math.ceil(height * scale / 32))
+        return math.ceil(patches * multiplier)
+    base, per_tile = next((cost for prefix, cost in IMAGE_TOKEN_COSTS if model.startswith(prefix)), DEFAULT_IMAGE_TOKEN_COST)
+    if detail == "low":
+        return base
+    # Fit within 2048x2048, scale the short side down to 768, then count 512px tiles
+    scale = min(1.0, 2048 / max(width, height))
+    scale *= min(1.0, 768 / (min(width, height) * scale))
+    tiles = math.ceil(width * scale / 512) * math.ceil(height * scale / 512)
+    return base + per_tile * tiles
+
+
+def estimate_prompt_tokens(model: str, prompt: str, image_bytes: bytes = None, detail: str = None) -> int:
+    """Prompt tokens of one text + image request, before sending it"""
+    tokens = len(prompt) // CHARS_PER_TOKEN
+    if image_bytes is not None:
+        width, height = (1, 1) if detail == "low" else image_dimensions(image_bytes)
+        tokens += estimate_image_tokens(model, width, height, detail)
+    return tokens
+
+
+class TokenBucket:
+    """Refills at `per_minute` / 60 per second up to `burst_seconds` worth; 0 means unlimited.
+
+    Takes may overdraw the bucket (a call larger than its capacity goes once
+    it is full), and later calls wait for the debt to refill.
+    """
+
+    def __init__(self, per_minute: int, burst_seconds: float = OPENAI_RATE_BURST_SECONDS):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds) if per_minute else 0.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float, now: float):
+        if self.rate:
+            self._refill(now)
+            self.level -= amount
+
+    def adjust(self, amount: float):
+        """Charge (or refund) a correction once the real usage is known"""
+        if self.rate:
+            self.level -= amount
+
+
+class Grant:
+    """Permission for one call; `response` is set once it has been sent"""
+
+    def __init__(self, model: str, prompt_tokens: int, token_bucket: TokenBucket):
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.token_bucket = token_bucket
+        self.response = None
+
+    def settle(self, usage):
+        """Correct the token bucket by the difference between estimated and reported prompt tokens"""
+        reported = getattr(usage, "prompt_tokens", None)
+        if reported is not None:
+            self.token_bucket.adjust(reported - self.prompt_tokens)
+
+
+class _Waiter:
+    __slots__ = ("future", "model", "prompt_tokens", "tokens")
+
+    def __init__(self, future, model: str, prompt_tokens: int, tokens: int):
+        self.future = future
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.tokens = tokens
+
+
+# Set per HTTP request (and for background jobs); tasks and threads started below inherit it
+_current_user = contextvars.ContextVar("scheduler_user", default="anonymous")
+
+
+@contextmanager
+def user_scope(user: str):
+    """Queue the calls made inside the block under `user`"""
+    token = _current_user.set(user)
+    try:
+        yield
+    finally:
+        _current_user.reset(token)
+
+
+class RequestUserMiddleware:
+    """ASGI middleware naming the fair-queueing user of each request: the user header, else the client address"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        user = headers.get(SCHEDULER_USER_HEADER.encode("latin-1"), b"").decode("latin-1").strip()
+        if not user:
+            forwarded = headers.get(b"x-forwarded-for", b"").decode("latin-1").split(",")[0].strip()
+            user = forwarded or (scope.get("client") or ("anonymous",))[0]
+        with user_scope(user):
+            await self.app(scope, receive, send)
+
+
+def retry_after_seconds(error: BaseException):
+    """Delay the server asked for in Retry-After / retry-after-ms, if any"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return max(0.0, float(headers[header]) * scale)
+        except (KeyError, TypeError, ValueError):
+            pass
+    try:
+        return max(0.0, parsedate_to_datetime(headers["retry-after"]).timestamp() - time.time())
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def retry_reason(error: BaseException):
+    """'rate_limit' or 'server' for errors the scheduler retries, else None"""
+    try:
+        import openai
+    except ImportError:
+        return None
+    if isinstance(error, openai.RateLimitError):
+        # An exhausted billing quota is also a 429, but waiting will not fix it
+        return None if getattr(error, "code", None) == "insufficient_quota" else "rate_limit"
+    if isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):
+        return "server"
+    return None
+
+
+class RequestScheduler:
+    """Grants OpenAI calls under the concurrency cap and per-model RPM/TPM buckets, fairly across users"""
+
+    def __init__(self, max_concurrency: int = OPENAI_MAX_CONCURRENCY, rpm: int = OPENAI_RPM_LIMIT,
+                 tpm: int = OPENAI_TPM_LIMIT, limits: dict = None, max_retries: int = OPENAI_MAX_RETRIES,
+                 shares: int = OPENAI_RATE_SHARES):
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.limits = limits if limits is not None else parse_rate_limits(OPENAI_RATE_LIMITS)
+        self.max_retries = max_retries
+        self.shares = shares
+        self.active = 0
+        self.paused_until = 0.0
+        # user -> waiting calls; the first user in the dict is served next
+        self._queues = OrderedDict()
+        self._buckets = {}
+        self._timer = None
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def buckets(self, model: str) -> tuple:
+        """(request bucket, token bucket) of a model"""
+        if model not in self._buckets:
+            rpm, tpm = self.limits.get(model, (self.rpm, self.tpm))
+            self._buckets[model] = (TokenBucket(math.ceil(rpm / self.shares)), TokenBucket(math.ceil(tpm / self.shares)))
+        return self._buckets[model]
+
+    async def acquire(self, model: str, prompt_tokens: int, max_tokens: int, retry: bool = False) -> Grant:
+        """Wait for a grant; retried calls keep their place at the front of their user's queue"""
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), model, prompt_tokens, prompt_tokens + max_tokens)
+        queue = self._queues.setdefault(_current_user.get(), deque())
+        queue.appendleft(waiter) if retry else queue.append(waiter)
+        started = time.perf_counter()
+        self._dispatch()
+        try:
+            grant = await waiter.future
+        except asyncio.CancelledError:
+            # Granted just before the caller went away: hand the slot back
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(waiter.future.result())
+            raise
+        observe_stage("rate_limit_wait", time.perf_counter() - started)
+        return grant
+
+    def release(self, grant: Grant):
+        self.active -= 1
+        self._dispatch()
+
+    def pause(self, seconds: float):
+        """Hold every grant for `seconds` (the whole key is over quota, not just one call)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._queues and self.active < self.max_concurrency:
+            user, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            if waiter.future.done():
+                # Cancelled while waiting
+                queue.popleft()
+                if not queue:
+                    del self._queues[user]
+                continue
+
+            now = time.monotonic()
+            requests, tokens = self.buckets(waiter.model)
+            wait = max(self.paused_until - now, requests.wait_time(1, now), tokens.wait_time(waiter.tokens, now))
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+
+            queue.popleft()
+            requests.take(1, now)
+            tokens.take(waiter.tokens, now)
+            self.active += 1
+            waiter.future.set_result(Grant(waiter.model, waiter.prompt_tokens, tokens))
+            # Round-robin: this user goes to the back of the line
+            del self._queues[user]
+            if queue:
+                self._queues[user] = queue
+
+    def retry_delay(self, error: BaseException, attempt: int):
+        """Seconds to wait before retry number `attempt + 1`, or None when the error is final"""
+        reason = retry_reason(error)
+        if reason is None or attempt >= self.max_retries:
+            return None
+        backoff = min(OPENAI_BACKOFF_MAX_SECONDS, OPENAI_BACKOFF_BASE_SECONDS * 2 ** attempt)
+        retry_after = retry_after_seconds(error)
+        delay = (retry_after if retry_after is not None else backoff / 2) + random.uniform(0, backoff / 2)
+        RETRIES.inc(reason=reason)
+        logger.warning(f"⏳ OpenAI {reason} error, retry {attempt + 1}/{self.max_retries} in {delay:.1f}s: {str(error)}")
+        if reason == "rate_limit":
+            self.pause(delay)
+        return delay
+
+    @asynccontextmanager
+    async def request(self, model: str, prompt_tokens: int, max_tokens: int, send):
+        """Await `send()` under a grant and yield the grant, holding it until the block exits (for streams)"""
+        attempt = 0
+        while True:
+            grant = await self.acquire(model, prompt_tokens, max_tokens, retry=attempt > 0)
+            try:
+                grant.response = await send()
+            except BaseException as e:
+                self.release(grant)
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                # Rate limits pause the scheduler itself; other errors only delay this call
+                if retry_reason(e) != "rate_limit":
+                    await asyncio.sleep(delay)
+                continue
+            try:
+                yield grant
+            finally:
+                self.release(grant)
+            return
+
+    async def call(self, model: str, prompt_tokens: int, max_tokens: int, send):
+        """Response of `send()` under a grant, settled against its reported usage"""
+        async with self.request(model, prompt_tokens, max_tokens, send) as grant:
+            grant.settle(getattr(grant.response, "usage", None))
+            return grant.response
+
+
+def create_http_client():
+    """Keep-alive pool sized to the concurrency cap, so granted calls reuse open TLS connections"""
+    import httpx
+    from openai import DefaultAsyncHttpxClient
+
+    return DefaultAsyncHttpxClient(limits=httpx.Limits(
+        max_connections=OPENAI_MAX_CONCURRENCY,
+        max_keepalive_connections=OPENAI_MAX_CONCURRENCY,
+        keepalive_expiry=OPENAI_KEEPALIVE_SECONDS
+    ))
+
+
+async def warm_connections(client, count: int = OPENAI_WARM_CONNECTIONS):
+    """Open `count` pooled connections (TLS handshake included) before the first upload needs one"""
+    if count <= 0:
+        return
+    from openai import APIStatusError
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(client.models.list() for _ in range(count)), return_exceptions=True)
+    # Any HTTP answer, even an error status, means the connection is open and pooled
+    failed = [result for result in results if isinstance(result, BaseException) and not isinstance(result, APIStatusError)]
+    if failed:
+        logger.warning(f"⚠️ Connection warm-up: {len(failed)}/{count} failed: {str(failed[0])}")
+    else:
+        logger.info(f"🔥 Warmed {count} OpenAI connections in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,320 @@
+"""Per-stage timings, token usage, cost and payload sizes, exposed in Prometheus text format on /metrics"""
+import contextvars
+import sys
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7)
+# Python-level allocation tracing for the per-request memory report; it slows every allocation, so off by default
+MEMORY_TRACE = os.getenv("MEMORY_TRACE", "0") == "1"
+
+# USD per million prompt/completion tokens by model prefix, e.g. "gpt-4o=2.5/10,gpt-4o-mini=0.15/0.6"
+OPENAI_PRICES = os.getenv(
+    "OPENAI_PRICES", "gpt-4o=2.5/10,gpt-4o-mini=0.15/0.6,gpt-4.1=2/8,gpt-4.1-mini=0.4/1.6,gpt-4.1-nano=0.1/0.4"
+)
+
+if MEMORY_TRACE and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names: tuple, values: tuple) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = SECONDS_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                bucket_labels = self.labels + ("le",)
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    lines.append(f"{self.name}_bucket{_label_text(bucket_labels, key + (f'{bound:g}',))} {count}")
+                lines.append(f"{self.name}_bucket{_label_text(bucket_labels, key + ('+Inf',))} {series['count']}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {series['sum']:g}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {series['count']}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("policy_stage_seconds", "Time spent in each processing stage", ("stage",))
+TOKENS = Counter("openai_tokens_total", "Tokens reported in response.usage", ("model", "kind"))
+PAYLOAD_BYTES = Histogram("policy_payload_bytes", "Upload, model request and response sizes", ("kind",), BYTES_BUCKETS)
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route", "status"))
+RETRIES = Counter("openai_retries_total", "OpenAI calls retried by the scheduler", ("reason",))
+COALESCED = Counter("policy_coalesced_total", "Calls answered by an identical call already in flight", ("operation",))
+
+COST = Counter("openai_cost_usd_total", "Estimated spend from response.usage and OPENAI_PRICES", ("model",))
+ROUTES = Counter("policy_route_total", "Extractions by model route (fast, escalated, full)", ("route",))
+ROUTE_SECONDS = Histogram("policy_route_seconds", "Extraction latency by model route", ("route",))
+ROUTE_COST = Counter("policy_route_cost_usd_total", "Estimated extraction spend by model route", ("route",))
+ESCALATIONS = Counter("policy_route_escalations_total", "Fast-model replies that failed validation", ("reason",))
+
+METRICS = [STAGE_SECONDS, TOKENS, PAYLOAD_BYTES, REQUEST_SECONDS, RETRIES, COALESCED, COST, ROUTES, ROUTE_SECONDS,
+           ROUTE_COST, ESCALATIONS]
+
+
+def parse_prices(spec: str) -> list:
+    """'model=in/out,...' -> [(model prefix, (in, out))], most specific prefix first"""
+    prices = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, values = item.partition("=")
+        prompt, _, completion = values.partition("/")
+        prices.append((model.strip(), (float(prompt or 0), float(completion or 0))))
+    return sorted(prices, key=lambda price: len(price[0]), reverse=True)
+
+
+_prices = parse_prices(OPENAI_PRICES)
+
+
+def usage_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimated USD for one call; 0 for models without a configured price"""
+    prompt, completion = next((price for prefix, price in _prices if model.startswith(prefix)), (0.0, 0.0))
+    return (prompt_tokens * prompt + completion_tokens * completion) / 1e6
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process (0 where the platform does not report it)"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process right now (0 where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend([
+        "# HELP process_peak_rss_bytes Peak resident set size of the worker process",
+        "# TYPE process_peak_rss_bytes gauge",
+        f"process_peak_rss_bytes {peak_rss_bytes()}",
+        "# HELP process_resident_memory_bytes Resident set size of the worker process",
+        "# TYPE process_resident_memory_bytes gauge",
+        f"process_resident_memory_bytes {current_rss_bytes()}"
+    ])
+    return "\n".join(lines) + "\n"
+
+
+class Timings:
+    """Stage durations, token usage and sizes collected for one request"""
+
+    def __init__(self):
+        self.stages = {}
+        self.tokens = {}
+        self.sizes = {}
+        self.memory = {}
+        self.traced_start = None
+        self._lock = threading.Lock()
+
+    def add(self, section: dict, key: str, amount: float):
+        with self._lock:
+            section[key] = section.get(key, 0) + amount
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()},
+                "tokens": {kind: round(count, 6) for kind, count in self.tokens.items()},
+                "bytes": dict(self.sizes),
+                "peak_rss_mb": round(peak_rss_bytes() / 2 ** 20, 1),
+                "memory": self.memory_report()
+            }
+
+    def memory_report(self) -> dict:
+        """RSS now, this request's largest memory reservation and, when tracing, Python allocations.
+
+        traced_peak_mb is the process-wide tracemalloc peak since the request
+        started: exact for a request running alone, an upper bound otherwise.
+        """
+        report = {"rss_mb": round(current_rss_bytes() / 2 ** 20, 1)}
+        report.update({f"{key}_mb": round(size / 2 ** 20, 1) for key, size in self.memory.items()})
+        if self.traced_start is not None and tracemalloc.is_tracing():
+            report["traced_peak_mb"] = round((tracemalloc.get_traced_memory()[1] - self.traced_start) / 2 ** 20, 1)
+        return report
+
+
+# Set per request; tasks and to_thread calls inherit it, so stages anywhere below are collected
+_current_timings = contextvars.ContextVar("timings", default=None)
+# Usage totals of the enclosing track_usage() blocks, innermost last
+_current_usage = contextvars.ContextVar("usage", default=())
+_traced_requests = 0
+_traced_lock = threading.Lock()
+
+
+@contextmanager
+def track_request():
+    """Collect the timings of everything run inside the block (and the tasks it starts)"""
+    global _traced_requests
+    timings = Timings()
+    token = _current_timings.set(timings)
+    if tracemalloc.is_tracing():
+        with _traced_lock:
+            # The peak is process-wide; only restart it when no other request is measuring
+            if _traced_requests == 0:
+                tracemalloc.reset_peak()
+            _traced_requests += 1
+            timings.traced_start = tracemalloc.get_traced_memory()[0]
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+        if timings.traced_start is not None:
+            with _traced_lock:
+                _traced_requests -= 1
+
+
+def observe_stage(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(timings.stages, name, seconds)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as one processing stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+@contextmanager
+def track_usage():
+    """Tokens and estimated cost of the OpenAI calls made inside the block (and the tasks it starts)"""
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0}
+    token = _current_usage.set(_current_usage.get() + (usage,))
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
+
+
+def record_tokens(model: str, usage):
+    """Count the prompt/completion tokens and estimated cost of a chat completion's usage block"""
+    if usage is None:
+        return
+    timings = _current_timings.get()
+    counts = {kind: getattr(usage, kind, None) or 0 for kind in ("prompt_tokens", "completion_tokens")}
+    counts["cost_usd"] = usage_cost(model, counts["prompt_tokens"], counts["completion_tokens"])
+    for kind in ("prompt_tokens", "completion_tokens"):
+        TOKENS.inc(counts[kind], model=model, kind=kind.split("_")[0])
+    COST.inc(counts["cost_usd"], model=model)
+    for kind, count in counts.items():
+        if timings is not None:
+            timings.add(timings.tokens, kind, count)
+        # Only ever updated from the event loop, so no lock
+        for totals in _current_usage.get():
+            totals[kind] += count
+
+
+def record_bytes(kind: str, size: int):
+    PAYLOAD_BYTES.observe(size, kind=kind)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(timings.sizes, kind, size)
+
+
+def record_memory(kind: str, size: int):
+    """Largest amount of memory of one kind (e.g. the upload's budget reservation) held by this request"""
+    timings = _current_timings.get()
+    if timings is not None:
+        with timings._lock:
+            timings.memory[kind] = max(timings.memory.get(kind, 0), size)
+
+
+class RequestTimingMiddleware:
+    """ASGI middleware observing each HTTP request's full duration (body included) per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Route templates, not raw paths, keep job/artifact ids out of the label set
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.observe(time.perf_counter() - started, method=scope["method"], route=route, status=status["code"])
@@ -0,0 +1,153 @@
+"""Rate-card layout templates: a cheap first pass picks the layout, then a compact prompt extracts it"""
+import hashlib
+import os
+import re
+from typing import NamedTuple
+
+# off: always send the full prompt, auto: detect the layout first and fall back to the full prompt.
+# Detection adds a serial model call before every extraction; only turn it on once
+# bench/bench_templates.py --samples shows the templates matching the full prompt on real sheets
+LAYOUT_DETECTION = os.getenv("LAYOUT_DETECTION", "off").lower()
+# Model for the detection pass (a low-detail image is enough to tell layouts apart). Not gpt-4o-mini:
+# it bills an image at roughly 33x the tokens of gpt-4o, which costs more than the pass saves
+LAYOUT_MODEL = os.getenv("LAYOUT_MODEL", os.getenv("OPENAI_MODEL", "gpt-4o"))
+# Room for the name and the row count
+LAYOUT_MAX_TOKENS = 12
+# Reply meaning "none of the templates fit", which keeps the full prompt
+UNKNOWN_LAYOUT = "other"
+
+
+class LayoutTemplate(NamedTuple):
+    name: str
+    # One line shown to the detection pass
+    description: str
+    # Template-specific extraction rules, appended to the shared header. Only restates what
+    # EXTRACTION_PROMPT says about the layout, so a template never changes the extracted records
+    rules: str
+    # Objects the rules ask for per table row, for checking a reply against the detected row count
+    records_per_row: int = 1
+
+
+PROMPT_HEADER = """
+You are extracting insurance policy payout rates from an image.
+Return ONLY a JSON array (no markdown, no text) of objects with these exact keys:
+segment, policy_type, location, payin, remark.
+- payin: the rate as a float (67.5, not "67.5%"); negative % as positive; MISP means 0
+- remark: string, "" when there is nothing to add
+- One table row = one object unless told otherwise. Do not skip, merge or invent rows;
+  repeated values are real, copy them as shown.
+"""
+
+SEGMENT_RULES = """
+Segment must be one of these exact values:
+- Two wheeler (2W, MC, MCY, SC, Scooter, EV): "TW SAOD + COMP" for 1+1/Comp/SAOD,
+  "TW TP" for SATP/TP, "1+5" for New/Fresh
+- Private car (PVT CAR, Car, PCI, 4W): "PVT CAR COMP + SAOD" for 1+1/Comp/SAOD, "PVT CAR TP" for SATP/TP
+- Commercial vehicle (CV, GVW, PCV, GCV, tonnage, Auto = PCV 3W): "All GVW & PCV 3W, GCV 3W"
+- Bus: "SCHOOL BUS" for school buses, otherwise "STAFF BUS"
+- Taxi: "TAXI"
+- Tractor, Ambulance, Misd: "Misd, Tractor"
+policy_type is "Comp" or "TP". When a row has both a 1+1 and a SATP column, emit one object for each.
+"""
+
+TEMPLATES = {
+    "cd2_table": LayoutTemplate(
+        "cd2_table",
+        "table of segments/clusters with CD1/CD2 (or PO/payrate) columns, possibly 1+1 and SATP sub-columns",
+        """
+- location: the Cluster/Agency name of the row
+- payin: the CD2 value only (ignore CD1); if another payrate/PO column holds the rate, use it
+- A cell with several rates (e.g. "Tata 30%; any other makes 28%/26%"): one object per make,
+  taking the lowest rate for a range, with the make in remark ("Tata", "other make")
+- Conditions in the row (age bands like "Upto 2 years") go in remark, one object per rate
+"""
+    ),
+    "revised_po": LayoutTemplate(
+        "revised_po",
+        "RTO-Statename rows with Revised PO, a 'From <month>' column and Remarks",
+        """
+Every row is private car third party: segment "PVT CAR TP", policy_type "TP".
+- payin: the "From <month>" column (latest PO) when non-empty, otherwise "Revised PO"
+- location: RTO-Statename; when Remarks contains "Ex. <place>", append it ("PUNE Ex. Nagpur")
+- remark: the full Remarks cell
+"""
+    ),
+    "required_existing": LayoutTemplate(
+        "required_existing",
+        "RTO-Statename rows with Required and Existing rate columns",
+        """
+Every row is private car third party: segment "PVT CAR TP", policy_type "TP".
+- payin: the "Required" value; when it is "-", the "Existing" value
+- location: RTO-Statename exactly as written
+- remark: always ""
+"""
+    ),
+    "geo_cc_grid": LayoutTemplate(
+        "geo_cc_grid",
+        "Geo segment New/Old columns followed by Bikes and Scooter CC-band rate columns",
+        """
+Columns: Geo segment New, Geo segment Old, Bikes <75 CC, Bikes >75-150 CC, Bikes >150-350 CC,
+Bikes >350 CC, Scooter <75 CC, Scooter >75-150 CC.
+For EVERY row output exactly SIX objects, one per Bikes/Scooter column, each with
+segment "TW SAOD + COMP", policy_type "Comp", location = Geo segment New,
+doable_district = Geo segment Old, vehicle_category = the column name, payin = that cell
+(null when empty) and remark "".
+""",
+        records_per_row=6
+    ),
+    "bus_seating": LayoutTemplate(
+        "bus_seating",
+        "bus table with State/Location, Seating Capacity and School Bus / On Contract rate columns",
+        """
+- location: the State / Location cell
+- Take every rate column as a payin (75% and above included): "SCHOOL BUS" for the school bus
+  column, otherwise "STAFF BUS" (On Contract (Transporter), On Contract (Individual))
+"""
+    ),
+    "free_text": LayoutTemplate(
+        "free_text",
+        "mostly free text or a circular with rates in sentences, optionally with a small table",
+        """
+- Read rates from the sentences; prefer the value given with "net" or "OD"
+- Several states in one merged cell go in one location field
+- OEM / other make-model notes and CD/payout conditions go in remark
+- For RTO-Statename tables with current and proposed rates, use the proposed rate
+- For Standalone tables with per-class rates in one cell (e.g. "P and C at 52.5%, D at 30%"),
+  take each rate (P and C at 52.5, D at 30)
+"""
+    )
+}
+
+
+def template_prompt(name: str) -> str:
+    """Compact extraction prompt for a detected layout"""
+    template = TEMPLATES[name]
+    return PROMPT_HEADER + SEGMENT_RULES + "\nLAYOUT RULES:" + template.rules
+
+
+LAYOUT_PROMPT = (
+    "Which layout is this insurance rate-card image? Reply with exactly one name from the list, "
+    f"or \"{UNKNOWN_LAYOUT}\" if none fits, then the number of data rows in its rate table "
+    "(e.g. \"cd2_table 14\").\n\n"
+    + "\n".join(f"{template.name}: {template.description}" for template in TEMPLATES.values())
+)
+
+
+def parse_layout_reply(reply: str):
+    """Template name from the detection reply, or None when it is unknown or unusable"""
+    match = re.search(r"[a-z0-9_]+", (reply or "").strip().lower())
+    if match and match.group(0) in TEMPLATES:
+        return match.group(0)
+    return None
+
+
+def parse_row_count(reply: str):
+    """Data rows the detection reply counted after the layout name, or None"""
+    match = re.search(r"\b(\d{1,4})\b", reply or "")
+    return int(match.group(1)) if match else None
+
+
+# Part of the extraction cache key, so editing a template invalidates results extracted with it
+TEMPLATES_VERSION = hashlib.sha256(
+    "\n".join([LAYOUT_DETECTION, LAYOUT_MODEL, LAYOUT_PROMPT] + [template_prompt(name) for name in TEMPLATES]).encode("utf-8")
+).hexdigest()[:16]
@@ -0,0 +1,14 @@
+"""Shared setup: import the backend modules from backend/ and keep every store off disk by default.
+
+Run from backend/:
+    python -m pytest -q tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("RESULT_CACHE_BACKEND", "none")
+os.environ.setdefault("EXTRACTION_HISTORY", "off")
+os.environ.setdefault("JOB_WORKERS_IN_PROCESS", "0")
+os.environ.setdefault("LOCAL_OCR", "off")
@@ -0,0 +1,158 @@
+"""HTTP endpoints end to end, with model calls answered by bench/fakes.py's fake OpenAI server"""
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from history import HistoryStore
+from jobs import SUCCEEDED, JobStore
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench"))
+
+from fakes import SAMPLE_RECORDS, BackgroundServer, create_fake_openai_app, make_png
+
+IMAGE = make_png(200, 120, shade=240)
+
+
+@pytest.fixture
+def serve(monkeypatch, tmp_path):
+    """start(**options): the app as a TestClient, talking to create_fake_openai_app(**options); returns (client, fake)"""
+    monkeypatch.setattr(main, "_history_store", HistoryStore(str(tmp_path / "history.sqlite3")))
+    monkeypatch.setattr(main, "_job_store", JobStore(str(tmp_path / "jobs.sqlite3")))
+    stack = contextlib.ExitStack()
+
+    def start(**options):
+        fake = create_fake_openai_app(**{"delay": 0, **options})
+        server = stack.enter_context(BackgroundServer(fake))
+        monkeypatch.setenv("OPENAI_API_KEY", "test")
+        monkeypatch.setenv("OPENAI_BASE_URL", f"{server.url}/v1")
+        main.set_openai_client(None)
+        return stack.enter_context(TestClient(main.app)), fake
+
+    yield start
+    stack.close()
+    main.set_openai_client(None)
+
+
+def upload(client, path: str = "/process", image: bytes = IMAGE, **form):
+    return client.post(path, data={"company_name": "Acme", **form}, files={"policy_file": ("card.png", image, "image/png")})
+
+
+def locations(records: list) -> list:
+    return [record["location"] for record in records]
+
+
+def test_process_slim_links_artifacts(serve):
+    client, _ = serve()
+    response = upload(client)
+    assert response.status_code == 200
+    body = response.json()
+    assert locations(body["calculated_data"]) == locations(SAMPLE_RECORDS)
+    assert "excel_data" not in body and set(body["artifacts"]) == {"xlsx", "csv", "json"}
+
+
+def test_artifact_downloads(serve):
+    client, _ = serve()
+    artifacts = upload(client).json()["artifacts"]
+
+    csv = client.get(artifacts["csv"])
+    assert csv.status_code == 200 and "PUNE" in csv.text
+    assert client.get(artifacts["xlsx"]).content[:2] == b"PK"
+    assert client.get(artifacts["csv"].replace(".csv", ".pdf")).status_code == 400
+    assert client.get("/artifacts/missing.csv").status_code == 404
+
+
+def test_process_full_embeds_every_artifact(serve):
+    client, _ = serve()
+    body = upload(client, response_format="full").json()
+    assert len(body["calculated_data"]) == len(SAMPLE_RECORDS)
+    assert {"excel_data", "csv_data", "json_data", "parsed_data"} <= set(body)
+    assert "PUNE" in body["csv_data"]
+
+
+def test_process_xlsx_streams_the_workbook(serve):
+    from openpyxl import load_workbook
+
+    client, _ = serve()
+    response = upload(client, response_format="xlsx")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == main.XLSX_MEDIA_TYPE
+    cells = [cell for row in load_workbook(io.BytesIO(response.content)).active.iter_rows(values_only=True) for cell in row]
+    assert {"PUNE", "MUMBAI", "NAGPUR"} <= set(cells)
+
+
+def test_unknown_response_format_is_refused(serve):
+    client, _ = serve()
+    response = upload(client, response_format="bogus")
+    assert response.status_code == 400
+    assert "response_format" in response.json()["error"]
+
+
+def test_upload_over_the_limit_is_refused(serve):
+    client, _ = serve()
+    response = upload(client, image=IMAGE + b"\0" * main.MAX_UPLOAD_BYTES)
+    assert response.status_code == 413
+
+
+def test_truncated_reply_is_continued(serve):
+    client, fake = serve(truncate_after=1)
+    body = upload(client, response_format="full").json()
+    assert locations(body["calculated_data"]) == locations(SAMPLE_RECORDS)
+    assert fake.state.calls == {"extraction": 1, "continuation": 1}
+
+
+def test_process_stream_emits_records_then_the_workbook(serve):
+    client, _ = serve()
+    response = upload(client, "/process/stream")
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [event["event"] for event in events] == ["start"] + ["record"] * len(SAMPLE_RECORDS) + ["complete"]
+    assert locations(event["data"] for event in events[1:-1]) == locations(SAMPLE_RECORDS)
+    assert events[-1]["excel_data"]
+
+
+def test_process_batch_combines_files(serve):
+    client, _ = serve()
+    response = client.post("/process/batch", data={"company_name": "Acme"}, files=[
+        ("policy_files", ("a.png", IMAGE, "image/png")),
+        ("policy_files", ("b.png", make_png(220, 120, shade=240), "image/png"))
+    ])
+    assert response.status_code == 200
+    body = response.json()
+    assert [result["status"] for result in body["files"]] == ["ok", "ok"]
+    assert body["excel_data"]
+
+
+def test_jobs_run_in_the_background(serve, monkeypatch):
+    monkeypatch.setattr(main, "JOB_WORKERS_IN_PROCESS", 1)
+    client, _ = serve()
+    submitted = upload(client, "/jobs")
+    assert submitted.status_code == 202
+
+    deadline = time.monotonic() + 10
+    status = client.get(submitted.json()["status_url"]).json()
+    while status["status"] != SUCCEEDED and time.monotonic() < deadline:
+        time.sleep(0.1)
+        status = client.get(submitted.json()["status_url"]).json()
+    assert status["status"] == SUCCEEDED
+    result = client.get(f"{submitted.json()['status_url']}/result").json()
+    assert locations(result["calculated_data"]) == locations(SAMPLE_RECORDS)
+    assert client.get("/jobs/missing").status_code == 404
+
+
+def test_history_query_and_recompute(serve):
+    client, _ = serve()
+    upload(client)
+
+    rows = client.get("/history/query", params={"location": "pune"}).json()["rows"]
+    assert len(rows) == 1 and rows[0]["company_name"] == "Acme"
+    recompute = client.post("/history/recompute", data={"company_name": "Acme"})
+    assert recompute.status_code == 200
+    # Nothing changed since the records were stored with the current rules
+    assert recompute.json()["diff"] == []
+    assert client.post("/history/recompute", data={"diff_format": "xml"}).status_code == 400
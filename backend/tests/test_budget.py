@@ -0,0 +1,90 @@
+"""Upload memory budget: FIFO admission, shrinking reservations, and the peak estimate"""
+import asyncio
+
+import pytest
+
+import uploads
+from uploads import MemoryBudget, estimate_memory, keep_reservation, retain
+
+MB = 2 ** 20
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_uploads_wait_in_order_until_they_fit():
+    async def scenario():
+        budget = MemoryBudget(100)
+        first = await budget.acquire(60)
+        admitted = []
+
+        async def admit(name, amount):
+            reservation = await budget.acquire(amount)
+            admitted.append(name)
+            return reservation
+
+        big = asyncio.create_task(admit("big", 80))
+        small = asyncio.create_task(admit("small", 10))
+        await asyncio.sleep(0)
+        # The small one fits now but must not overtake the big one
+        assert admitted == [] and budget.stats()["waiting"] == 2
+        first.release()
+        await asyncio.gather(big, small)
+        assert admitted == ["big", "small"]
+        assert budget.in_use == 90
+        assert budget.peak == 90
+
+    run(scenario())
+
+
+def test_oversized_upload_is_admitted_alone():
+    async def scenario():
+        budget = MemoryBudget(100)
+        with await budget.acquire(500) as reservation:
+            assert reservation.amount == 100
+        assert budget.in_use == 0
+
+    run(scenario())
+
+
+def test_retain_shrinks_only_the_current_reservation():
+    async def scenario():
+        budget = MemoryBudget(100)
+        async with budget.reserve(80) as reservation:
+            with keep_reservation():
+                retain(10)
+            assert reservation.amount == 80
+            retain(30)
+            assert reservation.amount == 30 and budget.in_use == 30
+            # Never grows back
+            retain(50)
+            assert budget.in_use == 30
+        assert budget.in_use == 0
+
+    run(scenario())
+
+
+def test_cancelled_waiter_lets_the_next_one_in():
+    async def scenario():
+        budget = MemoryBudget(100)
+        held = await budget.acquire(50)
+        blocked = asyncio.create_task(budget.acquire(80))
+        queued = asyncio.create_task(budget.acquire(40))
+        await asyncio.sleep(0)
+        blocked.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await blocked
+        (await queued).release()
+        held.release()
+        assert budget.in_use == 0 and budget.stats()["waiting"] == 0
+
+    run(scenario())
+
+
+def test_estimate_covers_the_decode_or_the_payload_peak(monkeypatch):
+    monkeypatch.setattr(uploads, "IMAGE_PREPROCESS", True)
+    # A 20 MB TIFF decoding to 21 MB: the decoded copies dominate
+    assert estimate_memory(20 * MB, 21 * MB) == 20 * MB + uploads.DECODE_COPIES * 21 * MB
+    # Not an image: the upload is sent as is
+    assert estimate_memory(4 * MB, 0) == 4 * MB + uploads.PAYLOAD_COPIES * 4 * MB
@@ -0,0 +1,39 @@
+"""SQLite result cache: LRU eviction, throttled access writes and TTL"""
+import time
+
+from cache import SQLiteResultCache
+
+
+def last_access(cache: SQLiteResultCache, key: str) -> float:
+    return cache._conn.execute("SELECT last_access FROM result_cache WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = SQLiteResultCache(str(tmp_path / "cache.sqlite3"), max_entries=3, touch_seconds=0)
+    for key in "abc":
+        cache.set(key, key.upper())
+        time.sleep(0.01)
+    assert cache.get("a") == "A"
+    cache.set("d", "D")
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in "acd"] == ["A", "C", "D"]
+    assert cache.stats()["hits"] == 4 and cache.stats()["misses"] == 1
+
+
+def test_hits_only_write_once_per_touch_interval(tmp_path):
+    cache = SQLiteResultCache(str(tmp_path / "cache.sqlite3"), touch_seconds=3600)
+    cache.set("a", "A")
+    stored = last_access(cache, "a")
+    cache.get("a")
+    assert last_access(cache, "a") == stored
+
+    cache._conn.execute("UPDATE result_cache SET last_access = ? WHERE key = 'a'", (stored - 7200,))
+    cache.get("a")
+    assert last_access(cache, "a") > stored - 7200
+
+
+def test_expired_entries_miss(tmp_path):
+    cache = SQLiteResultCache(str(tmp_path / "cache.sqlite3"), ttl_seconds=60)
+    cache.set("a", "A")
+    cache._conn.execute("UPDATE result_cache SET created_at = created_at - 120")
+    assert cache.get("a") is None
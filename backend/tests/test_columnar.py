@@ -0,0 +1,80 @@
+"""calculate_frame (the /process path) must produce exactly what calculate_records (the /process/stream path) does"""
+import copy
+import json
+import random
+
+import pytest
+
+import main
+from columnar import calculate_frame
+
+SEGMENTS = ["TW TP", "TW SAOD + COMP", "PVT CAR TP", "PVT CAR COMP + SAOD", "TAXI", "SCHOOL BUS", "GCV 3W", "Tractor", ""]
+PAYINS = [12, 27.5, 45, 80, 0, True, "35%", " 22 % ", "12-15%", "N/A", "", "abc", "101.5", [50], None]
+REMARKS = ["", "Upto 2 years", ["Other make", "New"], 5, None]
+FIELDS = {
+    "segment": SEGMENTS + [None, 7],
+    "policy_type": ["Comp", "TP", "SAOD", None],
+    "location": ["CLUSTER 1", "Mumbai", None, 401],
+    "payin": PAYINS,
+    "remark": REMARKS
+}
+
+
+def both_paths(policy_data: list) -> tuple:
+    """((calculated rows, parsed records) from the row path, the same from the columnar path)"""
+    row_records = copy.deepcopy(policy_data)
+    frame_records = copy.deepcopy(policy_data)
+    row = main.calculate_records(row_records)
+    frame = calculate_frame(frame_records, main.RULE_INDEX).to_dict('records')
+    return (row, row_records), (frame, frame_records)
+
+
+def random_records(rng: random.Random, count: int) -> list:
+    records = []
+    for _ in range(count):
+        record = {}
+        for field, values in FIELDS.items():
+            # A quarter of the keys are absent altogether
+            if rng.random() >= 0.25:
+                record[field] = rng.choice(values)
+        records.append(record)
+    return records
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_columnar_matches_row_path(seed):
+    records = random_records(random.Random(seed), 50)
+    row, frame = both_paths(records)
+    assert frame == row
+
+
+def test_missing_and_null_keys_match_row_path():
+    records = [
+        {"segment": "TW TP", "policy_type": "Comp", "location": "A", "payin": "25%", "remark": "x"},
+        {"segment": "TW TP", "location": "B", "payin": 30},
+        {"segment": None, "policy_type": None, "location": None, "payin": None, "remark": None},
+        {}
+    ]
+    row, frame = both_paths(records)
+    assert frame == row
+    assert frame[0][1]["remark"] == ""
+    assert frame[0][1]["policy type"] == "Comp"
+    assert frame[0][2]["segment"] == "None"
+    assert frame[0][2]["policy type"] is None
+
+
+def test_partial_remarks_stay_json_compliant():
+    records = [
+        {"segment": "TW TP", "policy_type": "Comp", "location": "A", "payin": "25%", "remark": "x"},
+        {"segment": "TW TP", "policy_type": "Comp", "location": "B", "payin": "25%"}
+    ]
+    calculated = calculate_frame(records, main.RULE_INDEX).to_dict('records')
+    json.dumps(calculated, allow_nan=False)
+    assert [record["remark"] for record in calculated] == ["x", ""]
+
+
+def test_page_column_leads_multi_page_records():
+    records = [{"page": 1, "segment": "TAXI", "payin": 40}, {"page": 2, "segment": "TAXI", "payin": 10}]
+    row, frame = both_paths(records)
+    assert frame == row
+    assert list(frame[0][0])[0] == "page"
@@ -0,0 +1,59 @@
+"""Extraction history: recomputing stored payouts after a rules change"""
+import pytest
+
+import main
+from history import HistoryStore
+from rules import compile_formula_data
+
+
+def row(segment: str, payout: str, formula: str) -> dict:
+    return {"segment": segment, "policy type": "TP", "location": "Pune", "remark": "",
+            "Calculated Payout": payout, "Formula Used": formula}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(str(tmp_path / "history.sqlite3"))
+
+
+@pytest.fixture
+def corrected_rules():
+    """TW TP above 50% pays -4% instead of -3%"""
+    return compile_formula_data([
+        dict(rule, PO="-4%") if rule["SEGMENT"] == "TW TP" and rule["REMARKS"] == "Payin Above 50%" else rule
+        for rule in main.FORMULA_DATA
+    ])
+
+
+def rules_versions(store: HistoryStore) -> dict:
+    return dict(store._conn.execute("SELECT filename, rules_version FROM runs"))
+
+
+def test_recompute_reports_changed_payouts(store, corrected_rules):
+    store.save("a", "Liberty", "a.png", [row("TW TP", "57.00%", "-3%"), row("TW TP", "21.00%", "-3%")], [60.0, 24.0], "old")
+    result = store.recompute(corrected_rules, "new")
+    assert result["summary"]["changed_records"] == 1
+    assert result["diff"].iloc[0][["old_payout", "new_payout", "new_formula"]].tolist() == [57.0, 56.0, "-4%"]
+
+
+def test_unparsed_and_failed_records_are_left_alone(store, corrected_rules):
+    rows = [row("TW TP", "57.00%", "-3%"), row("TW TP", "0.00%", "-2%"), row("TW TP", "Error", "Error")]
+    store.save("a", "Liberty", "a.png", rows, [60.0, None, 60.0], "old")
+
+    result = store.recompute(corrected_rules, "new", apply=True)
+    assert result["summary"]["skipped_records"] == 2
+    assert result["diff"]["position"].tolist() == [0]
+    stored = store.load()
+    assert stored["payout"].tolist()[0] == 56.0
+    assert stored["payin"].isna().tolist() == [False, True, False]
+    assert stored["formula"].tolist()[1:] == ["-2%", "Error"]
+
+
+def test_apply_versions_only_recomputed_runs(store, corrected_rules):
+    store.save("a", "Liberty", "a.png", [row("TW TP", "57.00%", "-3%")], [60.0], "old")
+    store.save("b", "Liberty", "b.png", [row("TW TP", "Error", "Error")], [60.0], "old")
+    store.save("c", "Liberty", "c.png", [row("TW TP", "0.00%", "-2%")], [None], "old")
+
+    summary = store.recompute(corrected_rules, "new", apply=True)["summary"]
+    assert summary["updated_runs"] == 1
+    assert rules_versions(store) == {"a.png": "new", "b.png": "old", "c.png": "old"}
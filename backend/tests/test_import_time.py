@@ -0,0 +1,15 @@
+"""Cold import of main stays fast and leaves the heavy libraries for first use (see bench/check_import_time.py)"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench"))
+
+from check_import_time import LAZY_MODULES, measure_import
+
+IMPORT_BUDGET_MS = 1500
+
+
+def test_main_imports_within_budget_without_heavy_modules():
+    total_us, packages = measure_import("main")
+    assert not set(LAZY_MODULES) & packages
+    assert total_us / 1000 <= IMPORT_BUDGET_MS
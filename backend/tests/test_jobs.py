@@ -0,0 +1,154 @@
+"""Job queue: claims, retries, and getting orphaned jobs back on the queue"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from jobs import FAILED, JOB_MAX_ATTEMPTS, QUEUED, RUNNING, SUCCEEDED, JobStore, JobWorkerPool
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def submit(store: JobStore) -> str:
+    return store.submit(b"image", "card.png", "image/png", "Acme")
+
+
+def age(store: JobStore, job_id: str, seconds: float):
+    """Pretend the job's worker last touched it `seconds` ago"""
+    store._conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time() - seconds, job_id))
+
+
+def test_claim_is_exclusive(store):
+    job_id = submit(store)
+    job = store.claim_next()
+    assert job["id"] == job_id and job["attempts"] == 1
+    assert store.claim_next() is None
+    assert store.get(job_id)["status"] == RUNNING
+
+
+def test_requeue_stale_only_takes_untouched_jobs(store):
+    stale, fresh = submit(store), submit(store)
+    store.claim_next()
+    store.claim_next()
+    age(store, stale, 300)
+
+    assert store.requeue_stale(120) == 1
+    assert store.get(stale)["status"] == QUEUED
+    assert store.get(fresh)["status"] == RUNNING
+
+
+def test_heartbeat_keeps_a_running_job(store):
+    job_id = submit(store)
+    store.claim_next()
+    age(store, job_id, 300)
+    store.heartbeat(job_id)
+    assert store.requeue_stale(120) == 0
+
+
+def test_job_that_keeps_losing_its_worker_fails(store):
+    job_id = submit(store)
+    store._conn.execute("UPDATE jobs SET attempts = ? WHERE id = ?", (JOB_MAX_ATTEMPTS - 1, job_id))
+    store.claim_next()
+    age(store, job_id, 300)
+    assert store.requeue_stale(120) == 0
+    assert store.get(job_id)["status"] == FAILED
+
+
+def test_sweep_reclaims_orphans_while_running(store):
+    """A job left running by another (dead) worker is picked up without a restart"""
+    orphan = submit(store)
+    store.claim_next()
+
+    async def handler(job, report_progress):
+        return {"ok": True}
+
+    async def scenario():
+        pool = JobWorkerPool(store, handler, concurrency=1, heartbeat_seconds=0.05, stale_seconds=0.2)
+        pool.start()
+        try:
+            for _ in range(100):
+                if store.get(orphan)["status"] == SUCCEEDED:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            await pool.stop()
+
+    asyncio.run(scenario())
+    job = store.get(orphan)
+    assert job["status"] == SUCCEEDED
+    assert job["attempts"] == 2
+
+
+def test_shutdown_requeues_the_running_job(store):
+    job_id = submit(store)
+    started = None
+
+    async def handler(job, report_progress):
+        started.set()
+        await asyncio.sleep(60)
+
+    async def scenario():
+        nonlocal started
+        started = asyncio.Event()
+        pool = JobWorkerPool(store, handler, concurrency=1, heartbeat_seconds=0.05)
+        pool.start()
+        await asyncio.wait_for(started.wait(), 5)
+        await pool.stop()
+
+    asyncio.run(scenario())
+    job = store.get(job_id)
+    assert job["status"] == QUEUED
+    assert job["attempts"] == 0
+
+
+def test_progress_is_written_off_the_event_loop(store, monkeypatch):
+    job_id = submit(store)
+    written = []
+    original = store.set_progress
+
+    def set_progress(job_id, progress):
+        assert threading.current_thread() is not threading.main_thread()
+        written.append(progress)
+        original(job_id, progress)
+
+    monkeypatch.setattr(store, "set_progress", set_progress)
+
+    async def handler(job, report_progress):
+        report_progress("extracting")
+        for _ in range(100):
+            if written:
+                break
+            await asyncio.sleep(0.01)
+        return {"ok": True}
+
+    async def scenario():
+        pool = JobWorkerPool(store, handler, concurrency=1, heartbeat_seconds=5)
+        pool.start()
+        try:
+            for _ in range(100):
+                if store.get(job_id)["status"] == SUCCEEDED:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            await pool.stop()
+
+    asyncio.run(scenario())
+    assert written == ["extracting"]
+    assert store.get(job_id)["progress"] == "done"
+
+
+def test_finished_jobs_are_deleted_after_retention(store):
+    done, failed, queued = submit(store), submit(store), submit(store)
+    store.succeed(done, {"excel_data": "x" * 100})
+    store.fail(failed, "boom")
+    for job_id in (done, failed, queued):
+        age(store, job_id, 3600)
+
+    assert store.delete_finished(600) == 2
+    assert store.get(done) is None and store.get(failed) is None
+    assert store.get(queued)["status"] == QUEUED
+    assert store.delete_finished(0) == 0
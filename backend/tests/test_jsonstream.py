@@ -0,0 +1,48 @@
+"""Model reply parsing: streamed arrays and salvaging cut-off or partly malformed replies"""
+import json
+
+import pytest
+
+from jsonstream import JSONArrayStreamParser, salvage_json_array
+
+RECORDS = [{"segment": "TW TP", "payin": "25%", "remark": "say \"hi\" [x]"}, {"segment": "TAXI", "payin": 40}]
+REPLY = "```json\n" + json.dumps(RECORDS) + "\n```"
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, len(REPLY)])
+def test_stream_parser_emits_each_record_once_complete(chunk_size):
+    parser = JSONArrayStreamParser()
+    records = []
+    for start in range(0, len(REPLY), chunk_size):
+        records.extend(parser.feed(REPLY[start:start + chunk_size]))
+    assert records == RECORDS
+    assert parser.finished
+
+
+def test_stream_parser_skips_a_malformed_record():
+    parser = JSONArrayStreamParser()
+    assert parser.feed('[{"a": 1}, {"b": 2,}, {"c": 3}]') == [{"a": 1}, {"c": 3}]
+    assert parser.skipped == 1
+
+
+def test_stream_parser_keeps_its_buffer_small():
+    parser = JSONArrayStreamParser()
+    parser.feed("[")
+    for record in RECORDS * 100:
+        parser.feed(json.dumps(record) + ", ")
+    assert len(parser.buffer) < 10
+    assert parser.count == 200
+
+
+def test_salvage_keeps_the_complete_records_of_a_cut_off_reply():
+    text = json.dumps(RECORDS)[:-20]
+    salvaged = salvage_json_array(text)
+    assert salvaged.records == RECORDS[:1]
+    assert not salvaged.complete
+    assert text[:salvaged.truncated_at].endswith("}")
+
+
+def test_salvage_complete_and_lone_object_replies():
+    assert salvage_json_array(REPLY) == (RECORDS, True, 0, REPLY.rindex("}") + 1)
+    assert salvage_json_array('{"segment": "TAXI"}').records == [{"segment": "TAXI"}]
+    assert salvage_json_array("Sorry, I cannot read this image.") == ([], False, 0, 0)
@@ -0,0 +1,53 @@
+"""Local OCR pre-checks: uploads that cannot be a known layout leave before any text is read"""
+import random
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw
+
+import ocr
+
+
+def encoded(image, fmt: str = "PNG") -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def ruled_table(width: int = 900, height: int = 440) -> Image.Image:
+    image = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    for y in range(20, height, 44):
+        draw.line([(20, y), (width - 20, y)], fill=0)
+        draw.text((30, y + 12), "RTO-Statename   52.5%", fill=0)
+    return image
+
+
+def test_photos_get_scaled_down_before_ocr():
+    photo = Image.new("RGB", (3000, 4000), (120, 110, 100))
+    for fmt in ("JPEG", "PNG"):
+        image = ocr.load_image(encoded(photo, fmt))
+        assert max(image.size) == ocr.LOCAL_OCR_MAX_LONG_EDGE
+        assert image.mode == "L"
+
+
+def test_small_scans_get_scaled_up():
+    assert max(ocr.load_image(encoded(ruled_table(500, 240))).size) == ocr.LOCAL_OCR_MIN_LONG_EDGE
+
+
+def test_only_clean_pages_look_like_documents():
+    rng = random.Random(0)
+    noisy = Image.new("L", (400, 300))
+    noisy.putdata([rng.randrange(60, 190) for _ in range(400 * 300)])
+    assert ocr.looks_like_document(ruled_table())
+    assert not ocr.looks_like_document(noisy)
+    assert not ocr.looks_like_document(Image.new("L", (400, 300), 255))
+    assert not ocr.looks_like_document(Image.new("L", (400, 300), 3))
+
+
+def test_non_documents_never_reach_the_engine(monkeypatch):
+    monkeypatch.setattr(ocr, "LOCAL_OCR", "auto")
+    monkeypatch.setattr(ocr, "ocr_engine", lambda: "rapidocr")
+    monkeypatch.setattr(ocr, "read_text_boxes", lambda image: pytest.fail("OCR ran on a non-document"))
+    monkeypatch.setattr(ocr, "has_location_header", lambda image: pytest.fail("OCR ran on a non-document"))
+    assert ocr.extract_local(encoded(Image.new("RGB", (3000, 4000), (120, 110, 100)), "JPEG")) is None
@@ -0,0 +1,46 @@
+"""Tiling: when images are split, and how the tiles' records are merged back"""
+from io import BytesIO
+
+from PIL import Image
+
+import tiling
+
+
+def png(width: int, height: int) -> bytes:
+    buffer = BytesIO()
+    Image.new("L", (width, height), 255).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_preprocessed_photo_is_not_tiled_by_height_alone(monkeypatch):
+    monkeypatch.setattr(tiling, "TILED_EXTRACTION", "auto")
+    portrait = png(1536, 2048)
+    assert not tiling.should_tile(portrait)
+    assert not tiling.should_tile(portrait, rows=12)
+
+
+def test_long_tables_and_very_tall_images_are_tiled(monkeypatch):
+    monkeypatch.setattr(tiling, "TILED_EXTRACTION", "auto")
+    assert tiling.should_tile(png(1536, 2048), rows=tiling.TILE_MIN_ROWS)
+    assert tiling.should_tile(png(1000, tiling.TILE_MIN_HEIGHT))
+    # Too short to split, however many rows it holds
+    assert not tiling.should_tile(png(1000, tiling.TILE_HEIGHT), rows=100)
+
+
+def test_merge_drops_only_the_rows_repeated_at_a_seam():
+    first = [{"location": "A", "payin": 10}, {"location": "B", "payin": 20}, {"location": "C", "payin": 30}]
+    second = [{"location": "B", "payin": 20}, {"location": "C", "payin": 30}, {"location": "D", "payin": 40}]
+    merged = tiling.merge_tile_records([first, second])
+    assert [record["location"] for record in merged] == ["A", "B", "C", "D"]
+
+
+def test_merge_matches_rows_loosely_and_keeps_repeats_inside_a_tile():
+    first = [{"location": "A", "payin": 10}, {"location": "A", "payin": 10}, {"location": "B", "payin": "20%"}]
+    second = [{"Location": " b ", "payin": "20%"}, {"location": "C", "payin": 30}]
+    merged = tiling.merge_tile_records([first, second])
+    assert [record.get("location") for record in merged] == ["A", "A", "B", "C"]
+
+
+def test_merge_survives_an_empty_tile():
+    rows = [{"location": "A"}]
+    assert tiling.merge_tile_records([rows, [], rows]) == rows
@@ -0,0 +1,50 @@
+"""Upload handling: request-scoped disk spooling and the shared memory budget"""
+from io import BytesIO
+
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+from PIL import Image
+from starlette.formparsers import MultiPartParser
+
+import uploads
+
+
+def spool_app() -> FastAPI:
+    app = FastAPI()
+    app.router.route_class = uploads.UploadRoute
+
+    @app.post("/upload")
+    async def upload(policy_file: UploadFile = File(...)):
+        return {"on_disk": policy_file.file._rolled, "size": policy_file.size}
+
+    return app
+
+
+def test_upload_routes_spool_past_the_threshold(monkeypatch):
+    monkeypatch.setattr(uploads.SpoolingMultiPartParser, "spool_max_size", 1000)
+    client = TestClient(spool_app())
+    assert client.post("/upload", files={"policy_file": ("small.png", b"x" * 100)}).json()["on_disk"] is False
+    assert client.post("/upload", files={"policy_file": ("big.png", b"x" * 5000)}).json() == {"on_disk": True, "size": 5000}
+
+
+def test_spooling_leaves_other_forms_alone(monkeypatch):
+    monkeypatch.setattr(uploads.SpoolingMultiPartParser, "spool_max_size", 1000)
+    other = FastAPI()
+
+    @other.post("/upload")
+    async def upload(policy_file: UploadFile = File(...)):
+        return {"on_disk": policy_file.file._rolled}
+
+    client = TestClient(other)
+    assert client.post("/upload", files={"policy_file": ("big.png", b"x" * 5000)}).json()["on_disk"] is False
+    assert MultiPartParser.spool_max_size == 1024 * 1024
+
+
+def test_tiled_payload_keeps_room_for_its_tiles():
+    buffer = BytesIO()
+    Image.new("L", (1200, 2400), 255).save(buffer, format="PNG")
+    payload = buffer.getvalue()
+    single = uploads.payload_memory(payload)
+    assert single == uploads.PAYLOAD_COPIES * len(payload)
+    # The payload decoded again for cutting, and every tile's encodings in flight at once
+    assert uploads.payload_memory(payload, tiled=True) >= single + uploads.DECODE_COPIES * 1200 * 2400
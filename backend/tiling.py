@@ -0,0 +1,123 @@
+"""Split tall rate-card images into overlapping tiles and merge their records"""
+import logging
+import os
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+# off: never tile, auto: tile very tall images and long tables (and retry tiled when a single reply is
+# unusable), always: tile whenever possible
+TILED_EXTRACTION = os.getenv("TILED_EXTRACTION", "auto").lower()
+TILE_HEIGHT = int(os.getenv("TILE_HEIGHT", "1000"))
+TILE_OVERLAP = int(os.getenv("TILE_OVERLAP", "140"))
+TILE_HEADER_HEIGHT = int(os.getenv("TILE_HEADER_HEIGHT", "160"))
+# Every tile is a model call of its own: three tiles cost about three times the tokens and latency
+# of one call. Pre-processing caps the long edge at 2048, so by height alone only images sent at
+# full size are tiled; the rest are tiled when layout detection counts at least TILE_MIN_ROWS rows.
+TILE_MIN_HEIGHT = int(os.getenv("TILE_MIN_HEIGHT", "3000"))
+TILE_MIN_ROWS = int(os.getenv("TILE_MIN_ROWS", "40"))
+# How far back across a seam we look for rows both tiles extracted
+TILE_MAX_SEAM_RECORDS = int(os.getenv("TILE_MAX_SEAM_RECORDS", "48"))
+
+# Part of the extraction cache key
+TILING_VERSION = f"{TILED_EXTRACTION}:{TILE_HEIGHT}:{TILE_OVERLAP}:{TILE_HEADER_HEIGHT}:{TILE_MIN_HEIGHT}:{TILE_MIN_ROWS}"
+
+TILE_PROMPT_SUFFIX = """
+
+TILED INPUT:
+This image is one horizontal slice of a taller table. The top band repeats the table header
+so you know the columns. Extract every data row that is fully visible in this slice and skip
+any row that is cut off at the top or bottom edge (a neighbouring slice contains it in full).
+"""
+
+
+def image_height(image_bytes: bytes) -> int:
+    """Pixel height of an encoded image, 0 when it cannot be decoded"""
+    try:
+        from PIL import Image
+        with Image.open(BytesIO(image_bytes)) as image:
+            return image.height
+    except Exception:
+        return 0
+
+
+def split_into_tiles(image_bytes: bytes, tile_height: int = TILE_HEIGHT, overlap: int = TILE_OVERLAP,
+                     header_height: int = TILE_HEADER_HEIGHT) -> list:
+    """Cut an image into overlapping horizontal PNG tiles, repeating the header band on each"""
+    from PIL import Image
+
+    image = Image.open(BytesIO(image_bytes))
+    image.load()
+    width, height = image.size
+    header_height = min(header_height, height // 4)
+    if height <= tile_height + overlap:
+        return [image_bytes]
+
+    header = image.crop((0, 0, width, header_height))
+    body_height = tile_height - header_height
+    step = body_height - overlap
+    if step <= 0:
+        raise ValueError("TILE_HEIGHT must exceed TILE_HEADER_HEIGHT + TILE_OVERLAP")
+
+    tiles = []
+    top = header_height
+    while top < height:
+        bottom = min(height, top + body_height)
+        if top == header_height:
+            tile = image.crop((0, 0, width, bottom))
+        else:
+            tile = Image.new(image.mode, (width, header_height + bottom - top), "white")
+            tile.paste(header, (0, 0))
+            tile.paste(image.crop((0, top, width, bottom)), (0, header_height))
+        buffer = BytesIO()
+        tile.save(buffer, format="PNG")
+        tiles.append(buffer.getvalue())
+        if bottom >= height:
+            break
+        top += step
+
+    logger.info(f"🧩 Split {width}x{height} image into {len(tiles)} tiles")
+    return tiles
+
+
+def should_tile(image_bytes: bytes, rows: int = None) -> bool:
+    """Whether the configured mode wants this image tiled up front; rows is the detected row count, if any"""
+    if TILED_EXTRACTION == "always":
+        return image_height(image_bytes) > TILE_HEIGHT + TILE_OVERLAP
+    if TILED_EXTRACTION == "auto":
+        height = image_height(image_bytes)
+        if height >= TILE_MIN_HEIGHT:
+            return True
+        return rows is not None and rows >= TILE_MIN_ROWS and height > TILE_HEIGHT + TILE_OVERLAP
+    return False
+
+
+def can_tile(image_bytes: bytes) -> bool:
+    """Whether the image may end up tiled, up front or as the retry of an unusable single reply"""
+    return TILED_EXTRACTION != "off" and image_height(image_bytes) > TILE_HEIGHT + TILE_OVERLAP
+
+
+def _record_key(record) -> tuple:
+    if not isinstance(record, dict):
+        return (str(record),)
+    return tuple(sorted((str(k).lower(), str(v).strip().lower()) for k, v in record.items()))
+
+
+def merge_tile_records(tile_records: list, max_seam_records: int = TILE_MAX_SEAM_RECORDS) -> list:
+    """Concatenate per-tile records in order, dropping rows repeated across each seam.
+
+    Only the overlap at a seam is deduplicated (the longest run at the end of
+    the merged list that equals the start of the next tile), so rows that are
+    genuinely repeated inside the table are kept as-is.
+    """
+    merged = []
+    for records in tile_records:
+        keys = [_record_key(r) for r in records]
+        merged_keys = [_record_key(r) for r in merged[-max_seam_records:]]
+        overlap = 0
+        for size in range(min(len(merged_keys), len(keys)), 0, -1):
+            if merged_keys[-size:] == keys[:size]:
+                overlap = size
+                break
+        merged.extend(records[overlap:])
+    return merged
@@ -0,0 +1,322 @@
+"""Bounded-memory upload handling: streamed size limits, disk spooling and a shared memory budget"""
+import asyncio
+import contextvars
+import logging
+import os
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from io import BytesIO
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import FormData
+from starlette.exceptions import HTTPException
+from starlette.formparsers import MultiPartException, MultiPartParser
+from starlette.requests import Request
+
+from pages import PAGE_MAX_CONCURRENCY, is_pdf, page_count, rendered_page_size
+from preprocess import IMAGE_GRAYSCALE, IMAGE_MAX_LONG_EDGE, IMAGE_PREPROCESS
+from telemetry import record_memory
+
+logger = logging.getLogger(__name__)
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 2 ** 20)))
+# Several files (or ZIP archives) in one /process/batch request
+MAX_BATCH_UPLOAD_BYTES = int(os.getenv("MAX_BATCH_UPLOAD_BYTES", str(200 * 2 ** 20)))
+# File parts above this are spooled to a temporary file while the request body streams in
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(2 ** 20)))
+# Decoded pixels, upload bytes and model payloads of all in-flight uploads together; 0 = unbounded.
+# RSS only follows it when glibc returns large frees to the OS (MALLOC_MMAP_THRESHOLD_=1048576)
+UPLOAD_MEMORY_BUDGET_BYTES = int(os.getenv("UPLOAD_MEMORY_BUDGET_BYTES", str(256 * 2 ** 20)))
+
+# Room for the multipart boundaries and form fields next to the file itself
+FORM_OVERHEAD_BYTES = 64 * 1024
+# Measured peaks: pre-processing holds ~3x the decoded frame (frame, grayscale copy, crop mask);
+# sending holds ~4x the payload (base64 data URL, then the SDK's JSON body as str and bytes)
+DECODE_COPIES = 3
+PAYLOAD_COPIES = 4
+
+
+
+class UploadTooLarge(Exception):
+    """An upload (or a file inside a ZIP) over its size limit; answered with 413"""
+
+
+class SpoolingMultiPartParser(MultiPartParser):
+    """Starlette's parser with our spooling threshold (Starlette reads it off the class, not per call)"""
+
+    spool_max_size = UPLOAD_SPOOL_BYTES
+
+
+class SpoolingRequest(Request):
+    """Request whose multipart form spools file parts over UPLOAD_SPOOL_BYTES to disk"""
+
+    async def _get_form(self, *, max_files: int | float = 1000, max_fields: int | float = 1000,
+                        max_part_size: int = 1024 * 1024) -> FormData:
+        if self._form is None and self.headers.get("Content-Type", "").startswith("multipart/form-data"):
+            parser = SpoolingMultiPartParser(
+                self.headers, self.stream(), max_files=max_files, max_fields=max_fields, max_part_size=max_part_size
+            )
+            try:
+                self._form = await parser.parse()
+            except MultiPartException as exc:
+                raise HTTPException(status_code=400, detail=exc.message)
+        return await super()._get_form(max_files=max_files, max_fields=max_fields, max_part_size=max_part_size)
+
+
+class UploadRoute(APIRoute):
+    """Route class for this app's endpoints: forms are parsed with SpoolingRequest.
+
+    Scoped to the app's own routes, so other Starlette forms in the process keep their defaults.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def spooling_handler(request: Request):
+            return await handler(SpoolingRequest(request.scope, request.receive))
+
+        return spooling_handler
+
+
+def upload_size(upload) -> int:
+    """Size of a parsed UploadFile, without reading it into memory"""
+    if upload.size is not None:
+        return upload.size
+    position = upload.file.tell()
+    upload.file.seek(0, os.SEEK_END)
+    size = upload.file.tell()
+    upload.file.seek(position)
+    return size
+
+
+async def read_upload(upload, limit: int = MAX_UPLOAD_BYTES) -> bytes:
+    """The upload's bytes, refusing files over limit before reading them"""
+    size = upload_size(upload)
+    if size > limit:
+        raise UploadTooLarge(f"{upload.filename} is {size / 2 ** 20:.1f} MB, the limit is {limit / 2 ** 20:.0f} MB")
+    return await upload.read()
+
+
+def decoded_size(file) -> int:
+    """Bytes of the frames decoded at once, read from the headers only (0 if it is not an image or PDF).
+
+    Pages of a PDF or multi-frame TIFF are rendered concurrently, up to PAGE_MAX_CONCURRENCY.
+    """
+    try:
+        pages = min(page_count(file), PAGE_MAX_CONCURRENCY)
+    except ValueError:
+        pages = 1
+    if is_pdf(file):
+        return pages * rendered_page_size()
+    try:
+        from PIL import Image
+    except ImportError:
+        return 0
+    position = file.tell()
+    try:
+        with Image.open(file) as image:
+            return pages * image.width * image.height * len(image.getbands())
+    except Exception:
+        return 0
+    finally:
+        file.seek(position)
+
+
+def estimate_memory(size: int, decoded: int) -> int:
+    """Peak bytes one upload of `size` bytes (`decoded` once decoded) needs while it is processed"""
+    payload = size
+    if IMAGE_PREPROCESS and decoded:
+        # Pre-processing only ever sends something smaller than the upload
+        payload = min(size, IMAGE_MAX_LONG_EDGE ** 2 * (1 if IMAGE_GRAYSCALE else 3))
+    return size + max(DECODE_COPIES * decoded, PAYLOAD_COPIES * payload)
+
+
+def upload_memory(upload) -> int:
+    return estimate_memory(upload_size(upload), decoded_size(upload.file))
+
+
+def bytes_memory(file_bytes: bytes) -> int:
+    return estimate_memory(len(file_bytes), decoded_size(BytesIO(file_bytes)))
+
+
+def payload_memory(payload: bytes, tiled: bool = False) -> int:
+    """Peak bytes the pipeline needs for a pre-processed `payload` (on top of the upload itself).
+
+    Tiling decodes the payload again and sends all of its tiles, about one more
+    payload's worth of encodings, at the same time.
+    """
+    amount = PAYLOAD_COPIES * len(payload)
+    if tiled:
+        amount += DECODE_COPIES * decoded_size(BytesIO(payload)) + PAYLOAD_COPIES * len(payload)
+    return amount
+
+
+# The reservation of the request being processed, so the pipeline can hand back what it no longer needs
+_current_reservation = contextvars.ContextVar("memory_reservation", default=None)
+
+
+class Reservation:
+    """Bytes held against a MemoryBudget; entering it makes it the current request's reservation"""
+
+    def __init__(self, budget: "MemoryBudget", amount: int):
+        self.budget = budget
+        self.amount = amount
+        self._token = None
+
+    def shrink(self, amount: int):
+        """Keep only `amount` bytes reserved (never grows)"""
+        released = self.amount - max(0, amount)
+        if released > 0:
+            self.amount -= released
+            self.budget.release(released)
+
+    def release(self):
+        self.shrink(0)
+
+    def __enter__(self):
+        self._token = _current_reservation.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        _current_reservation.reset(self._token)
+        self.release()
+
+
+class MemoryBudget:
+    """FIFO byte budget: uploads wait (spooled on disk) until their estimated peak fits.
+
+    A single upload larger than the whole budget is admitted alone rather than
+    refused; the size limits are what bound that case.
+    """
+
+    def __init__(self, limit: int = UPLOAD_MEMORY_BUDGET_BYTES):
+        self.limit = limit
+        self.in_use = 0
+        self.peak = 0
+        self._waiters = deque()
+
+    async def acquire(self, amount: int) -> Reservation:
+        amount = min(amount, self.limit) if self.limit > 0 else 0
+        if not self._waiters and self.in_use + amount <= self.limit:
+            self._grant(amount)
+        elif amount:
+            future = asyncio.get_running_loop().create_future()
+            waiter = (amount, future)
+            self._waiters.append(waiter)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self.release(amount)
+                else:
+                    self._waiters.remove(waiter)
+                    self._wake()
+                raise
+        record_memory("reserved", amount)
+        return Reservation(self, amount)
+
+    @asynccontextmanager
+    async def reserve(self, amount: int):
+        """Hold `amount` bytes for the block, as the current reservation"""
+        with await self.acquire(amount) as reservation:
+            yield reservation
+
+    def release(self, amount: int):
+        self.in_use -= amount
+        self._wake()
+
+    def _grant(self, amount: int):
+        self.in_use += amount
+        self.peak = max(self.peak, self.in_use)
+
+    def _wake(self):
+        while self._waiters and self.in_use + self._waiters[0][0] <= self.limit:
+            amount, future = self._waiters.popleft()
+            if not future.done():
+                self._grant(amount)
+                future.set_result(None)
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "in_use": self.in_use, "peak": self.peak, "waiting": len(self._waiters)}
+
+
+def retain(amount: int):
+    """Shrink the current request's reservation once its decoding peak is over"""
+    reservation = _current_reservation.get()
+    if reservation is not None:
+        reservation.shrink(amount)
+
+
+@contextmanager
+def keep_reservation():
+    """Work inside which retain() does nothing, for one part (a page) of an upload whose other parts still need it"""
+    token = _current_reservation.set(None)
+    try:
+        yield
+    finally:
+        _current_reservation.reset(token)
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware refusing request bodies over a per-path limit with 413, while they stream in.
+
+    A Content-Length over the limit is refused before any body is read; a
+    chunked body is cut off as soon as it passes the limit.
+    """
+
+    def __init__(self, app, limits: dict = None, default: int = MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES):
+        self.app = app
+        self.limits = limits or {}
+        self.default = default
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.limits.get(scope["path"], self.default)
+        headers = dict(scope["headers"])
+        try:
+            declared = int(headers.get(b"content-length", b"0"))
+        except ValueError:
+            declared = 0
+        if declared > limit:
+            await self._refuse(send, limit)
+            return
+
+        state = {"received": 0, "exceeded": False, "started": False}
+
+        async def limited_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+                if state["received"] > limit:
+                    state["exceeded"] = True
+                    raise UploadTooLarge(f"Request body over {limit} bytes")
+            return message
+
+        async def guarded_send(message):
+            # Whatever the app answers after the cut-off (usually a form parsing error) is replaced by the 413
+            if state["exceeded"]:
+                return
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            pass
+        if state["exceeded"] and not state["started"]:
+            await self._refuse(send, limit)
+
+    @staticmethod
+    async def _refuse(send, limit: int):
+        logger.warning(f"⚠️ Refused an upload over {limit / 2 ** 20:.1f} MB")
+        body = f'{{"error": "Upload too large (limit {limit / 2 ** 20:.0f} MB)"}}'.encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        })
+        await send({"type": "http.response.body", "body": body})